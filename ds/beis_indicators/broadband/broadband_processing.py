@@ -6,10 +6,10 @@ import logging
 import numpy as np
 import os
 import pandas as pd
-from urllib.request import urlretrieve
 from zipfile import ZipFile
 
 from beis_indicators import project_dir
+from beis_indicators.data.download import fetch_to
 from beis_indicators.utils.dir_file_management import save_indicator
 from beis_indicators.utils import chunks, camel_to_snake
 from beis_indicators.geo import NutsCoder, LepCoder
@@ -52,8 +52,7 @@ def get_broadband_data(year, extract=True, delete_raw=False):
     if not os.path.isdir(broadband_dir):
         os.mkdir(broadband_dir)
     fout = f'{broadband_dir}/{fname}.zip'
-    if not os.path.isfile(fout):
-        urlretrieve(url, fout)
+    fetch_to(url, fout)
 
     if extract:
         _compile_data(year, delete_raw=delete_raw)
@@ -5,44 +5,60 @@ import glob
 from beis_indicators import project_dir
 
 from beis_indicators.geo import NutsCoder, LepCoder
-from beis_indicators.indicators import points_to_indicator, save_indicator
+from beis_indicators.indicators import stream_points_to_indicator, save_indicator
 from beis_indicators.broadband.broadband_processing import get_broadband_data
 
 import pandas as pd
 
 logger = logging.getLogger(__name__)
 
+BROADBAND_DIR = f'{project_dir}/data/raw/broadband'
 
 
-coders = {
-    'nuts2': NutsCoder(level=2),
-    'nuts3': NutsCoder(level=3),
-    'lep': LepCoder()
-    }
+def read_speeds(files, chunksize=500000):
+    for f in files:
+        yield from pd.read_csv(f, chunksize=chunksize)
 
-BROADBAND_DIR = f'{project_dir}/data/raw/broadband'
 
+def main():
+    coders = {
+        'nuts2': NutsCoder(level=2),
+        'nuts3': NutsCoder(level=3),
+        'lep': LepCoder()
+        }
+
+    postcode_latlon = pd.read_csv(f'{project_dir}/data/raw/final_postcode_lat_lon.csv')
+
+    # MYDIR = (f'{project_dir}/data/raw/broadband')
+    # CHECK_FOLDER = os.path.isdir(MYDIR)
 
-postcode_latlon = pd.read_csv(f'{project_dir}/data/raw/final_postcode_lat_lon.csv')
+    years = [2014, 2015, 2016, 2017, 2018, 2019]
 
-# MYDIR = (f'{project_dir}/data/raw/broadband')
-# CHECK_FOLDER = os.path.isdir(MYDIR)
+    for year in years:
+        get_broadband_data(year)
 
-years = [2014, 2015, 2016, 2017, 2018, 2019]
+    # stream the yearly files in chunks rather than holding them all in memory
 
-for year in years:
-    get_broadband_data(year)
+    files = glob.glob(f'{BROADBAND_DIR}/*.csv')
 
-# read and concat
+    # NUTS2 is rolled up from NUTS3 so the chunks are only streamed once for NUTS
+    nuts_means = stream_points_to_indicator(read_speeds(files), value_col='speed',
+                    coder=coders['nuts3'], stat='mean',
+                    value_rename='broadband_download_speed_data',
+                    projection='EPSG:4326', x_col='longitude', y_col='latitude',
+                    n_jobs=-1, levels=[2, 3])
+    for level, broadband_mean in nuts_means.items():
+        save_indicator(broadband_mean, 'broadband', f'nuts{level}')
 
-files = glob.glob(f'{BROADBAND_DIR}/*.csv')
+    broadband_mean = stream_points_to_indicator(read_speeds(files), value_col='speed',
+                    coder=coders['lep'], stat='mean',
+                    value_rename='broadband_download_speed_data',
+                    projection='EPSG:4326', x_col='longitude', y_col='latitude',
+                    n_jobs=-1)
+    save_indicator(broadband_mean, 'broadband', 'lep')
 
-dfs = [pd.read_csv(f) for f in files]
-latlon_speeds = pd.concat(dfs, ignore_index=True)
 
-for geo, coder in coders.items():
-    broadband_mean = points_to_indicator(latlon_speeds, value_col='speed', coder=coder,
-                    aggfunc=np.mean, value_rename='broadband_download_speed_data',
-                    projection='EPSG:4326', x_col='longitude', y_col='latitude')
-    # save_indicator(funding_agg, 'cordis', geo)
-    save_indicator(broadband_mean, 'broadband', geo)
+# workers re-import this module when they are spawned, so the pipeline
+# only runs from the main process
+if __name__ == '__main__':
+    main()
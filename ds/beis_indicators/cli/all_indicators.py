@@ -11,7 +11,7 @@ import yaml
 
 
 from beis_indicators import project_dir
-from beis_indicators.geo import NutsCoder, LepCoder
+from beis_indicators.geo.regions import region_names
 
 
 @click.command()
@@ -126,44 +126,13 @@ def create_indicator_table(indicator_dir, schema_dir, geography):
 
 
 def apply_nuts_codes(df, level):
-    nuts = {}
-    nuts_coder = NutsCoder(level=level)
-    for year, regions in nuts_coder.shapes.items():
-        code_name_map = {}
-        for code, name in zip(regions['NUTS_ID'].values, regions['NUTS_NAME'].values):
-            code_name_map[code] = name
-        nuts[year] = code_name_map
-
-    def map_nuts_codes(year, code, var):
-        year = np.abs(year)
-        return nuts[year][code]
-
-    df['nuts_name'] = df.apply(
-            lambda row: map_nuts_codes(row['nuts_year'], row['nuts_id'], row['variable']),
-            axis=1
-            )
+    df['nuts_name'] = region_names(df['nuts_id'], df['nuts_year'], 'nuts',
+                                   level=level)
     return df
 
 
 def apply_lep_codes(df):
-    leps = {}
-    lep_coder = LepCoder()
-    for year, regions in lep_coder.shapes.items():
-        lep_year = str(year)[-2:]
-        name_col = f'lep{lep_year}nm'
-        code_name_map = {}
-        for code, name in zip(regions['lep_id'].values, regions[name_col].values):
-            code_name_map[code] = name
-        leps[year] = code_name_map
-
-    def map_lep_codes(year, code, var):
-        year = np.abs(year)
-        return leps[year][code]
-
-    df['lep_name'] = df.apply(
-            lambda row: map_lep_codes(row['lep_year'], row['lep_id'], row['variable']),
-            axis=1
-            )
+    df['lep_name'] = region_names(df['lep_id'], df['lep_year'], 'lep')
     return df
 
 
@@ -5,10 +5,10 @@ import logging
 import numpy as np
 import os
 import pandas as pd
-from urllib.request import urlretrieve
 from zipfile import ZipFile
 
 from beis_indicators import project_dir
+from beis_indicators.data.download import fetch, fetch_to
 from beis_indicators.utils.dir_file_management import save_indicator
 from beis_indicators.utils import chunks, camel_to_snake
 from beis_indicators.geo import NutsCoder, LepCoder
@@ -55,7 +55,7 @@ def get_cordis_projects(fp, extract=True, delete_raw=False):
     if not os.path.isdir(cordis_dir):
         os.mkdir(cordis_dir)
     fout = f'{cordis_dir}/{fname}'
-    urlretrieve(url, fout)
+    fetch_to(url, fout)
 
     if extract:
         _extract_projects(fp, delete_raw=delete_raw)
@@ -75,7 +75,7 @@ def get_cordis_dates(fp):
     read_opts = {"sep": ";", 
             "decimal": ",", 
             "parse_dates": ["startDate", "endDate"]}
-    df = pd.read_csv(url, **read_opts)
+    df = pd.read_csv(fetch(url), **read_opts)
     df = df[~pd.isnull(df['startDate'])]
     df['year'] = df['startDate'].dt.year.astype(int)
     df = df[['rcn', 'year']]
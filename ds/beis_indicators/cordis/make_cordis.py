@@ -2,7 +2,7 @@ import logging
 import numpy as np
 
 from beis_indicators.geo import NutsCoder, LepCoder
-from beis_indicators.indicators import points_to_indicator, save_indicator
+from beis_indicators.indicators import points_to_indicators, save_indicator
 from beis_indicators.cordis.cordis_processing import prep_funding_data
 
 import pandas as pd
@@ -27,9 +27,9 @@ funding = prep_funding_data(fps=['h2020'])
 funding = funding[(funding['year'] >= min_year) & (funding['year'] <= max_year)]
 funding = funding.dropna()
 
-for geo, coder in coders.items():
-    funding_agg = points_to_indicator(funding, value_col='ecContribution', coder=coder,
-                    aggfunc=aggfunc, value_rename=var_name,
-                    projection='EPSG:4326', x_col='lon', y_col='lat')
+funding_aggs = points_to_indicators(funding, value_col='ecContribution',
+                coders=coders, aggfunc=aggfunc, value_rename=var_name,
+                projection='EPSG:4326', x_col='lon', y_col='lat',
+                hierarchy=True)
+for geo, funding_agg in funding_aggs.items():
     save_indicator(funding_agg, 'cordis', geo)
-
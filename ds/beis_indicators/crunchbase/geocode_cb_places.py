@@ -7,7 +7,7 @@ from ast import literal_eval
 import pandas as pd
 
 import beis_indicators
-from beis_indicators.geo.reverse_geocoder import reverse_geocode
+from beis_indicators.geo.reverse_geocoder import multi_reverse_geocode, nuts_shapes
 from beis_indicators.utils.dir_file_management import *
 from beis_indicators.utils.nesta_utils import get_daps_data
 from dotenv import load_dotenv
@@ -51,18 +51,14 @@ places_df = get_daps_data('geographic_data',con)
 #Reverse geocoding
 #We focus on the last 2 periods as those are the ones for which we have data
 
-#TODO: turn the below into a function and put it into the reverse_geocoder.py script 
 nuts_targets = [2010,2013,2016]
 
-cb_places_nuts_list = [reverse_geocode(place_df=places_df,
-                        shape_name=f'nuts2_{str(y)}',
-                        shape_file=f'NUTS_RG_01M_{str(y)}_4326_LEVL_2.shp.zip',
+cb_places_nuts = multi_reverse_geocode(place_df=places_df,
+                        shapes=nuts_shapes(nuts_targets),
                         place_id='id',
-                        coord_names= ['longitude','latitude'])['NUTS_ID'] for y in nuts_targets]
+                        coord_names= ['longitude','latitude'])
 
-#Create a df and turn into a map
-cb_places_nuts = pd.concat(cb_places_nuts_list,axis=1)
-cb_places_nuts.columns = [f"nuts2_{str(y)}" for y in nuts_targets]
+#Turn into a map
 cb_places_dict = cb_places_nuts.to_dict(orient='index')
 
 #Save
@@ -1,7 +1,8 @@
 import geopandas as gpd
 import numpy as np
 import pandas as pd
-import pyproj
+
+from beis_indicators.geo.transform import transform_coordinates
 
 
 BASE_URL = 'https://uk-air.defra.gov.uk/datastore/pcm/map{}{}g.csv'
@@ -10,8 +11,8 @@ POLLUTION_TYPES = {
         'pm10': 'pm10',
         }
 
-BNG = pyproj.Proj('epsg:27700')
-WGS84 = pyproj.Proj('epsg:4326')
+BNG = 'EPSG:27700'
+WGS84 = 'EPSG:4326'
 
 
 def _get_modelled_data(pollution_type, year):
@@ -25,7 +26,8 @@ def _get_modelled_data(pollution_type, year):
     pollution_col = f'{pollution_type}{year}g'
     df = df.rename(columns={pollution_col: 'value'})
     df = df.dropna()
-    df['lat'], df['lon'] = pyproj.transform(BNG, WGS84, df['x'].values, df['y'].values)
+    df['lon'], df['lat'] = transform_coordinates(df['x'].values, df['y'].values,
+                                                 BNG, WGS84)
     df['year'] = year
     df = df[['year', 'lat', 'lon', 'value']]
     gdf = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df['lon'], df['lat']))
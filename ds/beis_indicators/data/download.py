@@ -0,0 +1,211 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import requests
+
+from beis_indicators import project_dir
+
+
+logger = logging.getLogger(__name__)
+
+# Downloads are stored once under the hash of their content, with an index
+# entry per URL recording the hash and the validators the server sent.
+# Setting BEIS_HTTP_CACHE points the pipeline at a pre-seeded cache, and
+# BEIS_OFFLINE=1 serves everything from it without touching the network.
+CACHE_DIR = os.environ.get('BEIS_HTTP_CACHE',
+                           f'{project_dir}/data/raw/http_cache')
+OFFLINE = os.environ.get('BEIS_OFFLINE', '').lower() in ('1', 'true', 'yes')
+CHUNK_SIZE = 1 << 20
+TIMEOUT = 60
+
+
+def _url_key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def _index_file(url, cache_dir):
+    return os.path.join(cache_dir, 'index', f'{_url_key(url)}.json')
+
+
+def _object_file(digest, cache_dir):
+    return os.path.join(cache_dir, 'objects', digest[:2], digest)
+
+
+def _atomic_write(fout, write):
+    '''_atomic_write
+    Writes a file through a temporary file in the same directory, so readers
+    only ever see the old or the complete new file.
+    '''
+    dirname = os.path.dirname(fout)
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp, fout)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def read_entry(url, cache_dir=None):
+    '''read_entry
+    Reads the cache index entry for a URL.
+
+    Returns:
+        entry (dict): The URL, content hash, ETag and Last-Modified headers
+            and fetch time, or None if the URL is not cached.
+    '''
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    fin = _index_file(url, cache_dir)
+    if not os.path.isfile(fin):
+        return None
+    with open(fin, 'r') as f:
+        entry = json.load(f)
+    if not os.path.isfile(_object_file(entry['sha256'], cache_dir)):
+        return None
+    return entry
+
+
+def _write_entry(entry, cache_dir):
+    data = json.dumps(entry, indent=2).encode('utf-8')
+    _atomic_write(_index_file(entry['url'], cache_dir),
+                  lambda f: f.write(data))
+
+
+def _download(url, entry, session, cache_dir):
+    '''_download
+    Requests a URL, conditionally on the cached entry's validators if there
+    is one, and stores the body. Returns the new or revalidated entry.
+    '''
+    headers = {}
+    if entry is not None:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    with session.get(url, headers=headers, stream=True,
+                     timeout=TIMEOUT) as response:
+        if response.status_code == 304 and entry is not None:
+            logger.info(f'Not modified: {url}')
+            entry['fetched'] = time.time()
+            return entry
+        response.raise_for_status()
+        logger.info(f'Downloading: {url}')
+
+        sha = hashlib.sha256()
+        objects_dir = os.path.join(cache_dir, 'objects')
+        os.makedirs(objects_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=objects_dir, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    sha.update(chunk)
+                    f.write(chunk)
+            digest = sha.hexdigest()
+            fout = _object_file(digest, cache_dir)
+            os.makedirs(os.path.dirname(fout), exist_ok=True)
+            os.replace(tmp, fout)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    return {'url': url,
+            'sha256': digest,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fetched': time.time()}
+
+
+def fetch(url, max_age=0, offline=None, session=None, cache_dir=None):
+    '''fetch
+    Returns the local path of a URL's content, downloading it only if it is
+    not cached or the server reports that it has changed.
+
+    Cached URLs are revalidated with a conditional request using the ETag
+    and Last-Modified headers from the last download, so unchanged files
+    cost one round trip and no transfer. If the server can't be reached,
+    the cached copy is served with a warning.
+
+    Args:
+        url (str): URL to fetch.
+        max_age (float): Seconds after a download or revalidation during
+            which the cached copy is used without contacting the server.
+            None never revalidates once a URL is cached.
+        offline (bool): Serve only from the cache. Defaults to `OFFLINE`.
+        session (requests.Session, optional): Session to make requests with.
+        cache_dir (str): Cache directory. Defaults to `CACHE_DIR`.
+
+    Returns:
+        (str): Path of the cached content. This is shared between URLs with
+            identical content and must not be modified.
+
+    Raises:
+        FileNotFoundError: If offline and the URL is not cached.
+    '''
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    offline = OFFLINE if offline is None else offline
+    session = requests if session is None else session
+
+    entry = read_entry(url, cache_dir)
+    if entry is not None:
+        fresh = max_age is None or time.time() - entry['fetched'] < max_age
+        if offline or fresh:
+            return _object_file(entry['sha256'], cache_dir)
+    elif offline:
+        raise FileNotFoundError(f'{url} is not in the cache at {cache_dir} '
+                                'and downloads are disabled')
+
+    try:
+        entry = _download(url, entry, session, cache_dir)
+    except requests.ConnectionError:
+        if entry is None:
+            raise
+        logger.warning(f'Could not reach {url}, using the cached copy')
+        return _object_file(entry['sha256'], cache_dir)
+
+    _write_entry(entry, cache_dir)
+    return _object_file(entry['sha256'], cache_dir)
+
+
+def fetch_to(url, fout, **kwargs):
+    '''fetch_to
+    Fetches a URL through the cache and writes its content to `fout`, for
+    code that expects a download at a particular path. `fout` is only
+    rewritten if the content has changed.
+
+    Args:
+        url (str): URL to fetch.
+        fout (str): Path to write the content to.
+        kwargs: Passed to `fetch`.
+
+    Returns:
+        (str): `fout`
+    '''
+    fin = fetch(url, **kwargs)
+    if os.path.isfile(fout) and _same_content(fin, fout):
+        return fout
+
+    def copy(f):
+        with open(fin, 'rb') as src:
+            shutil.copyfileobj(src, f, CHUNK_SIZE)
+    _atomic_write(fout, copy)
+    return fout
+
+
+def _same_content(a, b):
+    if os.path.getsize(a) != os.path.getsize(b):
+        return False
+    sha = hashlib.sha256()
+    with open(b, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest() == os.path.basename(a)
@@ -1,7 +1,7 @@
 import pandas as pd 
 import numpy as np
-import requests
 import beis_indicators
+from beis_indicators.data.download import fetch, fetch_to
 import os
 import logging
 from beis_indicators.utils.dir_file_management import make_indicator, save_indicator
@@ -19,12 +19,9 @@ logging.info("Collecting data")
 # We get a 403 when we try to open directly with pandas so we save it in raw 
 # & load it
 
-file = requests.get(
-    "https://www.ons.gov.uk/file?uri=%2fpeoplepopulationandcommunity%2fpopulationandmigration%2fmigrationwithintheuk%2fdatasets%2flocalareamigrationindicatorsunitedkingdom%2fcurrent/lamis2020final.xlsx")
-
-#Save it
-with open(f'{project_dir}/data/raw/migration.xls','wb') as outfile:
-    outfile.write(file.content)
+fetch_to(
+    "https://www.ons.gov.uk/file?uri=%2fpeoplepopulationandcommunity%2fpopulationandmigration%2fmigrationwithintheuk%2fdatasets%2flocalareamigrationindicatorsunitedkingdom%2fcurrent/lamis2020final.xlsx",
+    f'{project_dir}/data/raw/migration.xls')
 
 # Read the file
 migration = pd.read_excel(f'{project_dir}/data/raw/migration.xls',sheet_name=1,header=None)
@@ -103,7 +100,7 @@ laua_nuts = nspl.drop_duplicates(
 
 # Get the lad to many different nuts lookup
 lad_nuts_lookup = pd.read_csv(
-        'https://opendata.arcgis.com/datasets/10abfc7a2fb249caa13ed345fe756e4e_0.csv')
+        fetch('https://opendata.arcgis.com/datasets/10abfc7a2fb249caa13ed345fe756e4e_0.csv'))
 
 # Create the lad to nuts lookup
 new_lookup = pd.merge(laua_nuts,lad_nuts_lookup,
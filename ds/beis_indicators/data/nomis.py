@@ -7,17 +7,42 @@ Collect official data from the NOMIS API, using configuration files.
 
 import requests
 from collections import Counter
-from io import StringIO
+import glob
+import hashlib
+import json
+import os
 import pandas as pd
 from collections import defaultdict
 import re
+import shutil
 import logging
 import datetime
 import configparser
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from beis_indicators import project_dir
+from beis_indicators.data.download import fetch
+from beis_indicators.nomis.reader import ColumnBuffer, read_typed_page
 
 NOMIS = "http://www.nomisweb.co.uk/api/v01/dataset/{}"
 NOMIS_DEF = NOMIS.format("{}def.sdmx.json")
 REGEX = re.compile(r"(\w+)_code$")
+DISCOVERY_DIR = f"{project_dir}/data/interim/nomis_discovery"
+# Discovery metadata rarely changes, so it is only refreshed monthly
+DISCOVERY_TTL = 30 * 24 * 60 * 60
+
+# Geography type indexes already loaded in this process
+_GEOGRAPHY_INDEX = {}
+
+# Pages of batch downloads are staged here until the download is finished
+STAGING_DIR = f"{project_dir}/data/interim/nomis_staging"
+PAGE_SIZE = 25000
+# Staged downloads are started again once they are older than this, as
+# NOMIS revises datasets between releases
+STAGE_TTL = 7 * 24 * 60 * 60
 
 
 def get_config(conf_path):
@@ -77,11 +102,117 @@ def reformat_nomis_columns(data):
     # Append this pair of values
     return tables
 
+def _stage_dir(config, dataset_id, date_format, staging_dir):
+    """Staging directory of a download, keyed by dataset, query and geography
+    batch, so each distinct request resumes from its own pages."""
+    key = {k: str(v) for k, v in config.items() if k != "RecordOffset"}
+    key["dataset"] = dataset_id
+    key["date_format"] = date_format
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8"))
+    return os.path.join(staging_dir, dataset_id, digest.hexdigest()[:16])
+
+
+def _read_manifest(stage):
+    """Progress of a staged download. `pages` maps the offset of each staged
+    page to its number of rows, `end` is set once the last page is in and
+    `started` is when the first page was requested."""
+    fin = os.path.join(stage, "manifest.json")
+    if not os.path.isfile(fin):
+        return {"pages": {}, "end": None, "compacted": False,
+                "started": time.time()}
+    with open(fin, "r") as f:
+        return json.load(f)
+
+
+def _is_stale(manifest, max_age):
+    """Whether a staged download is older than `max_age` seconds. None
+    never expires a stage."""
+    if max_age is None:
+        return False
+    return time.time() - manifest.get("started", 0) >= max_age
+
+
+def _write_manifest(stage, manifest):
+    fout = os.path.join(stage, "manifest.json")
+    with open(f"{fout}.part", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f"{fout}.part", fout)
+
+
+def _page_file(stage, offset):
+    return os.path.join(stage, f"offset={offset:010d}.parquet")
+
+
+def _stage_page(stage, manifest, offset, df):
+    """Write a page to the staging area, then record it in the manifest"""
+    os.makedirs(stage, exist_ok=True)
+    fout = _page_file(stage, offset)
+    df.to_parquet(f"{fout}.part", index=False)
+    os.replace(f"{fout}.part", fout)
+    manifest["pages"][str(offset)] = len(df)
+    if len(df) < PAGE_SIZE:
+        manifest["end"] = offset + PAGE_SIZE
+    _write_manifest(stage, manifest)
+
+
+def _read_page(stage, manifest, offset):
+    """Read a staged page, or None if the page hasn't been fetched"""
+    if str(offset) not in manifest["pages"]:
+        return None
+    if manifest["compacted"]:
+        df = pd.read_parquet(os.path.join(stage, "data.parquet"),
+                             filters=[("page_offset", "==", offset)])
+        return df.drop(columns="page_offset")
+    return pd.read_parquet(_page_file(stage, offset))
+
+
+def _unify_dictionaries(schema):
+    """Use the same index type for every dictionary (categorical) column,
+    as pages with more categories get wider indices"""
+    return pa.schema([
+        field.with_type(pa.dictionary(pa.int32(), field.type.value_type))
+        if pa.types.is_dictionary(field.type) else field
+        for field in schema]).remove_metadata()
+
+
+def _compact(stage, manifest):
+    """Combine the staged pages of a finished download into one parquet file,
+    with a row group per page, and remove the pages"""
+    offsets = sorted(int(offset) for offset in manifest["pages"])
+    files = [_page_file(stage, offset) for offset in offsets]
+    schema = pa.unify_schemas(
+            [_unify_dictionaries(pq.read_schema(f)) for f in files])
+    schema = schema.append(pa.field("page_offset", pa.int64()))
+
+    fout = os.path.join(stage, "data.parquet")
+    with pq.ParquetWriter(f"{fout}.part", schema) as writer:
+        for offset, fin in zip(offsets, files):
+            table = pq.read_table(fin)
+            table = table.append_column(
+                    "page_offset", pa.array([offset] * len(table), pa.int64()))
+            writer.write_table(table.cast(schema))
+    os.replace(f"{fout}.part", fout)
+
+    manifest["compacted"] = True
+    _write_manifest(stage, manifest)
+    for fin in glob.glob(os.path.join(stage, "offset=*.parquet")):
+        os.remove(fin)
+
+
 def batch_request(config, dataset_id, geographies, date_format,
-                  record_offset=0, max_api_calls=10):
+                  record_offset=0, max_api_calls=10, staging_dir=STAGING_DIR,
+                  max_age=STAGE_TTL):
     """Fetch a NOMIS dataset from the API, in batches,
     based on a configuration object.
 
+    Every page is checkpointed to a staging area as soon as it arrives, so
+    if the download is interrupted, calling this again with the same
+    arguments reads the pages fetched so far from disk and only requests
+    the rest. Once the last page is in, the pages are compacted into a
+    single parquet file (see :obj:`read_download`). A download started
+    more than `max_age` seconds ago is discarded and fetched again when it
+    is next requested from the first record.
+
     Args:
         config (dict): Configuration object, from which a get
                        request is formed.
@@ -89,7 +220,10 @@ def batch_request(config, dataset_id, geographies, date_format,
         geographies (list): Return object from :obj:`discovery_iter`.
         date_format (str): Formatting string for dates in the dataset
         record_offset (int): Record to start from
-        max_api_calls (int): Number of requests allowed
+        max_api_calls (int): Number of pages to return
+        staging_dir (str): Directory where pages are staged
+        max_age (float): Seconds a staged download is reused for. 0 always
+                         fetches again and None reuses it forever.
     Returns:
         dfs (:obj:`list` of :obj:`pd.DataFrame`): Batch return results.
     """
@@ -97,34 +231,85 @@ def batch_request(config, dataset_id, geographies, date_format,
                                    for row in geographies)
     config["RecordOffset"] = record_offset
     date_parser = lambda x: pd.datetime.strptime(x, date_format)
-
-    # Build a list of dfs in chunks from the NOMIS API
-    dfs = []
-    offset = 25000
+    stage = _stage_dir(config, dataset_id, date_format, staging_dir)
+    manifest = _read_manifest(stage)
+    if record_offset == 0 and _is_stale(manifest, max_age):
+        # Later batches of this download resume from the new stage
+        shutil.rmtree(stage, ignore_errors=True)
+        manifest = _read_manifest(stage)
+
+    # Collect chunks from the staging area or the NOMIS API into one buffer
+    buffer = None
+    offset = PAGE_SIZE
     icalls = 0
     done = False
     while (not done) and icalls < max_api_calls:
-        #logging.debug(f"\t\t {offset}")
-        # Build the request payload
-        params = "&".join(f"{k}={v}" for k,v in config.items())
-        # Hit the API
-        r = requests.get(NOMIS.format(f"{dataset_id}.data.csv"), params=params)
-        # Read the data
-        with StringIO(r.text) as sio:
-            _df = pd.read_csv(sio, parse_dates=["DATE"], date_parser=date_parser)
-            done = len(_df) < offset
+        _df = _read_page(stage, manifest, config["RecordOffset"])
+        if _df is None:
+            #logging.debug(f"\t\t {offset}")
+            # Build the request payload
+            params = "&".join(f"{k}={v}" for k,v in config.items())
+            # Hit the API and stream the data into a typed table
+            with requests.get(NOMIS.format(f"{dataset_id}.data.csv"),
+                              params=params, stream=True) as r:
+                r.raise_for_status()
+                _df = read_typed_page(r, parse_dates=["DATE"],
+                                      date_parser=date_parser)
+            _stage_page(stage, manifest, config["RecordOffset"], _df)
+        done = len(_df) < offset
         # Increment the offset
         config["RecordOffset"] += offset
         # Ignore empty fields
-        dfs.append(_df.loc[_df.OBS_VALUE > 0])
+        if buffer is None:
+            # Size the buffer from RECORD_COUNT where the dataset has it
+            size = len(_df)
+            if "RECORD_COUNT" in _df.columns and len(_df) > 0:
+                size = min(_df.RECORD_COUNT.iloc[0] - record_offset,
+                           offset * max_api_calls)
+            buffer = ColumnBuffer(max(size, len(_df)))
+        buffer.append(_df.loc[_df.OBS_VALUE > 0])
         icalls += 1
 
-    # Combine and return
-    df = pd.concat(dfs)
+    if done and not manifest["compacted"]:
+        _compact(stage, manifest)
+
+    # Return the rows collected in the buffer
+    df = buffer.to_frame()
     df.columns = [c.lower() for c in df.columns]
     return df, done, config["RecordOffset"]
 
 
+def read_download(config, dataset_id, geographies, date_format,
+                  staging_dir=STAGING_DIR, max_age=STAGE_TTL):
+    """Read a finished :obj:`batch_request` download from its compacted file.
+
+    Args:
+        config (dict): Configuration object the download was made with.
+        dataset_id (str): NOMIS dataset ID
+        geographies (list): Return object from :obj:`discovery_iter`.
+        date_format (str): Formatting string for dates in the dataset
+        staging_dir (str): Directory where pages are staged
+        max_age (float): Seconds a staged download is reused for, as in
+                         :obj:`batch_request`.
+    Returns:
+        df (:obj:`pd.DataFrame`): Every row with a positive value, or None
+                                  if the download hasn't finished or is
+                                  older than `max_age`.
+    """
+    config = dict(config)
+    config["geography"] = ",".join(str(row["nomis_id"])
+                                   for row in geographies)
+    stage = _stage_dir(config, dataset_id, date_format, staging_dir)
+    manifest = _read_manifest(stage)
+    if not manifest["compacted"] or _is_stale(manifest, max_age):
+        return None
+    df = pd.read_parquet(os.path.join(stage, "data.parquet"),
+                         filters=[("OBS_VALUE", ">", 0)])
+    df = df.drop(columns="page_offset")
+    df.columns = [c.lower() for c in df.columns]
+    return df
+
+
 
 def process_config(config_filename, test=False):
     """Fetch a NOMIS dataset from the API based on a configuration file.
@@ -165,20 +350,23 @@ def jaccard_repeats(a, b):
     return 1 - n/(len(a) + len(b) - n)
 
 
-def discovery_iter(dataset_id):
+def discovery_iter(dataset_id, max_age=DISCOVERY_TTL):
     """Iterate through the NOMIS discovery API
 
+    Responses are kept in the download cache and only requested again once
+    they are older than `max_age`.
+
     Args:
         dataset_id (str): ID of the dataset to inspect, which fits into the API request
                           as http://www.nomisweb.co.uk/api/v01/dataset/{dataset_id}def.sdmx.json.
+        max_age (float): Seconds a cached response is used for.
     Yields:
         _row_data (dict): A flattened row of discovery data.
     """
     # Hit the discovery API
-    r = requests.get(NOMIS_DEF.format(dataset_id))
-    r.raise_for_status()
+    with open(fetch(NOMIS_DEF.format(dataset_id), max_age=max_age)) as f:
+        data = json.load(f)
     # Dead end if no codelists are present
-    data = r.json()
     codelists = data['structure']['codelists']
     if codelists is None:
         return
@@ -194,6 +382,45 @@ def discovery_iter(dataset_id):
             yield _row_data
 
 
+def geography_index(dataset_id="NM_1_1", max_age=DISCOVERY_TTL):
+    """Index of every geography type of a dataset.
+
+    The geography codelist tree is two layers deep, so building the index
+    takes one discovery request per top level geography. It is stored and
+    kept in memory, so geography types are then found without any requests.
+
+    Args:
+        dataset_id (str): NOMIS dataset ID
+        max_age (float): Seconds a stored index is used for.
+    Returns:
+        index (:obj:`pd.DataFrame`): The `parent_id`, `type_id` and
+                                     `type_name` of each geography type.
+    """
+    if dataset_id in _GEOGRAPHY_INDEX:
+        return _GEOGRAPHY_INDEX[dataset_id]
+
+    fin = os.path.join(DISCOVERY_DIR, f"{dataset_id}_geography_types.csv")
+    if (os.path.isfile(fin)
+            and time.time() - os.path.getmtime(fin) < max_age):
+        index = pd.read_csv(fin, dtype=str)
+    else:
+        rows = []
+        for row in discovery_iter(f"{dataset_id}/geography.", max_age):
+            for sub_row in discovery_iter(
+                    f"{dataset_id}/geography/{row['nomis_id']}.", max_age):
+                rows.append((row['nomis_id'], sub_row['nomis_id'],
+                             sub_row['TypeName']))
+        index = pd.DataFrame(rows, columns=["parent_id", "type_id",
+                                            "type_name"], dtype=str)
+        # Don't repeat any previously found geography types
+        index = index.drop_duplicates("type_name").reset_index(drop=True)
+        os.makedirs(DISCOVERY_DIR, exist_ok=True)
+        index.to_csv(fin, index=False)
+
+    _GEOGRAPHY_INDEX[dataset_id] = index
+    return index
+
+
 def find_geographies(geography_name, dataset_id = "NM_1_1"):
     """Find all geography codes based on the name of the geography type.
 
@@ -203,25 +430,14 @@ def find_geographies(geography_name, dataset_id = "NM_1_1"):
     Returns:
         List of geography codes, if found.
     """
-    # Iterate two layers deep to find all the geography type names
-    matches = {}
-    for row in discovery_iter(f"{dataset_id}/geography."):
-        for sub_row in discovery_iter(f"{dataset_id}/geography/{row['nomis_id']}."):
-            # Don't repeat any previously found geography types
-            test_name = sub_row['TypeName']
-            if test_name in matches:
-                continue
-            # Calculate the Jaccard similarity between this geography type, and
-            # the desired geography name. This will only be used to help the
-            # user find a close match in the case that no geography codes
-            # are found.
-            matches[test_name] = jaccard_repeats(geography_name, test_name)
-            # Exclude inexact matches
-            if test_name != geography_name:
-                continue
-            # Return if a match is found
-            return list(discovery_iter(f"{dataset_id}/geography/{sub_row['nomis_id']}."))
-    # No match has been found, so give a recommendation
+    index = geography_index(dataset_id)
+    match = index.loc[index["type_name"] == geography_name, "type_id"]
+    if len(match) > 0:
+        return list(discovery_iter(f"{dataset_id}/geography/{match.iloc[0]}."))
+    # No match has been found, so give a recommendation, using the Jaccard
+    # similarity between each geography type and the desired geography name
+    matches = {test_name: jaccard_repeats(geography_name, test_name)
+               for test_name in index["type_name"]}
     best, _ = Counter(matches).most_common(1)[0]
     raise ValueError(f"No result found, did you mean '{best}'?")
 
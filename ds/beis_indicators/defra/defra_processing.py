@@ -1,6 +1,7 @@
 import geopandas as gpd
 import os
-import pyproj
+
+from beis_indicators.geo.transform import transform_coordinates
 
 
 def coordinates_to_points(df, x_coord_name, y_coord_name):
@@ -30,8 +31,7 @@ def translate_coordinates(x, y, pin, pout):
         pout (str): Output projection.
     
     Returns:
-        (tuple of array-like): Translated coordinate vectors.
+        (tuple of array-like): Translated coordinate vectors in x, y order,
+            i.e. longitude, latitude for geographic projections.
     '''
-    proj_in = pyproj.Proj(pin)
-    proj_out = pyproj.Proj(pout)
-    return pyproj.transform(proj_in, proj_out, x, y)
+    return transform_coordinates(x, y, pin, pout)
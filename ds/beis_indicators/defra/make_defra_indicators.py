@@ -8,7 +8,7 @@ from zipfile import ZipFile
 from beis_indicators import project_dir
 from beis_indicators.utils.dir_file_management import save_indicator
 from beis_indicators.geo import NutsCoder, LepCoder
-from beis_indicators.indicators import points_to_indicator, save_indicator
+from beis_indicators.indicators import points_to_indicators, save_indicator
 
 logger = logging.getLogger(__name__)
 
@@ -97,7 +97,7 @@ def make_air_pollution_nuts(years, raw_data_dir, shapefile_dir,
 
         pollution['longitude'], pollution['latitude'] = translate_coordinates(
             pollution['x'].values, pollution['y'].values, pin, pout)
-        pollution_gdf = coordinates_to_points(pollution, 'latitude', 'longitude')
+        pollution_gdf = coordinates_to_points(pollution, 'longitude', 'latitude')
         
         nuts_spec_year = nuts_earliest(year)
         nuts = load_nuts_regions(nuts_spec_year, shapefile_dir, level=nuts_level)
@@ -181,30 +181,37 @@ def make_air_pollution_leps(years, raw_data_dir, shapefile_dir,
     return df
 
 
-raw_data_dir = f'{project_dir}/data/raw/defra'
-shapefile_dir = f'{project_dir}/data/raw/shapefiles'
-years = range(2007, 2019)
-aggfunc = np.mean
-pollution_type = 'pm10'
-out_dir = f'{project_dir}/data/processed/defra'
-var_name = f'air_pollution_{aggfunc.__name__}_{pollution_type}'
-
-coders = {
-    'nuts2': NutsCoder(level=2),
-    'nuts3': NutsCoder(level=3),
-    'lep': LepCoder()
-    }
-
-pollution = []
-for year in years:
-    p = load_pollution_data(year, raw_data_dir, pollution_type)
-    p['year'] = year
-    pollution.append(p)
-pollution = pd.concat(pollution)
-
-for geo, coder in coders.items():
-    mean_pm10 = points_to_indicator(pollution, value_col='pm10', coder=coder,
+def main():
+    raw_data_dir = f'{project_dir}/data/raw/defra'
+    shapefile_dir = f'{project_dir}/data/raw/shapefiles'
+    years = range(2007, 2019)
+    aggfunc = np.mean
+    pollution_type = 'pm10'
+    out_dir = f'{project_dir}/data/processed/defra'
+    var_name = f'air_pollution_{aggfunc.__name__}_{pollution_type}'
+
+    coders = {
+        'nuts2': NutsCoder(level=2),
+        'nuts3': NutsCoder(level=3),
+        'lep': LepCoder()
+        }
+
+    pollution = []
+    for year in years:
+        p = load_pollution_data(year, raw_data_dir, pollution_type)
+        p['year'] = year
+        pollution.append(p)
+    pollution = pd.concat(pollution)
+
+    mean_pm10 = points_to_indicators(pollution, value_col='pm10', coders=coders,
                     aggfunc=np.mean, value_rename=var_name,
-                    projection='EPSG:27700', x_col='x', y_col='y')
-    save_indicator(mean_pm10, 'defra', geo)
+                    projection='EPSG:27700', x_col='x', y_col='y',
+                    grid='defra_pcm_1km', n_jobs=-1, hierarchy=True)
+    for geo, indicator in mean_pm10.items():
+        save_indicator(indicator, 'defra', geo)
+
 
+# workers re-import this module when they are spawned, so the pipeline
+# only runs from the main process
+if __name__ == '__main__':
+    main()
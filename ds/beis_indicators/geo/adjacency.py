@@ -0,0 +1,118 @@
+import logging
+import numpy as np
+import os
+import pandas as pd
+import shapely
+import tempfile
+from scipy import sparse
+from shapely import STRtree
+
+from beis_indicators import project_dir
+
+
+logger = logging.getLogger(__name__)
+
+ADJACENCY_DIR = f'{project_dir}/data/interim/adjacency'
+# Equal area projection that centroid distances are measured in
+DISTANCE_CRS = 'EPSG:3035'
+
+
+def adjacency_pairs(geoms, kind='queen'):
+    '''adjacency_pairs
+    Finds the pairs of neighbouring polygons.
+
+    Args:
+        geoms (array-like): Polygon geometries.
+        kind (str): `queen` for polygons that share any boundary point or
+            `rook` for polygons that share a boundary segment.
+
+    Returns:
+        (np.array): 2 by n array of the indices of neighbouring polygons.
+            Each pair appears in both orders.
+    '''
+    if kind not in ('queen', 'rook'):
+        raise ValueError(f"kind must be 'queen' or 'rook', not {kind}")
+    geoms = np.asarray(geoms)
+    shapely.prepare(geoms)
+    left, right = STRtree(geoms).query(geoms, predicate='intersects')
+    distinct = left != right
+    left, right = left[distinct], right[distinct]
+
+    if kind == 'rook':
+        shared = shapely.intersection(shapely.boundary(geoms[left]),
+                                      shapely.boundary(geoms[right]))
+        segment = shapely.length(shared) > 0
+        left, right = left[segment], right[segment]
+    return np.vstack([left, right])
+
+
+def centroid_distances(shape, crs=DISTANCE_CRS):
+    '''centroid_distances
+    Calculates the distances between the centroids of every pair of
+    regions.
+
+    Args:
+        shape (gpd.GeoDataFrame): Region boundaries.
+        crs (str): Projection that centroids and distances are calculated
+            in. The default is an equal area projection in metres.
+
+    Returns:
+        (np.array): Square matrix of distances in the units of `crs`.
+    '''
+    points = shapely.centroid(shape.to_crs(crs).geometry.values)
+    xy = np.column_stack([shapely.get_x(points), shapely.get_y(points)])
+    return np.sqrt(((xy[:, None, :] - xy[None, :, :]) ** 2).sum(axis=2))
+
+
+def load_adjacency(name, ids, geoms, kind='queen',
+        adjacency_dir=ADJACENCY_DIR):
+    '''load_adjacency
+    Loads a sparse adjacency matrix stored as a CSV of neighbouring region
+    IDs, building and storing it first if needed.
+
+    Args:
+        name (str): Name of the boundaries, e.g. `nuts2_2016`.
+        ids (pd.Index): Region IDs, in the order of the matrix.
+        geoms (array-like): Region geometries aligned with `ids`.
+        kind (str): See `adjacency_pairs`.
+        adjacency_dir (str): Directory where adjacencies are stored.
+
+    Returns:
+        (scipy.sparse.csr_matrix): Binary adjacency matrix.
+    '''
+    fin = os.path.join(adjacency_dir, f'{name}_{kind}.csv')
+    if os.path.isfile(fin):
+        pairs = pd.read_csv(fin, dtype=str)
+        left = ids.get_indexer(pairs['region'])
+        right = ids.get_indexer(pairs['neighbour'])
+        if (left < 0).any() or (right < 0).any():
+            logger.warning(f'{fin} has regions that are not in {name}. '
+                           'Rebuilding it.')
+            left, right = _build_adjacency(fin, name, ids, geoms, kind)
+    else:
+        left, right = _build_adjacency(fin, name, ids, geoms, kind)
+    return sparse.csr_matrix((np.ones(len(left)), (left, right)),
+                             shape=(len(ids), len(ids)))
+
+
+def _build_adjacency(fout, name, ids, geoms, kind):
+    '''_build_adjacency
+    Finds neighbouring regions and stores them as a CSV of region IDs. The
+    CSV is written to a temporary file and moved into place, so a partial
+    file is never read back.
+    '''
+    logger.info(f'Building {kind} adjacency for {name}')
+    left, right = adjacency_pairs(geoms, kind)
+    dirname = os.path.dirname(fout)
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.part')
+    try:
+        with os.fdopen(fd, 'w', newline='') as f:
+            pd.DataFrame({'region': ids[left], 'neighbour': ids[right]}
+                         ).to_csv(f, index=False)
+        os.replace(tmp, fout)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return left, right
@@ -0,0 +1,58 @@
+import geopandas as gpd
+import logging
+import os
+import pandas as pd
+import shapely
+
+from beis_indicators import project_dir
+
+
+logger = logging.getLogger(__name__)
+
+CENTROID_DIR = f'{project_dir}/data/interim/centroids'
+
+# Centroid tables already loaded in this process
+_CENTROIDS = {}
+
+
+def area_centroids(geography, year, shape_file, code_col,
+        centroid_dir=CENTROID_DIR):
+    '''area_centroids
+    Returns the centroids of a set of statistical areas, e.g. LSOAs, for a
+    boundary vintage. Centroids are computed once from the boundaries and
+    stored as a small parquet table, and are kept in memory after the first
+    call, so pipelines that only need area locations never re-read the
+    full resolution boundaries.
+
+    Args:
+        geography (str): Area type, e.g. `lsoa`, `msoa` or `oa`.
+        year (int): Boundary vintage.
+        shape_file (str): Path of the boundaries to compute centroids from
+            if they are not stored yet.
+        code_col (str): Column of area codes in the boundaries.
+        centroid_dir (str): Directory where centroid tables are stored.
+
+    Returns:
+        centroids (pd.DataFrame): `lon` and `lat` of each area's centroid
+            (in EPSG:4326) indexed by area code.
+    '''
+    key = (geography, year)
+    if key in _CENTROIDS:
+        return _CENTROIDS[key]
+
+    fin = os.path.join(centroid_dir, f'{geography}_{year}_centroids.parquet')
+    if os.path.isfile(fin):
+        centroids = pd.read_parquet(fin)
+    else:
+        logger.info(f'Calculating {geography} {year} centroids')
+        areas = gpd.read_file(shape_file).to_crs(epsg=4326)
+        points = shapely.centroid(areas.geometry.values)
+        centroids = pd.DataFrame({'lon': shapely.get_x(points),
+                                  'lat': shapely.get_y(points)},
+                                 index=pd.Index(areas[code_col].values,
+                                                name=f'{geography}_code'))
+        os.makedirs(centroid_dir, exist_ok=True)
+        centroids.to_parquet(fin)
+
+    _CENTROIDS[key] = centroids
+    return centroids
@@ -4,29 +4,61 @@ import requests
 import geopandas as gpd
 import pandas as pd
 import numpy as np
-import pyproj
 from urllib.request import urlretrieve
 from zipfile import ZipFile
+import json
 import logging
+from collections.abc import Mapping
 
 from beis_indicators import project_dir
+from beis_indicators.geo.adjacency import centroid_distances, load_adjacency
+from beis_indicators.geo.prefilter import PrefilteredTree
+from beis_indicators.geo.shape_cache import cached_shape
+from beis_indicators.geo.transform import transform_coordinates
 
 
 logger = logging.getLogger(__name__)
 
 
-def _setattr(obj, value, value_name, regex, url):
-    allowed_values = _get_available(regex, url)
-    if value not in allowed_values:
-        raise ValueError(f"'{value_name}' must be one of {allowed_values}")
-    setattr(obj, value_name, value)
+def _get_available(url, **regexes):
+    """_get_available
+    Scrapes a download page once and returns the integer values matched by
+    each of the named regexes.
+    """
+    r = requests.get(url)
+    r.raise_for_status()
+    return {name: sorted(set(int(v) for v in re.findall(regex, r.text)))
+            for name, regex in regexes.items()}
 
 
-def _get_available(regex, url):
-    r = requests.get(url)
-    values = set(int(yr) for yr in
-                 re.findall(regex, r.text))
-    return values
+class _LazyShapes(Mapping):
+    """_LazyShapes
+    Mapping of boundary year to boundaries that only reads a year from disk
+    the first time it is accessed. The available years are known up front
+    so that `generate_year_spec` can work without loading anything.
+
+    Args:
+        years (iter of int): Boundary years that can be loaded.
+        loader (function): Called with a year to load its boundaries.
+    """
+    def __init__(self, years, loader):
+        self._years = sorted(years)
+        self._loader = loader
+        self._loaded = {}
+
+    def __getitem__(self, year):
+        if year not in self._years:
+            raise KeyError(year)
+        if year not in self._loaded:
+            self._loaded[year] = self._loader(year)
+        return self._loaded[year]
+
+    def __iter__(self):
+        return iter(self._years)
+
+    def __len__(self):
+        return len(self._years)
+
 
 class _Coder:
     def __init__(self):
@@ -38,11 +70,59 @@ class _Coder:
     def code_points(self):
         pass
 
+    def _spatial_index(self, year):
+        """_spatial_index
+        Returns the boundaries for a year, projected to the coder's
+        projection, along with a two tier index of their geometries that
+        only tests points near a boundary against the full resolution
+        polygons. Both are built on first use and kept on the coder so that
+        repeated calls to `code_points` do not re-project or re-index the
+        same polygons.
+
+        Args:
+            year (int): Boundary specification year.
+
+        Returns:
+            shape (gpd.GeoDataFrame): Projected boundaries.
+            tree (PrefilteredTree): Index over the boundary geometries.
+        """
+        if not hasattr(self, '_indexes'):
+            self._indexes = {}
+        key = (year, getattr(self, 'level', None), self.PROJECTION)
+        if key not in self._indexes:
+            logger.info(f'Indexing {self.GEOGRAPHY} {year} boundaries')
+            shape = self.shapes[year].to_crs(self.PROJECTION)
+            tree = PrefilteredTree(shape.geometry.values)
+            self._indexes[key] = (shape, tree)
+        return self._indexes[key]
+
     def _reverse_geocode(self, points, year):
         """_reverse_geocode
+        Finds the boundary containing each point. The output matches a right
+        `gpd.sjoin` with the `within` predicate: one row per point-boundary
+        match, plus a row for each boundary that contains no points.
         """
-        shape = self.shapes[year].to_crs(self.PROJECTION)
-        joined = gpd.sjoin(points, shape, op='within', how='right')
+        shape, tree = self._spatial_index(year)
+        point_idx, shape_idx = tree.query(
+                np.asarray(points.geometry.values), predicate='within')
+        order = np.argsort(shape_idx, kind='stable')
+        point_idx, shape_idx = point_idx[order], shape_idx[order]
+
+        left = pd.DataFrame(points.drop(columns=points.geometry.name))
+        overlap = set(left.columns).intersection(shape.columns)
+        left = left.rename(columns={c: f'{c}_left' for c in overlap})
+        right = shape.rename(columns={c: f'{c}_right' for c in overlap})
+
+        matched = left.iloc[point_idx]
+        matched = matched.assign(index_left=matched.index)
+        coded = right.iloc[shape_idx]
+        matched = pd.concat([matched.reset_index(drop=True),
+                             coded.reset_index(drop=True)], axis=1)
+        matched.index = coded.index
+        empty = np.setdiff1d(np.arange(len(right)), shape_idx)
+        joined = pd.concat([matched, right.iloc[empty]])
+        joined = gpd.GeoDataFrame(joined, geometry=right.geometry.name,
+                crs=right.crs)
         return joined
 
     def _coordinates_to_points(self, x, y, data=None):
@@ -64,19 +144,171 @@ class _Coder:
         Returns:
             (tuple of array-like): Translated coordinate vectors.
         '''
-        proj_in = pyproj.Proj(pin)
-        proj_out = pyproj.Proj(pout)
-        return pyproj.transform(proj_in, proj_out, x, y)
+        return transform_coordinates(x, y, pin, pout)
+
+    def hierarchy_key(self):
+        """hierarchy_key
+        Identifies coders whose regions nest within each other, so that
+        points coded at the finest level can be rolled up to the others.
+        None if the coder's regions are not part of a hierarchy.
+        """
+        return None
+
+    def parent_ids(self, ids, level):
+        """parent_ids
+        Maps region IDs to the IDs of the regions containing them at a
+        coarser level of the hierarchy.
+        """
+        raise NotImplementedError(
+                f'{self.GEOGRAPHY} regions are not hierarchical')
+
+    def _boundary_name(self, year):
+        """_boundary_name
+        Name of the boundaries for a year, used for cached artefacts.
+        """
+        return f'{self.GEOGRAPHY}_{year}'
+
+    def region_ids(self, year):
+        """region_ids
+        IDs of the regions for a year, in the order of `adjacency` and
+        `distances`.
+        """
+        shape, _ = self._spatial_index(year)
+        return pd.Index(shape[self.ID_COL].values, name=f'{self.GEOGRAPHY}_id')
+
+    def adjacency(self, year, kind='queen'):
+        """adjacency
+        Sparse binary adjacency matrix of the regions for a year. Matrices
+        are stored on disk and kept on the coder after the first call.
+
+        Args:
+            year (int): Boundary specification year.
+            kind (str): `queen` for regions that share any boundary point or
+                `rook` for regions that share a boundary segment.
+
+        Returns:
+            ids (pd.Index): Region IDs of the rows and columns.
+            adjacency (scipy.sparse.csr_matrix): Adjacency matrix.
+        """
+        if not hasattr(self, '_adjacencies'):
+            self._adjacencies = {}
+        key = (year, getattr(self, 'level', None), kind)
+        if key not in self._adjacencies:
+            shape, _ = self._spatial_index(year)
+            ids = self.region_ids(year)
+            self._adjacencies[key] = (ids, load_adjacency(
+                    self._boundary_name(year), ids, shape.geometry.values,
+                    kind))
+        return self._adjacencies[key]
+
+    def distances(self, year):
+        """distances
+        Matrix of the distances in metres between the centroids of the
+        regions for a year. Kept on the coder after the first call.
+
+        Returns:
+            ids (pd.Index): Region IDs of the rows and columns.
+            distances (np.array): Distance matrix.
+        """
+        if not hasattr(self, '_distances'):
+            self._distances = {}
+        key = (year, getattr(self, 'level', None))
+        if key not in self._distances:
+            shape, _ = self._spatial_index(year)
+            self._distances[key] = (self.region_ids(year),
+                                    centroid_distances(shape))
+        return self._distances[key]
+
+    def _vintage_index(self, years):
+        """_vintage_index
+        Returns a single index over the boundaries of several years, along
+        with the region ID and year of each indexed boundary. Built on first
+        use and kept on the coder.
+        """
+        if not hasattr(self, '_indexes'):
+            self._indexes = {}
+        key = (tuple(years), getattr(self, 'level', None), self.PROJECTION)
+        if key not in self._indexes:
+            logger.info(f'Indexing {self.GEOGRAPHY} {list(years)} boundaries')
+            shapes = [self._spatial_index(year)[0] for year in years]
+            geoms = np.concatenate([s.geometry.values for s in shapes])
+            ids = np.concatenate([s[self.ID_COL].values for s in shapes])
+            vintages = np.repeat(years, [len(s) for s in shapes])
+            tree = PrefilteredTree(geoms, groups=vintages)
+            self._indexes[key] = (ids, vintages, tree)
+        return self._indexes[key]
+
+    def join_all_vintages(self, x, y, projection, years=None):
+        """join_all_vintages
+        Finds the regions containing each point for several boundary years
+        with a single query of one index over all of their boundaries.
+
+        Args:
+            x (array-like): Horizontal coordinates of points.
+            y (array-like): Vertical coordinates of points.
+            projection (str): Projection of the coordinates.
+            years (list): Boundary years. Defaults to all available years.
+
+        Returns:
+            point_idx (np.array): Position of the point in each match.
+            vintages (np.array): Boundary year of each match.
+            ids (np.array): Region ID of each match.
+        """
+        years = sorted(self.shapes.keys()) if years is None else sorted(years)
+        ids, vintages, tree = self._vintage_index(years)
+        x, y = self._translate_coordinates(x, y, projection, self.PROJECTION)
+        point_idx, shape_idx = tree.query(gpd.points_from_xy(x, y),
+                                          predicate='within')
+        return point_idx, vintages[shape_idx], ids[shape_idx]
+
+    def code_points_all_vintages(self, x, y, projection, years=None):
+        """code_points_all_vintages
+        Assigns points to a region in every boundary year at once.
+
+        Args:
+            x (array-like): Horizontal coordinates of points.
+            y (array-like): Vertical coordinates of points.
+            projection (str): Projection of the coordinates.
+            years (list): Boundary years. Defaults to all available years.
+
+        Returns:
+            (pd.DataFrame): Region IDs with a row for each point and a column
+                for each boundary year. Points outside all regions are NaN.
+                Points in more than one region of the same year, which
+                happens for LEPs that overlapped, are given the first.
+        """
+        years = sorted(self.shapes.keys()) if years is None else sorted(years)
+        point_idx, vintages, ids = self.join_all_vintages(x, y, projection,
+                                                          years)
+        coded = np.full((len(np.asarray(x)), len(years)), np.nan,
+                        dtype=object)
+        cols = np.searchsorted(years, vintages)
+        # matches are sorted by point and boundary, so keep the first of
+        # each point and year
+        _, first = np.unique(point_idx * len(years) + cols, return_index=True)
+        coded[point_idx[first], cols[first]] = ids[first]
+        return pd.DataFrame(coded, columns=pd.Index(years,
+                            name=f'{self.GEOGRAPHY}_year_spec'))
 
     def generate_year_spec(self, year):
         '''generate_year_spec
+        Returns the latest boundary year that is no later than a year. Years
+        before the earliest boundaries get the negative of the earliest
+        boundary year.
+
+        Args:
+            year (int or array-like): A year or an array of years.
+
+        Returns:
+            (int or np.array): Boundary year for each year.
         '''
-        years_available = reversed(sorted(self.shapes.keys())) 
-        for y in years_available:
-            if year >= y:
-                return y
-        else:
-            return -y
+        years_available = np.array(sorted(self.shapes.keys()))
+        pos = np.searchsorted(years_available, year, side='right') - 1
+        year_spec = np.where(pos >= 0, years_available[np.maximum(pos, 0)],
+                             -years_available[0])
+        if year_spec.ndim == 0:
+            return int(year_spec)
+        return year_spec
 
 
 class NutsCoder(_Coder):
@@ -89,7 +321,10 @@ class NutsCoder(_Coder):
     NESTED_FILE = 'NUTS_RG_{resolution}M_{year}_4326_LEVL_{level}.geojson'
     PROJECTION = 'EPSG:4326'
     GEOGRAPHY = 'nuts'
+    ID_COL = 'NUTS_ID'
     SHAPE_DIR = (f'{project_dir}/data/raw/shapefiles/')
+    MANIFEST_FILE = 'ref-nuts-manifest.json'
+    FILE_REGEX = r'ref-nuts-([0-9]+)-([0-9]+)m\.geojson\.zip$'
 
     def _get_shape(self, year):
         """_get_shape
@@ -103,43 +338,156 @@ class NutsCoder(_Coder):
         urlretrieve(url, fout)
 
     def __init__(self, resolution=1, level=2, nuts_countries=['UK']):
-        _setattr(self, resolution, 'resolution', self.RES_REGEX, self.TOP_URL)
+        self.manifest = self._load_manifest()
+        if resolution not in self.manifest['resolutions']:
+            raise ValueError("'resolution' must be one of "
+                             f"{self.manifest['resolutions']}")
+        self.resolution = resolution
         self.nuts_countries = nuts_countries
         self.level = level
         self._load_shapes()
 
+    def hierarchy_key(self):
+        """hierarchy_key
+        NUTS regions of any level nest within each other for coders with the
+        same boundary resolution and countries.
+        """
+        countries = self.nuts_countries
+        if countries is not None:
+            countries = tuple(countries)
+        return (self.GEOGRAPHY, self.resolution, countries)
+
+    def parent_ids(self, ids, level):
+        """parent_ids
+        NUTS IDs are a two letter country code followed by one character
+        per level, so parents are found by truncating the ID.
+
+        Args:
+            ids (pd.Series): NUTS IDs at this coder's level.
+            level (int): Level of the parent regions.
+
+        Returns:
+            (pd.Series): IDs of the parent regions.
+        """
+        if level > self.level:
+            raise ValueError(f'Level {level} is finer than the coder level '
+                             f'{self.level}')
+        return ids.str[:level + 2]
+
+    def _boundary_name(self, year):
+        """_boundary_name
+        Name of the boundaries for a year, including the level, resolution
+        and any country filter, used for cached artefacts.
+        """
+        name = f'{self.GEOGRAPHY}{self.level}_{year}_{self.resolution}m'
+        if self.nuts_countries is not None:
+            name = f"{name}_{'-'.join(self.nuts_countries)}"
+        return name
+
+    def _shape_file(self, year, resolution=None):
+        """_shape_file
+        Path to the local boundary zip for a year.
+        """
+        if resolution is None:
+            resolution = self.resolution
+        resolution = str(resolution).zfill(2)
+        return os.path.join(self.SHAPE_DIR,
+                            f'ref-nuts-{year}-{resolution}m.geojson.zip')
+
+    def _local_available(self):
+        """_local_available
+        Years and resolutions of the boundary zips already in `SHAPE_DIR`.
+        """
+        found = []
+        if os.path.isdir(self.SHAPE_DIR):
+            for fname in os.listdir(self.SHAPE_DIR):
+                match = re.match(self.FILE_REGEX, fname)
+                if match:
+                    found.append(tuple(int(v) for v in match.groups()))
+        return {'years': sorted(set(y for y, _ in found)),
+                'resolutions': sorted(set(r for _, r in found))}
+
+    def _load_manifest(self):
+        """_load_manifest
+        Reads the catalogue of NUTS years and resolutions published by GISCO.
+        The download page is only scraped if there is no manifest in
+        `SHAPE_DIR`, after which the result is written there for reuse. If
+        the page can't be reached or lists nothing, the catalogue falls back
+        to the boundary files already on disk and nothing is saved.
+
+        Returns:
+            manifest (dict): Lists of available `years` and `resolutions`.
+        """
+        fin = os.path.join(self.SHAPE_DIR, self.MANIFEST_FILE)
+        local = self._local_available()
+        if os.path.isfile(fin):
+            with open(fin, 'r') as f:
+                manifest = json.load(f)
+        else:
+            try:
+                manifest = _get_available(self.TOP_URL,
+                                          years=self.YEAR_REGEX,
+                                          resolutions=self.RES_REGEX)
+            except requests.exceptions.RequestException:
+                logger.warning('Could not reach GISCO. Using NUTS '
+                               f'boundaries found in {self.SHAPE_DIR}')
+                return local
+            if not manifest['years'] or not manifest['resolutions']:
+                logger.warning(f'No NUTS boundaries listed at {self.TOP_URL}. '
+                               f'Using NUTS boundaries found in '
+                               f'{self.SHAPE_DIR}')
+                return local
+            if not os.path.isdir(self.SHAPE_DIR):
+                os.mkdir(self.SHAPE_DIR)
+            tmp = f'{fin}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(manifest, f)
+            os.replace(tmp, fin)
+
+        missing = set(local['years']) - set(manifest['years'])
+        if missing:
+            logger.warning(f'NUTS years {sorted(missing)} are on disk but '
+                           f'not in {fin}. Delete it to refresh.')
+        return manifest
+
     def _load_shapes(self):
-        self.shapes = {}
-        years_available = _get_available(self.YEAR_REGEX, self.TOP_URL)
+        self.shapes = _LazyShapes(self.manifest['years'], self._load_shape)
+
+    def _load_shape(self, year):
+        """_load_shape
+        Loads the boundaries for a single year, downloading them if needed.
+        """
+        logger.info(f'Loading NUTS {self.level} {year} boundaries')
+        gdf = cached_shape(lambda: self._read_shape(year),
+                           f'{self.GEOGRAPHY}_geojson', year,
+                           level=self.level, resolution=self.resolution,
+                           crs=self.PROJECTION,
+                           source=self._shape_file(year))
+        if self.nuts_countries is not None:
+            gdf = (gdf.set_index('CNTR_CODE')
+                      .loc[self.nuts_countries]
+                      .reset_index())
+        return gdf
+
+    def _read_shape(self, year):
+        """_read_shape
+        Parses the boundaries for a year from the GISCO zip.
+        """
         resolution = str(self.resolution).zfill(2)
-        for year in years_available:
-            logger.info(f'Loading NUTS {self.level} {year} boundaries')
-            shape_zip_dir = os.path.join(self.SHAPE_DIR, 
-                                    f'ref-nuts-{year}-{resolution}m.geojson.zip')
-            exists = os.path.isfile(shape_zip_dir)
-            if not exists:
-                self._get_shape(year)
-            z = ZipFile(shape_zip_dir)
-            nested = self.NESTED_FILE.format(resolution=resolution, year=year, level=self.level)
-            gdf = gpd.read_file(z.open(nested))
-            if self.nuts_countries is not None:
-                gdf = (gdf.set_index('CNTR_CODE')
-                          .loc[self.nuts_countries]
-                          .reset_index())
-            self.shapes[year] = gdf
+        shape_zip_dir = self._shape_file(year)
+        exists = os.path.isfile(shape_zip_dir)
+        if not exists:
+            self._get_shape(year)
+        z = ZipFile(shape_zip_dir)
+        nested = self.NESTED_FILE.format(resolution=resolution, year=year,
+                                         level=self.level)
+        return gpd.read_file(z.open(nested))
 
     def code_points(self, x, y, year, projection, data=None):
         """code_points
         """
         shape = self.shapes[year]
-        if projection != self.PROJECTION:
-            # reverse x and y because eurostat uses lat, lon for polygons
-            # rather than lon, lat
-            y, x = self._translate_coordinates(np.array(x), np.array(y),
-                    projection, self.PROJECTION)
-        else:
-            x, y = self._translate_coordinates(np.array(x), np.array(y),
-                    projection, self.PROJECTION)
+        x, y = self._translate_coordinates(x, y, projection, self.PROJECTION)
         points = self._coordinates_to_points(x, y, data=data)
         joined = self._reverse_geocode(points, year)
         joined = joined.rename(columns={'NUTS_ID': 'nuts_id'})
@@ -156,6 +504,7 @@ class LepCoder(_Coder):
     FILE = 'lep_{year}.geojson'
     PROJECTION = 'EPSG:4326'
     GEOGRAPHY = 'lep'
+    ID_COL = 'lep_id'
     SHAPE_DIR = (f'{project_dir}/data/raw/shapefiles/')
 
     def __init__(self):
@@ -171,29 +520,38 @@ class LepCoder(_Coder):
         urlretrieve(url, fout)
 
     def _load_shapes(self):
-        self.shapes = {}
-        for year, file_url in self.YEAR_URLS.items():
-            logger.info(f'Loading LEP {year} boundaries')
-            fname = self.FILE.format(year=year)
-            shape_dir = os.path.join(self.SHAPE_DIR, fname)
-            exists = os.path.isfile(shape_dir)
-            if not exists:
-                self._get_shape(year, f"{self.TOP_URL}{file_url}")
-            gdf = gpd.read_file(shape_dir)
-            lep_id_col = f'lep{str(year)[-2:]}cd'
-            gdf = gdf.rename(columns={lep_id_col: 'lep_id'})
-            self.shapes[year] = gdf
+        self.shapes = _LazyShapes(self.YEAR_URLS.keys(), self._load_shape)
+
+    def _load_shape(self, year):
+        """_load_shape
+        Loads the boundaries for a single year, downloading them if needed.
+        """
+        logger.info(f'Loading LEP {year} boundaries')
+        fname = self.FILE.format(year=year)
+        gdf = cached_shape(lambda: self._read_shape(year),
+                           f'{self.GEOGRAPHY}_geojson', year,
+                           crs=self.PROJECTION,
+                           source=os.path.join(self.SHAPE_DIR, fname))
+        lep_id_col = f'lep{str(year)[-2:]}cd'
+        gdf = gdf.rename(columns={lep_id_col: 'lep_id'})
+        return gdf
+
+    def _read_shape(self, year):
+        """_read_shape
+        Parses the boundaries for a year from the downloaded GeoJSON.
+        """
+        fname = self.FILE.format(year=year)
+        shape_dir = os.path.join(self.SHAPE_DIR, fname)
+        exists = os.path.isfile(shape_dir)
+        if not exists:
+            self._get_shape(year, f"{self.TOP_URL}{self.YEAR_URLS[year]}")
+        return gpd.read_file(shape_dir)
 
     def code_points(self, x, y, year, projection, data=None):
         """code_points
         """
         shape = self.shapes[year]
-        if projection != self.PROJECTION:
-            y, x = self._translate_coordinates(np.array(x), np.array(y),
-                    projection, self.PROJECTION)
-        else:
-            x, y = self._translate_coordinates(np.array(x), np.array(y),
-                    projection, self.PROJECTION)
+        x, y = self._translate_coordinates(x, y, projection, self.PROJECTION)
         points = self._coordinates_to_points(x, y, data=data)
         joined = self._reverse_geocode(points, year)
         joined = joined.rename(columns={f'lep{year}cd': 'lep_id'})
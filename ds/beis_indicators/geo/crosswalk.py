@@ -0,0 +1,299 @@
+import geopandas as gpd
+import logging
+import numpy as np
+import os
+import pandas as pd
+from scipy import sparse
+
+from beis_indicators import project_dir
+
+
+logger = logging.getLogger(__name__)
+
+CROSSWALK_DIR = f'{project_dir}/data/interim/crosswalks'
+# Equal area projection for measuring polygon overlaps across Europe
+AREA_CRS = 'EPSG:3035'
+
+
+class Crosswalk:
+    '''Crosswalk
+    Sparse weights between the regions of two geographies, e.g. NUTS2 2013
+    and NUTS2 2016, or LADs and TTWAs. Weights are stored unnormalised (as
+    postcode counts or overlap areas) in a CSR matrix with a row for each
+    target region and a column for each source region, and are normalised
+    when data is converted depending on whether the values are extensive
+    (counts, totals) or intensive (means, rates).
+
+    Args:
+        source_ids (array-like): IDs of the source regions.
+        target_ids (array-like): IDs of the target regions.
+        weights (scipy.sparse matrix): Target by source weights.
+    '''
+    def __init__(self, source_ids, target_ids, weights):
+        self.source_ids = pd.Index(source_ids)
+        self.target_ids = pd.Index(target_ids)
+        self.weights = sparse.csr_matrix(weights)
+
+    @classmethod
+    def from_pairs(cls, source, target, weight=None):
+        '''from_pairs
+        Builds a crosswalk from aligned arrays of source and target region
+        IDs. Weights of repeated pairs are summed, so passing one pair per
+        postcode and no weights gives postcode counts.
+
+        Args:
+            source (array-like): Source region IDs.
+            target (array-like): Target region IDs.
+            weight (array-like): Weight of each pair. Defaults to 1.
+
+        Returns:
+            (Crosswalk)
+        '''
+        pairs = pd.DataFrame({'source': source, 'target': target})
+        pairs['weight'] = 1.0 if weight is None else np.asarray(weight, float)
+        pairs = pairs.dropna()
+        source_codes, source_ids = pd.factorize(pairs['source'], sort=True)
+        target_codes, target_ids = pd.factorize(pairs['target'], sort=True)
+        weights = sparse.coo_matrix(
+                (pairs['weight'].values, (target_codes, source_codes)),
+                shape=(len(target_ids), len(source_ids)))
+        # duplicate entries are summed on conversion to CSR
+        return cls(source_ids, target_ids, weights.tocsr())
+
+    def to_pairs(self):
+        '''to_pairs
+        Returns the non-zero weights as a dataframe of (source, target,
+        weight) rows.
+        '''
+        coo = self.weights.tocoo()
+        return pd.DataFrame({'source': self.source_ids[coo.col],
+                             'target': self.target_ids[coo.row],
+                             'weight': coo.data})
+
+    def save(self, path):
+        '''save
+        Writes the crosswalk to a CSV of (source, target, weight) rows.
+        '''
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.to_pairs().to_csv(path, index=False)
+
+    @classmethod
+    def load(cls, path):
+        '''load
+        Reads a crosswalk written by `save`.
+        '''
+        pairs = pd.read_csv(path, dtype={'source': str, 'target': str})
+        return cls.from_pairs(pairs['source'], pairs['target'],
+                              pairs['weight'])
+
+    def matrix(self, extensive=True):
+        '''matrix
+        Normalised weight matrix.
+
+        Args:
+            extensive (bool): If True, each source region's weights sum to
+                1, so totals are split between target regions. If False,
+                each target region's weights sum to 1, so target values are
+                weighted means of the source values.
+
+        Returns:
+            (scipy.sparse.csr_matrix): Target by source weights.
+        '''
+        axis = 0 if extensive else 1
+        totals = np.asarray(self.weights.sum(axis=axis)).ravel()
+        scale = np.divide(1, totals, out=np.zeros_like(totals, dtype=float),
+                          where=totals != 0)
+        if extensive:
+            return sparse.csr_matrix(self.weights @ sparse.diags(scale))
+        return sparse.csr_matrix(sparse.diags(scale) @ self.weights)
+
+    def convert(self, values, extensive=True):
+        '''convert
+        Converts values from source to target regions with one sparse matrix
+        product. For extensive values, source regions missing from `values`
+        or with missing values contribute nothing. For intensive values,
+        each target is a weighted mean over only the source regions with
+        values, and is NaN if none of its source regions have values.
+
+        Args:
+            values (pd.Series or pd.DataFrame): Values indexed by source
+                region ID.
+            extensive (bool): See `matrix`.
+
+        Returns:
+            (pd.Series or pd.DataFrame): Values indexed by target region ID
+                for targets that overlap any of the source regions in
+                `values`.
+        '''
+        aligned = values.reindex(self.source_ids)
+        present = aligned.notna().values.astype(float)
+        filled = aligned.fillna(0).values
+        if extensive:
+            weights = self.matrix(extensive)
+            converted = weights @ filled
+            totals = weights @ present
+        else:
+            # normalise by the weights of the sources that are present, per
+            # column, so missing sources don't drag the means down
+            totals = self.weights @ present
+            converted = np.divide(self.weights @ filled, totals,
+                                  out=np.full(totals.shape, np.nan),
+                                  where=totals > 0)
+        covered = totals > 0
+        if aligned.ndim > 1:
+            covered = covered.any(axis=1)
+
+        index = self.target_ids[covered]
+        if aligned.ndim > 1:
+            return pd.DataFrame(converted[covered], index=index,
+                                columns=values.columns)
+        return pd.Series(converted[covered], index=index, name=values.name)
+
+
+def overlap_crosswalk(source_shapes, target_shapes, source_col, target_col,
+        crs=AREA_CRS):
+    '''overlap_crosswalk
+    Builds a crosswalk weighted by the areas of overlap between two sets of
+    polygons.
+
+    Args:
+        source_shapes (gpd.GeoDataFrame): Source region boundaries.
+        target_shapes (gpd.GeoDataFrame): Target region boundaries.
+        source_col (str): Column of source region IDs.
+        target_col (str): Column of target region IDs.
+        crs (str): Equal area projection that overlaps are measured in.
+
+    Returns:
+        (Crosswalk)
+    '''
+    source = source_shapes[[source_col, 'geometry']].to_crs(crs)
+    target = target_shapes[[target_col, 'geometry']].to_crs(crs)
+    source = source.rename(columns={source_col: 'source'})
+    target = target.rename(columns={target_col: 'target'})
+
+    overlap = gpd.overlay(source, target, how='intersection',
+                          keep_geom_type=True)
+    overlap = overlap[overlap.area > 0]
+    return Crosswalk.from_pairs(overlap['source'], overlap['target'],
+                                overlap.area.values)
+
+
+def postcode_crosswalk(source_codes, target_codes):
+    '''postcode_crosswalk
+    Builds a crosswalk weighted by the number of postcodes that fall in
+    each pair of regions, as a proxy for population.
+
+    Args:
+        source_codes (array-like): Source region of each postcode.
+        target_codes (array-like): Target region of each postcode.
+
+    Returns:
+        (Crosswalk)
+    '''
+    return Crosswalk.from_pairs(np.asarray(source_codes, dtype=object),
+                                np.asarray(target_codes, dtype=object))
+
+
+def _region_shapes(geography):
+    '''_region_shapes
+    Boundaries and ID column for a geography named like `nuts2_2013` or
+    `lep_2017`.
+    '''
+    from beis_indicators.geo.coders import LepCoder, NutsCoder
+
+    name, year = geography.split('_')
+    if name.startswith('nuts'):
+        return NutsCoder(level=int(name[4:])).shapes[int(year)], 'NUTS_ID'
+    if name == 'lep':
+        return LepCoder().shapes[int(year)], 'lep_id'
+    raise ValueError(f'No boundaries available for {geography}. Use '
+                     "method='postcode' instead.")
+
+
+def load_crosswalk(source, target, method='postcode',
+        crosswalk_dir=CROSSWALK_DIR):
+    '''load_crosswalk
+    Loads a crosswalk between two geographies, building and storing it on
+    the first request.
+
+    Geographies are named as region columns of `PostcodeCoder`, e.g. `lad`,
+    `ttwa`, `nuts2_2013` or `lep_2020`.
+
+    Args:
+        source (str): Source geography.
+        target (str): Target geography.
+        method (str): `postcode` to weight by postcode counts from NSPL or
+            `area` to weight by polygon overlap. `area` is only available
+            for NUTS and LEP geographies.
+        crosswalk_dir (str): Directory where crosswalks are stored.
+
+    Returns:
+        (Crosswalk)
+    '''
+    path = os.path.join(crosswalk_dir, f'{source}_to_{target}_{method}.csv')
+    if os.path.isfile(path):
+        return Crosswalk.load(path)
+
+    logger.info(f'Building {method} crosswalk from {source} to {target}')
+    if method == 'postcode':
+        from beis_indicators.geo.postcodes import PostcodeCoder
+
+        pc = PostcodeCoder()
+        regions = pc.code_postcodes(pc.nspl.index.values, [source, target])
+        crosswalk = postcode_crosswalk(regions[source], regions[target])
+    elif method == 'area':
+        source_shapes, source_col = _region_shapes(source)
+        target_shapes, target_col = _region_shapes(target)
+        crosswalk = overlap_crosswalk(source_shapes, target_shapes,
+                                      source_col, target_col)
+    else:
+        raise ValueError(f"method must be 'postcode' or 'area', not {method}")
+
+    crosswalk.save(path)
+    return crosswalk
+
+
+def convert_indicator(indicator, crosswalk, geography, target_geography,
+        target_year_spec, extensive=True, dp=2):
+    '''convert_indicator
+    Re-bases an indicator table onto another geography or boundary version,
+    e.g. NUTS2 2013 onto NUTS2 2016. Each year is converted with a single
+    sparse matrix product over all of the value columns.
+
+    Args:
+        indicator (pd.DataFrame): Indicator with `year`, `{geography}_id`
+            and `{geography}_year_spec` columns as created by
+            `points_to_indicator`. All rows should be for the crosswalk's
+            source boundaries.
+        crosswalk (Crosswalk): Crosswalk from the indicator's regions.
+        geography (str): Geography of the indicator, e.g. `nuts`.
+        target_geography (str): Geography of the output, e.g. `nuts` or
+            `lep`.
+        target_year_spec (int): Boundary year of the crosswalk's target
+            regions.
+        extensive (bool): True for counts and totals, False for means and
+            rates. See `Crosswalk.matrix`.
+        dp (int): Decimal places to round the converted values to.
+
+    Returns:
+        (pd.DataFrame): Indicator in the same format for the target regions.
+    '''
+    id_col = f'{geography}_id'
+    year_spec_col = f'{geography}_year_spec'
+    value_cols = [c for c in indicator.columns
+                  if c not in ['year', id_col, year_spec_col]]
+    target_id_col = f'{target_geography}_id'
+
+    converted = []
+    for year, group in indicator.groupby('year'):
+        values = crosswalk.convert(group.set_index(id_col)[value_cols],
+                                   extensive=extensive)
+        values.index.name = target_id_col
+        values = values.reset_index()
+        values.insert(0, 'year', year)
+        values.insert(2, f'{target_geography}_year_spec', target_year_spec)
+        converted.append(values)
+
+    converted = pd.concat(converted, ignore_index=True)
+    converted[value_cols] = converted[value_cols].round(dp)
+    return converted
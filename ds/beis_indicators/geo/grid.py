@@ -0,0 +1,94 @@
+import logging
+import numpy as np
+import os
+import pandas as pd
+
+from beis_indicators import project_dir
+
+
+logger = logging.getLogger(__name__)
+
+GRID_DIR = f'{project_dir}/data/interim/grid_cache'
+
+
+def _grid_file(grid, coder, year, grid_dir):
+    '''_grid_file
+    Path of the cached cell assignments for a grid and a coder's boundaries
+    for a year. The coder's boundary name includes everything that changes
+    the boundaries, such as NUTS level, resolution and countries.
+    '''
+    return os.path.join(grid_dir,
+                        f'{grid}_{coder._boundary_name(year)}.csv')
+
+
+def _cell_index(x, y):
+    return pd.MultiIndex.from_arrays([np.asarray(x), np.asarray(y)],
+                                     names=['x', 'y'])
+
+
+def grid_cell_regions(x, y, coder, year, projection, grid,
+        grid_dir=GRID_DIR):
+    '''grid_cell_regions
+    Assigns the cells of a fixed grid to regions. Assignments are cached on
+    disk per grid and set of boundaries, so each cell is only spatially
+    joined the first time it is seen. Cells that were not in the
+    cache are joined and added to it.
+
+    Args:
+        x (array-like): Horizontal coordinates of grid cells.
+        y (array-like): Vertical coordinates of grid cells.
+        coder (Coder): A coder object.
+        year (int): Boundary specification year.
+        projection (str): Projection of the grid coordinates.
+        grid (str): Name of the grid, e.g. `defra_pcm_1km`. Grids with
+            the same name must share cell coordinates.
+        grid_dir (str): Directory where cell assignments are cached.
+
+    Returns:
+        regions (pd.Series): Region ID of each unique cell, indexed by
+            (x, y). Cells outside all regions are NaN.
+    '''
+    id_col = f'{coder.GEOGRAPHY}_id'
+    fin = _grid_file(grid, coder, year, grid_dir)
+    if os.path.isfile(fin):
+        regions = pd.read_csv(fin, index_col=['x', 'y'])[id_col]
+    else:
+        regions = pd.Series(index=_cell_index([], []), name=id_col,
+                            dtype=object)
+
+    cells = _cell_index(x, y).unique()
+    new = cells.difference(regions.index)
+    if len(new) > 0:
+        logger.info(f'Assigning {len(new)} {grid} cells to '
+                    f'{coder.GEOGRAPHY} {year} regions')
+        new_x = new.get_level_values('x')
+        new_y = new.get_level_values('y')
+        joined = coder.code_points(new_x, new_y, year, projection,
+                pd.DataFrame({'x': new_x, 'y': new_y}))
+        joined = joined.dropna(subset=['index_left'])
+        joined = joined.drop_duplicates(subset=['x', 'y'])
+        assigned = joined.set_index(['x', 'y'])[id_col]
+        regions = pd.concat([regions, assigned.reindex(new)])
+        # write then rename so parallel workers never read a partial file
+        os.makedirs(grid_dir, exist_ok=True)
+        tmp = f'{fin}.{os.getpid()}.tmp'
+        regions.to_csv(tmp)
+        os.replace(tmp, fin)
+
+    return regions.reindex(cells)
+
+
+def gather_regions(x, y, regions):
+    '''gather_regions
+    Looks up the region of every point on a grid from cell assignments.
+
+    Args:
+        x (array-like): Horizontal coordinates of points.
+        y (array-like): Vertical coordinates of points.
+        regions (pd.Series): Cell assignments from `grid_cell_regions`.
+
+    Returns:
+        (np.array): Region ID of each point.
+    '''
+    pos = regions.index.get_indexer(_cell_index(x, y))
+    return regions.values[pos]
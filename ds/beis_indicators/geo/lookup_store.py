@@ -0,0 +1,144 @@
+import glob
+import logging
+import numpy as np
+import os
+import pandas as pd
+import tempfile
+import time
+
+from beis_indicators import project_dir
+
+
+logger = logging.getLogger(__name__)
+
+STORE_DIR = f'{project_dir}/data/interim/geo_lookup'
+# Marks points that have been geocoded but fall outside every region, so
+# that they are not confused with points that have not been geocoded yet
+NO_REGION = '_'
+KEY_NAMES = ['lon_key', 'lat_key']
+
+
+def _empty_column():
+    index = pd.MultiIndex.from_arrays(
+            [np.array([], dtype=np.int64)] * 2, names=KEY_NAMES)
+    return pd.Series(index=index, dtype=object, name='region')
+
+
+def _overwrite(old, new):
+    return pd.concat([old[~old.index.isin(new.index)], new])
+
+
+class GeoLookupStore:
+    '''GeoLookupStore
+    On-disk lookup from points to the regions they have been geocoded into.
+    Points are keyed on their lon/lat rounded to `dp` decimal places and the
+    store has a column of region codes for each set of boundaries, named by
+    the caller so that it identifies the boundaries, e.g.
+    `nuts2_2016__NUTS_RG_01M_2016_4326_LEVL_2.shp.zip__NUTS_ID`. It is
+    shared by every pipeline, so a point only needs reverse geocoding once
+    across all datasets and runs.
+
+    Each column is a directory of CSV shards that are only ever added to.
+    Saving writes a new shard with the rows added since the store was
+    loaded, so pipelines that share the store can save at the same time
+    without dropping each other's rows.
+
+    Args:
+        path (str): Directory that the store is kept in.
+        dp (int): Decimal places that coordinates are rounded to for keys.
+            6 decimal places is roughly 10cm.
+    '''
+    def __init__(self, path=STORE_DIR, dp=6):
+        self.path = path
+        self.dp = dp
+        self._columns = {}
+        self._unsaved = {}
+
+    def keys(self, lon, lat):
+        '''keys
+        Builds store keys for vectors of coordinates.
+
+        Args:
+            lon (array-like): Longitudes.
+            lat (array-like): Latitudes.
+
+        Returns:
+            (pd.MultiIndex): Integer keys of the rounded coordinates.
+        '''
+        scale = 10 ** self.dp
+        lon = np.round(np.asarray(lon, dtype=float) * scale).astype(np.int64)
+        lat = np.round(np.asarray(lat, dtype=float) * scale).astype(np.int64)
+        return pd.MultiIndex.from_arrays([lon, lat], names=KEY_NAMES)
+
+    def _column(self, column):
+        '''_column
+        Region codes of a column, read from its shards on first use. Shards
+        are named by the time they were written and later shards take
+        precedence.
+        '''
+        if column not in self._columns:
+            shards = sorted(glob.glob(
+                    os.path.join(self.path, column, '*.csv')))
+            codes = [pd.read_csv(fin, index_col=KEY_NAMES,
+                                 dtype={'region': str},
+                                 keep_default_na=False)['region']
+                     for fin in shards]
+            codes = pd.concat([_empty_column()] + codes)
+            self._columns[column] = codes[
+                    ~codes.index.duplicated(keep='last')]
+        return self._columns[column]
+
+    def lookup(self, keys, columns):
+        '''lookup
+        Looks up the stored regions for a set of keys.
+
+        Args:
+            keys (pd.MultiIndex): Keys created by `keys`.
+            columns (list): Region columns to return.
+
+        Returns:
+            (pd.DataFrame): Region codes aligned with `keys`. Values are NaN
+                where a key has not been geocoded for a column, and
+                `NO_REGION` where it was geocoded but was outside all regions.
+        '''
+        return pd.DataFrame({column: self._column(column).reindex(keys).values
+                             for column in columns},
+                            index=keys, columns=columns)
+
+    def update(self, regions):
+        '''update
+        Adds or overwrites region codes in the store.
+
+        Args:
+            regions (pd.DataFrame): Region codes indexed by keys created by
+                `keys`. NaN values are stored as `NO_REGION`.
+        '''
+        regions = regions[~regions.index.duplicated()].fillna(NO_REGION)
+        regions.index = regions.index.set_names(KEY_NAMES)
+        for column in regions.columns:
+            codes = regions[column].astype(object).rename('region')
+            self._columns[column] = _overwrite(self._column(column), codes)
+            self._unsaved[column] = _overwrite(
+                    self._unsaved.get(column, _empty_column()), codes)
+
+    def save(self):
+        '''save
+        Writes the rows added since the store was loaded to a new shard in
+        each updated column. Shards are written to a temporary file and
+        moved into place, so other processes never read a partial shard.
+        '''
+        for column, codes in self._unsaved.items():
+            dirname = os.path.join(self.path, column)
+            os.makedirs(dirname, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.part')
+            name = os.path.splitext(os.path.basename(tmp))[0]
+            fout = os.path.join(dirname, f'{time.time_ns():020d}_{name}.csv')
+            try:
+                with os.fdopen(fd, 'w', newline='') as f:
+                    codes.to_csv(f)
+                os.replace(tmp, fout)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+        self._unsaved = {}
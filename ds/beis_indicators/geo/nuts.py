@@ -5,6 +5,8 @@ import numpy as np
 import os
 from zipfile import ZipFile
 
+from beis_indicators.geo.shape_cache import cached_shape
+
 
 NUTS_ENFORCED = {
     2003: 2003,
@@ -53,14 +55,27 @@ NUTS2_UK_IDS ={
 
 NUTS_YEARS = np.array(list(NUTS2_UK_IDS.keys()))
 
+# Sorted NUTS2 region codes and a boolean matrix of which NUTS versions
+# (columns, in the order of NUTS_YEARS) each code (rows) belongs to
+NUTS2_UK_CODES = pd.Index(sorted(set().union(*NUTS2_UK_IDS.values())))
+NUTS2_UK_MEMBERSHIP = np.array(
+        [NUTS2_UK_CODES.isin(list(ids)) for ids in NUTS2_UK_IDS.values()]).T
+
+
+def _version_lookup(mapping):
+    """_version_lookup
+    Sorted arrays of the years from which each NUTS version applies and the
+    NUTS version years themselves.
+    """
+    versions = np.array(sorted(mapping, key=mapping.get))
+    starts = np.array([mapping[v] for v in versions])
+    return starts, versions
+
 
-def _year_containments(ids, years):
-    containments = []
-    for year in years:
-        year_ids = NUTS2_UK_IDS[year]
-        containments.append(_set_containment(ids, year_ids))
-    containments = np.array(containments)
-    return containments
+_NUTS_LOOKUPS = {
+    'introduced': _version_lookup(NUTS_INTRODUCED),
+    'enforced': _version_lookup(NUTS_ENFORCED),
+}
 
 
 def nuts_earliest(year, mode='introduced'):
@@ -69,49 +84,93 @@ def nuts_earliest(year, mode='introduced'):
     based on the enforcement date.
 
     Args:
-        year (int): A year
+        year (int or array-like): A year or an array of years
         mode (str): Choose whether to map years against the year that a NUTS
             version was enforced or introduced: Options:
                 - `introduced` (default)
                 - `enforced`
     Returns:
-        earliest (int): The closest possible NUTS version year
+        earliest (int or np.array): The closest possible NUTS version year
+            for each year
+
+    Raises:
+        ValueError: If a year is missing or precedes every NUTS version.
     '''
-    if mode == 'introduced':
-        mapping = NUTS_INTRODUCED
-    elif mode == 'enforced':
-        mapping = NUTS_ENFORCED
-
-    for k, v in mapping.items():
-        if year >= v:
-            earliest = k
+    starts, versions = _NUTS_LOOKUPS[mode]
+    years = np.asarray(year)
+    if np.any(pd.isna(years)):
+        raise ValueError('Missing years have no NUTS version')
+    pos = np.searchsorted(starts, years, side='right') - 1
+    if np.any(pos < 0):
+        raise ValueError(f'Years before {starts[0]} have no NUTS version')
+    earliest = versions[pos]
+    if earliest.ndim == 0:
+        return int(earliest)
     return earliest
 
 
+def nuts_year_spec(year, mode='introduced'):
+    '''nuts_year_spec
+    Alias of `nuts_earliest`.
+    '''
+    return nuts_earliest(year, mode)
+
+
+def _year_containments(ids, groups=None):
+    '''_year_containments
+    Calculates, for each group of region IDs, the share of the group's IDs
+    that are unique NUTS2 regions of each NUTS version.
+
+    Args:
+        ids (array-like): Region IDs.
+        groups (array-like): Group of each ID. If None, all IDs are treated
+            as one group.
+
+    Returns:
+        group_keys (np.array): Sorted group keys.
+        containments (np.array): Groups by NUTS_YEARS array of containments.
+    '''
+    ids = pd.Series(np.asarray(ids, dtype=object))
+    groups = np.zeros(len(ids)) if groups is None else np.asarray(groups)
+    group_codes, group_keys = pd.factorize(groups, sort=True)
+    sizes = np.bincount(group_codes, minlength=len(group_keys))
+
+    pairs = pd.DataFrame({'group': group_codes,
+                          'code': NUTS2_UK_CODES.get_indexer(ids)})
+    pairs = pairs[pairs['code'] >= 0].drop_duplicates()
+    counts = np.zeros((len(group_keys), len(NUTS_YEARS)))
+    np.add.at(counts, pairs['group'].values,
+              NUTS2_UK_MEMBERSHIP[pairs['code'].values])
+    return np.asarray(group_keys), counts / sizes[:, None]
+
+
 def _detect_nuts2_uk(ids, year):
     '''detect_nuts
     Detects the most likely NUTS version based on the region IDs.
     '''
-    earliest = nuts_earliest(year)
-    years = NUTS_YEARS[NUTS_YEARS >= nuts_earliest(year)]
-    # if only one year is possible, return it
-    if len(years) == 1:
-        return years[0]
-
-    # if not calculate containments between region IDs from possible years
-    containments = _year_containments(ids, years)
-    # check if there is a single perfect match
-    perfect = containments == 1
-    if np.sum(perfect) == 1:
-        year_inferred = years[np.argmax(perfect)]
-        return year_inferred
-
-    # if there is not a perfect match then chose the earliest and best
-    # possible match
-    elif np.sum(perfect) != 1:
-        best = np.argwhere(containments == np.max(containments)).ravel()
-        year_inferred = years[best[0]]
-        return year_inferred
+    _, detected = _detect_nuts2_uk_years(ids, np.full(len(ids), year))
+    return detected[0]
+
+
+def _detect_nuts2_uk_years(ids, years):
+    '''_detect_nuts2_uk_years
+    Detects the most likely NUTS version for the region IDs of each year in
+    a single pass. Only versions introduced by the year are considered. Of
+    those, the earliest with the highest containment of the IDs is chosen,
+    which is the single perfect match if there is one.
+
+    Returns:
+        years (np.array): Sorted unique years.
+        detected (np.array): NUTS version detected for each year.
+    '''
+    years, containments = _year_containments(ids, years)
+    earliest = nuts_earliest(years)
+    candidates = NUTS_YEARS[None, :] >= earliest[:, None]
+    containments = np.where(candidates, containments, -1)
+    detected = NUTS_YEARS[np.argmax(containments, axis=1)]
+    # years with no candidate versions in NUTS2_UK_IDS keep their earliest
+    detected = np.where(candidates.any(axis=1), detected, earliest)
+    return years, detected
 
 
 def auto_nuts2_uk(df, year='year', nuts_id='nuts_id'):
@@ -127,14 +186,10 @@ def auto_nuts2_uk(df, year='year', nuts_id='nuts_id'):
         df (:obj:`pd.DataFrame`): Modified dataframe with new column
             for NUTS region years, `nuts_year_spec`.
     '''
-    dfs = []
-    for year, group in df.groupby(year):
-        auto_nuts_year = _detect_nuts2_uk(group[nuts_id], year)
-        group = group.assign(nuts_year_spec=auto_nuts_year)
-        dfs.append(group)
-
-    df = pd.concat(dfs, axis=0)
-    return df
+    df = df.dropna(subset=[year])
+    years, detected = _detect_nuts2_uk_years(df[nuts_id], df[year])
+    year_spec = pd.Series(detected, index=years)
+    return df.assign(nuts_year_spec=df[year].map(year_spec).values)
 
 
 def load_nuts_regions(year, shapefile_dir, level=2, projection=4326, resolution=1, countries=['UK']):
@@ -151,24 +206,51 @@ def load_nuts_regions(year, shapefile_dir, level=2, projection=4326, resolution=
             all regions will be returned. Default is `["UK"]`.
     '''
 
+    nuts_gdf = cached_shape(
+            lambda: _read_nuts_regions(year, shapefile_dir, level,
+                                       projection, resolution),
+            'nuts_shp', year, level=level, resolution=resolution,
+            crs=f'EPSG:{projection}',
+            source=_nuts_shape_dir(year, shapefile_dir, level, projection,
+                                   resolution) + '.zip')
+
+    if countries is not None:
+        nuts_gdf = nuts_gdf.set_index('CNTR_CODE').loc[countries].reset_index()
+
+    return nuts_gdf
+
+
+def _nuts_shape_dir(year, shapefile_dir, level, projection, resolution):
+    '''_nuts_shape_dir
+    Path of the extracted NUTS shapefile directory for a year and level.
+    Its zip is at the same path with a `.zip` suffix.
+    '''
     resolution = str(resolution).zfill(2)
+    return (f'{shapefile_dir}/'
+            f'ref-nuts-{year}-{resolution}m.shp/'
+            f'NUTS_RG_{resolution}M_{year}_{projection}_LEVL_{level}.shp')
 
-    nuts_dir = (f'{shapefile_dir}/'
-                f'ref-nuts-{year}-{resolution}m.shp/'
-                f'NUTS_RG_{resolution}M_{year}_{projection}_LEVL_{level}.shp')
 
-    if not os.path.isdir(nuts_dir):
-        with ZipFile(f'{nuts_dir}.zip','r') as archive:
+def _read_nuts_regions(year, shapefile_dir, level, projection, resolution):
+    '''_read_nuts_regions
+    Extracts and parses a NUTS shapefile.
+    '''
+    nuts_dir = _nuts_shape_dir(year, shapefile_dir, level, projection,
+                               resolution)
+    resolution = str(resolution).zfill(2)
+
+    # extracted again if the zip has been replaced since
+    nuts_zip = f'{nuts_dir}.zip'
+    if (not os.path.isdir(nuts_dir)
+            or (os.path.isfile(nuts_zip)
+                and os.path.getmtime(nuts_zip) > os.path.getmtime(nuts_dir))):
+        with ZipFile(nuts_zip, 'r') as archive:
             archive.extractall(nuts_dir)
+        os.utime(nuts_dir)
 
     nuts_fin = (f'{nuts_dir}/'
                 f'NUTS_RG_{resolution}M_{year}_{projection}_LEVL_{level}.shp')
-    nuts_gdf = gpd.read_file(nuts_fin)
-
-    if countries is not None:
-        nuts_gdf = nuts_gdf.set_index('CNTR_CODE').loc[countries].reset_index()
-
-    return nuts_gdf
+    return gpd.read_file(nuts_fin)
 
 
 def get_nuts_shape(year, shapefile_dir, resolution=1):
@@ -190,35 +272,4 @@ def get_nuts_shape(year, shapefile_dir, resolution=1):
     fout = f'{shapefile_dir}/{fname}'
 
     urlretrieve(url, fout)
-
-
-def nuts_year_spec(year, mode='introduced'):
-    '''nuts_earliest
-    Returns the earliest possible NUTS version for a year
-    based on the enforcement date.
-
-    Args:
-        year (int): A year
-        mode (str): Choose whether to map years against the year that a NUTS
-            version was enforced or introduced: Options:
-                - `introduced` (default)
-                - `enforced`
-    Returns:
-        earliest (int): The closest possible NUTS version year
-    '''
-    if mode == 'introduced':
-        mapping = NUTS_INTRODUCED
-    elif mode == 'enforced':
-        mapping = NUTS_ENFORCED
-
-    for k, v in mapping.items():
-        if year >= v:
-            earliest = k
-    return earliest
-
-
-def _set_containment(a, b):
-    i = len(set(a).intersection(set(b)))
-    c = i / len(a)
-    return c
 # >>>>>>> dev:ds/beis_indicators/geo/nuts.py
@@ -0,0 +1,176 @@
+import logging
+import numpy as np
+import os
+import pandas as pd
+
+from beis_indicators import project_dir
+from beis_indicators.geo.reverse_geocoder import multi_reverse_geocode
+
+
+logger = logging.getLogger(__name__)
+
+NSPL_FILE = f'{project_dir}/data/raw/nspl/Data/NSPL_FEB_2020_UK.csv'
+EXTRACT_FILE = f'{project_dir}/data/interim/nspl_extract.parquet'
+LAU_NUTS_URL = ('https://opendata.arcgis.com/datasets/'
+                '10abfc7a2fb249caa13ed345fe756e4e_0.csv')
+
+
+def _normalise(postcodes):
+    '''_normalise
+    Upper cases postcodes and strips all whitespace so that differently
+    formatted postcodes share a key.
+    '''
+    return (pd.Series(postcodes, dtype=object).astype(str)
+            .str.upper().str.replace(r'\s+', '', regex=True).values)
+
+
+class PostcodeCoder:
+    '''PostcodeCoder
+    Maps postcodes and outward codes straight to region codes using the
+    administrative geographies that NSPL already carries, rather than
+    converting them to points and running a spatial join.
+
+    The coder is backed by a compact extract of NSPL, indexed on normalised
+    postcode with categorical region columns, which is built from the full
+    NSPL file once and stored in `data/interim`. Region columns that NSPL
+    doesn't have (e.g. older NUTS versions) are geocoded from the NSPL
+    coordinates with `multi_reverse_geocode`.
+
+    Region columns available without a spatial join are:
+        - lad: Local authority district
+        - lau2: Local administrative unit 2
+        - ttwa: Travel to work area
+        - lep_2017: LEP
+        - nuts2_2016, nuts3_2016: NUTS regions via the ONS LAU2 lookup
+
+    Args:
+        nspl_file (str): Path to the full NSPL CSV.
+        extract_file (str): Path to the NSPL extract.
+    '''
+    NSPL_COLUMNS = {
+        'pcds': 'postcode',
+        'lat': 'lat',
+        'long': 'long',
+        'laua': 'lad',
+        'nuts': 'lau2',
+        'ttwa': 'ttwa',
+        'lep1': 'lep_2017',
+    }
+    REGION_COLUMNS = ['lad', 'lau2', 'ttwa', 'lep_2017',
+                      'nuts2_2016', 'nuts3_2016']
+
+    def __init__(self, nspl_file=NSPL_FILE, extract_file=EXTRACT_FILE):
+        self.nspl_file = nspl_file
+        self.extract_file = extract_file
+        self.nspl = self._load_extract()
+        self._outward = None
+
+    def _load_extract(self):
+        '''_load_extract
+        Loads the NSPL extract, building it from the full NSPL file if it
+        doesn't exist yet.
+        '''
+        if os.path.isfile(self.extract_file):
+            return pd.read_parquet(self.extract_file)
+
+        logger.info('Building NSPL extract')
+        nspl = pd.read_csv(self.nspl_file, usecols=self.NSPL_COLUMNS.keys())
+        nspl = nspl.rename(columns=self.NSPL_COLUMNS)
+
+        lau_nuts = pd.read_csv(LAU_NUTS_URL,
+                               usecols=['LAU218CD', 'NUTS218CD', 'NUTS318CD'])
+        lau_nuts = (lau_nuts.drop_duplicates('LAU218CD')
+                    .set_index('LAU218CD'))
+        nspl['nuts2_2016'] = nspl['lau2'].map(lau_nuts['NUTS218CD'])
+        nspl['nuts3_2016'] = nspl['lau2'].map(lau_nuts['NUTS318CD'])
+
+        nspl['pcds_1st'] = nspl['postcode'].str.split(' ').str[0]
+        nspl.index = pd.Index(_normalise(nspl['postcode']), name='key')
+        nspl = nspl.drop(columns='postcode')
+        for col in self.REGION_COLUMNS + ['pcds_1st']:
+            nspl[col] = nspl[col].astype('category')
+
+        os.makedirs(os.path.dirname(self.extract_file), exist_ok=True)
+        nspl.to_parquet(self.extract_file)
+        return nspl
+
+    def _lookup(self, table, keys, columns):
+        '''_lookup
+        Hash joins keys against a table of postcodes, falling back to a
+        spatial join from the postcode coordinates for any columns that
+        aren't in the table.
+        '''
+        keys = pd.Index(np.unique(keys), name='key')
+        native = [c for c in columns if c in table.columns]
+        spatial = [c for c in columns if c not in table.columns]
+
+        pos = table.index.get_indexer(keys)
+        found = pos >= 0
+        coded = table.iloc[pos[found]][
+                list(dict.fromkeys(native + ['long', 'lat']))]
+        coded.index = keys[found]
+
+        if spatial:
+            shapes = {c: self._shape_spec(c) for c in spatial}
+            geocoded = multi_reverse_geocode(
+                    coded.reset_index(), shapes, place_id='key',
+                    coord_names=['long', 'lat'])
+            coded = coded.join(geocoded)
+        return coded[columns].reindex(keys)
+
+    @staticmethod
+    def _shape_spec(column):
+        '''_shape_spec
+        Shapefile spec for a NUTS column such as `nuts2_2013`.
+        '''
+        if not column.startswith('nuts'):
+            raise ValueError(f'{column} is not available from NSPL and can '
+                             'only be spatially joined for NUTS regions')
+        level, year = column[4:].split('_')
+        return (f'nuts2_{year}',
+                f'NUTS_RG_01M_{year}_4326_LEVL_{level}.shp.zip')
+
+    def code_postcodes(self, postcodes, columns):
+        '''code_postcodes
+        Assigns full postcodes to regions.
+
+        Args:
+            postcodes (array-like): Postcodes in any spacing or case.
+            columns (list): Region columns to return, e.g. `lad`, `lep_2017`,
+                `nuts2_2016`. NUTS columns for other years are spatially
+                joined using the NSPL coordinates. `lat` and `long` can also
+                be requested.
+
+        Returns:
+            (pd.DataFrame): Region codes aligned with `postcodes`. Postcodes
+                missing from NSPL are NaN.
+        '''
+        keys = _normalise(postcodes)
+        coded = self._lookup(self.nspl, keys, columns)
+        coded = coded.reindex(keys)
+        coded.index = pd.Index(postcodes)
+        return coded
+
+    def code_outward(self, outward, columns):
+        '''code_outward
+        Assigns outward codes (the part of a postcode before the space) to
+        regions, using the first postcode in NSPL for each outward code.
+
+        Args:
+            outward (array-like): Outward codes.
+            columns (list): Region columns to return. See `code_postcodes`.
+
+        Returns:
+            (pd.DataFrame): Region codes aligned with `outward`. Outward
+                codes missing from NSPL are NaN.
+        '''
+        if self._outward is None:
+            first = ~self.nspl['pcds_1st'].duplicated().values
+            self._outward = self.nspl[first].set_index('pcds_1st')
+            self._outward.index = pd.Index(
+                    self._outward.index.astype(str), name='pcds_1st')
+        keys = pd.Series(outward, dtype=object).astype(str).str.upper().values
+        coded = self._lookup(self._outward, keys, columns)
+        coded = coded.reindex(keys)
+        coded.index = pd.Index(outward)
+        return coded
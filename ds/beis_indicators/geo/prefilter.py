@@ -0,0 +1,166 @@
+import logging
+import numpy as np
+import shapely
+from shapely import STRtree
+
+
+logger = logging.getLogger(__name__)
+
+# Width, in the units of the boundaries' projection, of the band around
+# each boundary where points are tested against the full resolution
+# polygons. 0.005 degrees is roughly 500m.
+TOLERANCE = 0.005
+
+
+class PrefilteredTree:
+    '''PrefilteredTree
+    Two tier point in polygon index. Each polygon is shrunk by
+    `2 * tolerance` and simplified, which gives a much lighter polygon that
+    lies strictly inside the original. Points within these interiors are
+    resolved without touching the full resolution polygon, and only the
+    points within a band of the boundaries are tested exactly.
+
+    Interiors that intersect any other polygon are dropped, so a point in
+    an interior can only be within that one polygon and results are always
+    identical to an exact `STRtree.query(..., predicate='within')`.
+
+    Polygons can be split into groups, such as boundary vintages, that are
+    expected to overlap each other. Interiors are then only dropped if they
+    intersect another polygon in the same group, and points are tested
+    exactly unless they are in an interior in every group.
+
+    Args:
+        geoms (array-like): Polygon geometries.
+        tolerance (float): Width of the boundary band, in the units of the
+            geometries' projection.
+        groups (array-like): Group of each polygon. If None, all polygons
+            are in one group.
+    '''
+    def __init__(self, geoms, tolerance=TOLERANCE, groups=None):
+        self.geoms = np.asarray(geoms)
+        shapely.prepare(self.geoms)
+        self.tree = STRtree(self.geoms)
+        if groups is None:
+            groups = np.zeros(len(self.geoms), dtype=int)
+        _, self.groups = np.unique(groups, return_inverse=True)
+        self.n_groups = self.groups.max() + 1 if len(self.groups) else 0
+
+        interiors = shapely.simplify(
+                shapely.buffer(self.geoms, -2 * tolerance), tolerance,
+                preserve_topology=True)
+        keep = ~(shapely.is_missing(interiors) | shapely.is_empty(interiors))
+        interior_idx, geom_idx = self.tree.query(interiors,
+                                                 predicate='intersects')
+        clash = ((interior_idx != geom_idx)
+                 & (self.groups[interior_idx] == self.groups[geom_idx]))
+        overlapping = interior_idx[clash]
+        keep[overlapping] = False
+
+        self._interior_ids = np.flatnonzero(keep)
+        self.interiors = interiors[keep]
+        shapely.prepare(self.interiors)
+        self.interior_tree = STRtree(self.interiors)
+
+    def query(self, geometry, predicate='within'):
+        '''query
+        Finds the polygons that contain each point. Same interface as
+        `shapely.STRtree.query`, which is used directly for predicates other
+        than `within`.
+
+        Args:
+            geometry (array-like): Point geometries.
+            predicate (str): Spatial predicate.
+
+        Returns:
+            (np.array): 2 by n array of point and polygon indices, sorted by
+                point.
+        '''
+        if predicate != 'within':
+            return self.tree.query(geometry, predicate=predicate)
+
+        points = np.asarray(geometry)
+        point_idx, interior_idx = self.interior_tree.query(
+                points, predicate='within')
+        shape_idx = self._interior_ids[interior_idx]
+
+        # each point is in at most one interior per group
+        resolved = np.bincount(point_idx, minlength=len(points))
+        unresolved = np.flatnonzero(resolved < self.n_groups)
+        exact_point_idx, exact_shape_idx = self.tree.query(
+                points[unresolved], predicate='within')
+
+        # points resolved in some groups are also matched exactly, so
+        # duplicate matches are dropped
+        point_idx = np.concatenate([point_idx, unresolved[exact_point_idx]])
+        shape_idx = np.concatenate([shape_idx, exact_shape_idx])
+        pairs = np.unique(point_idx.astype(np.int64) * len(self.geoms)
+                          + shape_idx)
+        return np.vstack([pairs // len(self.geoms), pairs % len(self.geoms)])
+
+
+def _boundary_points(geoms, n_points, tolerance, rng):
+    '''_boundary_points
+    Random points scattered within `tolerance` of the polygon boundaries,
+    where the two tiers disagree if anything does.
+    '''
+    boundaries = shapely.boundary(geoms)
+    lines = rng.choice(boundaries, n_points)
+    points = shapely.line_interpolate_point(lines, rng.random(n_points),
+                                            normalized=True)
+    x, y = shapely.get_coordinates(points).T
+    offsets = rng.uniform(-tolerance, tolerance, (2, n_points))
+    return shapely.points(x + offsets[0], y + offsets[1])
+
+
+def verify_prefilter(geoms, n_points=100000, tolerance=TOLERANCE, seed=0,
+        groups=None):
+    '''verify_prefilter
+    Checks that `PrefilteredTree` gives exactly the same matches as an exact
+    spatial join for random points over the polygons' bounds and random
+    points close to their boundaries.
+
+    Args:
+        geoms (array-like): Polygon geometries.
+        n_points (int): Number of points of each kind to check.
+        tolerance (float): Tolerance of the prefilter.
+        seed (int): Random seed.
+        groups (array-like): Group of each polygon. See `PrefilteredTree`.
+
+    Returns:
+        (int): Number of points checked.
+
+    Raises:
+        AssertionError: If any point is matched differently.
+    '''
+    geoms = np.asarray(geoms)
+    rng = np.random.default_rng(seed)
+    xmin, ymin, xmax, ymax = shapely.total_bounds(geoms)
+    points = np.concatenate([
+        shapely.points(rng.uniform(xmin, xmax, n_points),
+                       rng.uniform(ymin, ymax, n_points)),
+        _boundary_points(geoms, n_points, tolerance, rng),
+        ])
+
+    exact = STRtree(geoms).query(points, predicate='within')
+    exact = exact[:, np.lexsort((exact[1], exact[0]))]
+    fast = PrefilteredTree(geoms, tolerance, groups).query(points,
+                                                           predicate='within')
+    n_mismatched = len(set(map(tuple, exact.T)) ^ set(map(tuple, fast.T)))
+    assert n_mismatched == 0, f'{n_mismatched} point matches differ'
+    assert np.array_equal(exact, fast), \
+        'Point matches are in a different order'
+    return len(points)
+
+
+if __name__ == '__main__':
+    from beis_indicators.geo.coders import NutsCoder
+
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    for level in [2, 3]:
+        coder = NutsCoder(level=level)
+        for year in coder.shapes:
+            shape = coder.shapes[year].to_crs(coder.PROJECTION)
+            n = verify_prefilter(shape.geometry.values)
+            logger.info(f'NUTS{level} {year}: {n} points match the exact join')
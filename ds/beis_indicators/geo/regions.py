@@ -0,0 +1,126 @@
+import logging
+import numpy as np
+import os
+import pandas as pd
+
+from beis_indicators import project_dir
+
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_FILE = f'{project_dir}/data/interim/region_registry.parquet'
+REGISTRY_COLUMNS = ['geography', 'vintage', 'level', 'code', 'name',
+                    'parent']
+
+
+def _nuts_regions(levels):
+    '''_nuts_regions
+    Region codes and names for every NUTS vintage at each level.
+    '''
+    from beis_indicators.geo.coders import NutsCoder
+
+    regions = []
+    for level in levels:
+        coder = NutsCoder(level=level)
+        for year, shape in coder.shapes.items():
+            regions.append(pd.DataFrame({
+                'geography': 'nuts',
+                'vintage': year,
+                'level': level,
+                'code': shape['NUTS_ID'].values,
+                'name': shape['NUTS_NAME'].values,
+                'parent': (shape['NUTS_ID'].str[:-1].values if level > 0
+                           else None),
+                }))
+    return regions
+
+
+def _lep_regions():
+    '''_lep_regions
+    Region codes and names for every LEP vintage.
+    '''
+    from beis_indicators.geo.coders import LepCoder
+
+    regions = []
+    coder = LepCoder()
+    for year, shape in coder.shapes.items():
+        regions.append(pd.DataFrame({
+            'geography': 'lep',
+            'vintage': year,
+            'level': None,
+            'code': shape['lep_id'].values,
+            'name': shape[f'lep{str(year)[-2:]}nm'].values,
+            'parent': None,
+            }))
+    return regions
+
+
+def build_region_registry(nuts_levels=(0, 1, 2, 3), fout=REGISTRY_FILE):
+    '''build_region_registry
+    Builds a table of every region's code, name, level and parent for each
+    boundary vintage, without geometries, and saves it. The boundaries are
+    only loaded once, when the registry is built.
+
+    Args:
+        nuts_levels (tuple): NUTS levels to include.
+        fout (str): Path to save the registry to.
+
+    Returns:
+        registry (pd.DataFrame): The region registry.
+    '''
+    logger.info('Building region registry')
+    registry = pd.concat(_nuts_regions(nuts_levels) + _lep_regions(),
+                         ignore_index=True)
+    registry = registry[REGISTRY_COLUMNS]
+    registry['level'] = registry['level'].astype('Int64')
+    for col in ['geography', 'name', 'parent']:
+        registry[col] = registry[col].astype('category')
+
+    os.makedirs(os.path.dirname(fout), exist_ok=True)
+    registry.to_parquet(fout, index=False)
+    return registry
+
+
+def load_region_registry(fin=REGISTRY_FILE):
+    '''load_region_registry
+    Loads the region registry, building it if it doesn't exist yet.
+
+    Returns:
+        registry (pd.DataFrame): Registry with the columns geography,
+            vintage, level, code, name and parent.
+    '''
+    if not os.path.isfile(fin):
+        return build_region_registry(fout=fin)
+    return pd.read_parquet(fin)
+
+
+def region_names(codes, vintages, geography, level=None, registry=None):
+    '''region_names
+    Looks up the names of regions from their codes and boundary vintages.
+
+    Args:
+        codes (array-like): Region codes.
+        vintages (array-like): Boundary vintage of each code. Negative
+            vintages, used to flag interpolated years, are treated as
+            positive.
+        geography (str): `nuts` or `lep`.
+        level (int): NUTS level. None for geographies without levels.
+        registry (pd.DataFrame): Region registry. Loaded if not given.
+
+    Returns:
+        (np.array): Name of each region. NaN where the code is not in the
+            registry for that vintage.
+    '''
+    if registry is None:
+        registry = load_region_registry()
+    regions = registry[registry['geography'] == geography]
+    if level is not None:
+        regions = regions[regions['level'] == level]
+    regions = regions.set_index(['vintage', 'code'])['name']
+
+    keys = pd.MultiIndex.from_arrays(
+            [np.abs(np.asarray(vintages)), np.asarray(codes)])
+    pos = regions.index.get_indexer(keys)
+    names = regions.astype(object).values[pos]
+    names[pos < 0] = np.nan
+    return names
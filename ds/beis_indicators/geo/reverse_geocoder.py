@@ -2,13 +2,14 @@ import os
 import requests
 import geopandas as gp
 import pandas as pd
+import numpy as np
 from zipfile import ZipFile
 import beis_indicators
 import json
 from io import StringIO, BytesIO
-from shapely.geometry import Point
 
-import beis_indicators
+from beis_indicators.geo.lookup_store import GeoLookupStore, NO_REGION
+
 
 project_dir = beis_indicators.project_dir
 
@@ -53,27 +54,19 @@ def get_shape(file_name, path):
         print(f"{file_name} already collected")
 
 
-def reverse_geocode(
-    place_df, shape_name, shape_file, place_id, coord_names=["longitude", "latitude"]
-):
+def _read_shape(shape_name, shape_file):
     """
-    The reverse geocoder takes a df with geographical coordinates and does a spatial merge with a shapefile.
+    Reads a shapefile, extracting it first if it is zipped. Zips are only
+    extracted the first time they are read.
 
     Args:
-        place_df (df). A dataframe where every row is an entity we want to reverse geocode
         shape_name (str): The name of the shapefile we used
         shape_file (str) the name of the actual shapefile.
-        place_id (str): the name of the variable with the place id in place dfs
-        coord_names (list): Names for the lon and lat variables in the place_df
 
     Returns:
-        A spatially merged df with the location ids and their
-
+        A GeoDataFrame of the shapes projected to lat/lon
 
     """
-    # Read the shapefile
-    print("Reading shapefile...")
-
     source = f"{project_dir}/data/raw/shapefiles/{shape_name}/{shape_file}"
 
     # Do we need to unzip it?
@@ -81,36 +74,201 @@ def reverse_geocode(
     if "zip" in shape_file.lower():
 
         # Here we are removing the .shp.zip
-        target = f"{project_dir}/data/raw/shapefiles/{shape_name}/{shape_file}".split(
-            ".shp"
-        )[0]
+        target = source.split(".shp")[0]
 
-        with ZipFile(source, "r") as infile:
-            infile.extractall(target)
+        if not os.path.isdir(target):
+            with ZipFile(source, "r") as infile:
+                infile.extractall(target)
 
         # Get the shapefile name
-        sh = [x for x in os.listdir(target) if ".shp" in x.lower()][0]
+        sh = [x for x in os.listdir(target) if x.lower().endswith(".shp")][0]
 
         shape = gp.read_file(f"{target}/{sh}")
 
     else:
-        shape = gp.read_file(f"{target}/{sh}")
+        shape = gp.read_file(source)
 
     # Change its projection so it can deal with lats and lons
-    shape = shape.to_crs("EPSG:4326")
+    return shape.to_crs("EPSG:4326")
 
-    # Create a place_holder df (ho ho) where the index is the place id
-    place_holder = gp.GeoDataFrame(index=place_df[place_id], crs="EPSG:4326")
 
-    # Create the geo field for spatial merge using Point
-    place_holder["geometry"] = [
-        Point(x[coord_names[0]], x[coord_names[1]]) for rid, x in place_df.iterrows()
-    ]
+def _place_points(place_df, coord_names):
+    """
+    Builds lat/lon points for every row in a df in one vectorised step.
+    """
+    return gp.points_from_xy(
+        place_df[coord_names[0]], place_df[coord_names[1]], crs="EPSG:4326"
+    )
+
+
+def reverse_geocode(
+    place_df, shape_name, shape_file, place_id, coord_names=["longitude", "latitude"]
+):
+    """
+    The reverse geocoder takes a df with geographical coordinates and does a spatial merge with a shapefile.
+
+    Args:
+        place_df (df). A dataframe where every row is an entity we want to reverse geocode
+        shape_name (str): The name of the shapefile we used
+        shape_file (str) the name of the actual shapefile.
+        place_id (str): the name of the variable with the place id in place dfs
+        coord_names (list): Names for the lon and lat variables in the place_df
+
+    Returns:
+        A spatially merged df with the location ids and their
+
+
+    """
+    # Read the shapefile
+    print("Reading shapefile...")
+
+    shape = _read_shape(shape_name, shape_file)
+
+    # Create a place_holder df (ho ho) where the index is the place id
+    place_holder = gp.GeoDataFrame(
+        index=place_df[place_id], geometry=_place_points(place_df, coord_names)
+    )
 
     print("Joining...")
 
     # Spatial join: looks for points inside the polygons
-    joined = gp.sjoin(place_holder, shape, op="within")
+    joined = gp.sjoin(place_holder, shape, predicate="within")
 
     # Return the joined df
     return joined
+
+
+def nuts_shapes(years, level=2):
+    """
+    Names of the NUTS shapefiles for a set of years, in the format taken by
+    multi_reverse_geocode
+
+    Args:
+        years (list): NUTS versions
+        level (int): NUTS level
+
+    Returns:
+        A dict of nuts{level}_{year} to (shape_name, shape_file)
+    """
+    return {
+        f"nuts{level}_{str(y)}": (
+            f"nuts2_{str(y)}",
+            f"NUTS_RG_01M_{str(y)}_4326_LEVL_{level}.shp.zip",
+        )
+        for y in years
+    }
+
+
+def _multi_reverse_geocode(points, shapes, region_col):
+    """
+    Reverse geocodes points against several shapefiles, indexing the points
+    once and querying each shapefile's polygons against that index.
+
+    Returns:
+        A df with a column of region codes for each shapefile, in the same
+        order as points
+    """
+    tree = points.sindex
+
+    wide = pd.DataFrame(index=np.arange(len(points)))
+    for name, (shape_name, shape_file) in shapes.items():
+        print(f"Joining {name}...")
+        shape = _read_shape(shape_name, shape_file)
+        shape_idx, point_idx = tree.query(shape.geometry, predicate="contains")
+
+        # Keep the first region for points on shared boundaries
+        codes = pd.Series(shape[region_col].values[shape_idx], index=point_idx)
+        codes = codes[~codes.index.duplicated()]
+        wide[name] = codes.reindex(wide.index).values
+
+    return wide
+
+
+def _store_column(shape_name, shape_file, region_col):
+    """
+    Name of the GeoLookupStore column for a shapefile's region codes. It
+    includes everything that determines the codes, so different shapefiles
+    or region columns under the same output name don't share results.
+    """
+    return f"{shape_name}__{shape_file}__{region_col}"
+
+
+def multi_reverse_geocode(
+    place_df,
+    shapes,
+    place_id,
+    coord_names=["longitude", "latitude"],
+    region_col="NUTS_ID",
+    store=True,
+):
+    """
+    Reverse geocodes a df against several shapefiles (e.g. NUTS versions) in
+    one pass. Points are built once and indexed once, and each shapefile's
+    polygons are queried against that index.
+
+    By default this reads through the shared GeoLookupStore so only points
+    that have not been geocoded before are joined, and the new results are
+    added to the store. Stored results are keyed on the shapefile and
+    region_col rather than the output column names.
+
+    Args:
+        place_df (df). A dataframe where every row is an entity we want to reverse geocode
+        shapes (dict): Output column names mapped to (shape_name, shape_file)
+            pairs as taken by reverse_geocode. See nuts_shapes.
+        place_id (str): the name of the variable with the place id in place dfs
+        coord_names (list): Names for the lon and lat variables in the place_df
+        region_col (str): Name of the region code variable in the shapefiles
+        store (bool or GeoLookupStore): Store to read through. If True the
+            default store is used and if False every point is geocoded.
+
+    Returns:
+        A df indexed by place id with a column of region codes for each shapefile.
+        Places outside all regions in a shapefile are NaN.
+
+    """
+    lon = place_df[coord_names[0]].values
+    lat = place_df[coord_names[1]].values
+
+    if store is False:
+        points = gp.GeoSeries(_place_points(place_df, coord_names))
+        wide = _multi_reverse_geocode(points, shapes, region_col)
+        wide.index = place_df[place_id]
+        return wide
+
+    if store is True:
+        store = GeoLookupStore()
+
+    # Points without coordinates can't be geocoded or keyed
+    valid = pd.notnull(lon) & pd.notnull(lat)
+    keys = store.keys(lon[valid], lat[valid])
+    columns = {
+        name: _store_column(shape_name, shape_file, region_col)
+        for name, (shape_name, shape_file) in shapes.items()
+    }
+    known = store.lookup(keys, list(columns.values()))
+    known.columns = list(shapes)
+
+    missing = known.isnull()
+    todo = keys[missing.any(axis=1).values].unique()
+    if len(todo) > 0:
+        print(f"Geocoding {len(todo)} new points...")
+        todo_shapes = {k: v for k, v in shapes.items() if missing[k].any()}
+        scale = 10 ** store.dp
+        points = gp.GeoSeries(
+            gp.points_from_xy(
+                todo.get_level_values(0) / scale,
+                todo.get_level_values(1) / scale,
+                crs="EPSG:4326",
+            )
+        )
+        new = _multi_reverse_geocode(points, todo_shapes, region_col)
+        new.index = todo
+        new.columns = [columns[name] for name in new.columns]
+        store.update(new.loc[:, ~new.columns.duplicated()])
+        store.save()
+        known = store.lookup(keys, list(columns.values()))
+        known.columns = list(shapes)
+
+    wide = pd.DataFrame(index=place_df[place_id], columns=list(shapes))
+    wide.iloc[valid] = known.replace(NO_REGION, np.nan).values
+    return wide
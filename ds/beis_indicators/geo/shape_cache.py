@@ -0,0 +1,175 @@
+import geopandas as gpd
+import json
+import logging
+import os
+import tempfile
+
+from beis_indicators import project_dir
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = f'{project_dir}/data/interim/shape_cache'
+
+
+def _cache_file(geography, year, level, resolution, crs, cache_dir):
+    '''_cache_file
+    Path of the cached boundaries for a combination of boundary parameters.
+    '''
+    crs = str(crs).lower().replace(':', '')
+    level = 'na' if level is None else level
+    resolution = 'na' if resolution is None else str(resolution).zfill(2)
+    fname = f'{geography}_{year}_lvl{level}_{resolution}m_{crs}.parquet'
+    return os.path.join(cache_dir, fname)
+
+
+def _source_stamp(source):
+    '''_source_stamp
+    Path, size and modification time of the file boundaries were parsed
+    from, or None if there is no source file to compare against.
+    '''
+    if source is None or not os.path.isfile(source):
+        return None
+    stat = os.stat(source)
+    return {'source': os.path.abspath(source),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime}
+
+
+def _write_stamp(stamp, fout):
+    '''_write_stamp
+    Records the source of a cache file next to it, or removes the record if
+    there is no source.
+    '''
+    fstamp = f'{fout}.json'
+    if stamp is None:
+        if os.path.exists(fstamp):
+            os.remove(fstamp)
+        return
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fout), suffix='.part')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(stamp, f)
+        os.replace(tmp, fstamp)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _is_current(fout, source):
+    '''_is_current
+    Whether a cache file was built from `source` as it is now. Caches are
+    kept if the source file has since been removed.
+    '''
+    stamp = _source_stamp(source)
+    if stamp is None:
+        return True
+    fstamp = f'{fout}.json'
+    if not os.path.isfile(fstamp):
+        return False
+    with open(fstamp, 'r') as f:
+        return json.load(f) == stamp
+
+
+def read_shape_cache(geography, year, level, resolution, crs,
+        cache_dir=CACHE_DIR, source=None):
+    '''read_shape_cache
+    Reads cached boundaries, memory mapping the file where possible. If the
+    boundaries' source file is given and has changed since they were
+    cached, the cache is treated as missing.
+
+    Args:
+        geography (str): Boundary type and source format, e.g.
+            `nuts_geojson` or `nuts_shp`.
+        year (int): Boundary specification year.
+        level (int): Region level. None for geographies without levels.
+        resolution (int): Boundary resolution. None if not applicable.
+        crs (str): Projection of the cached geometries.
+        cache_dir (str): Directory where cached boundaries are stored.
+        source (str): File the boundaries were parsed from.
+
+    Returns:
+        gdf (gpd.GeoDataFrame): Cached boundaries or None if there is no
+            up to date cache for these parameters.
+    '''
+    fin = _cache_file(geography, year, level, resolution, crs, cache_dir)
+    if not os.path.isfile(fin):
+        return None
+    if not _is_current(fin, source):
+        logger.info(f'{source} has changed since {fin} was cached')
+        return None
+    try:
+        return gpd.read_parquet(fin, memory_map=True)
+    except ImportError:
+        logger.warning('pyarrow is not installed. Shape cache disabled.')
+        return None
+
+
+def write_shape_cache(gdf, geography, year, level, resolution, crs,
+        cache_dir=CACHE_DIR, source=None):
+    '''write_shape_cache
+    Writes boundaries to a GeoParquet file with WKB encoded geometries,
+    along with the path, size and modification time of their source file.
+
+    Args:
+        gdf (gpd.GeoDataFrame): Boundaries to cache.
+        geography (str): Boundary type and source format, e.g.
+            `nuts_geojson` or `nuts_shp`.
+        year (int): Boundary specification year.
+        level (int): Region level. None for geographies without levels.
+        resolution (int): Boundary resolution. None if not applicable.
+        crs (str): Projection of the cached geometries.
+        cache_dir (str): Directory where cached boundaries are stored.
+        source (str): File the boundaries were parsed from.
+    '''
+    fout = _cache_file(geography, year, level, resolution, crs, cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Written under a temporary name first, so that a reader in another
+    # process never sees a partly written file
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.part')
+    os.close(fd)
+    try:
+        gdf.to_parquet(tmp, index=False)
+        os.replace(tmp, fout)
+        _write_stamp(_source_stamp(source), fout)
+    except ImportError:
+        logger.warning('pyarrow is not installed. Shape cache disabled.')
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def cached_shape(loader, geography, year, level=None, resolution=None,
+        crs='EPSG:4326', cache_dir=CACHE_DIR, source=None):
+    '''cached_shape
+    Loads boundaries from the shape cache, falling back to `loader` and
+    caching its output on the first load. Boundaries are cached after being
+    projected to `crs` so later loads skip both parsing and re-projection.
+    They are loaded again if their source file changes.
+
+    Args:
+        loader (function): Called without arguments to load the boundaries
+            from their source files if they are not cached.
+        geography (str): Boundary type and source format, e.g.
+            `nuts_geojson` or `nuts_shp`.
+        year (int): Boundary specification year.
+        level (int): Region level. None for geographies without levels.
+        resolution (int): Boundary resolution. None if not applicable.
+        crs (str): Projection of the returned geometries.
+        cache_dir (str): Directory where cached boundaries are stored.
+        source (str): File that `loader` parses. It may not exist until
+            `loader` has downloaded it.
+
+    Returns:
+        gdf (gpd.GeoDataFrame): Boundaries projected to `crs`.
+    '''
+    gdf = read_shape_cache(geography, year, level, resolution, crs,
+            cache_dir, source)
+    if gdf is None:
+        gdf = loader()
+        if gdf.crs is not None:
+            gdf = gdf.to_crs(crs)
+        write_shape_cache(gdf, geography, year, level, resolution, crs,
+                cache_dir, source)
+    return gdf
@@ -0,0 +1,82 @@
+import numpy as np
+import pyproj
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+CHUNK_SIZE = 1_000_000
+
+# pyproj transformers must not be shared between threads, so each thread
+# keeps its own registry
+_local = threading.local()
+
+
+def get_transformer(pin, pout, always_xy=True):
+    '''get_transformer
+    Returns a cached transformer between two projections, creating it on
+    the first request from the current thread.
+
+    Args:
+        pin (str): Input projection, e.g. `EPSG:27700`.
+        pout (str): Output projection.
+        always_xy (bool): If True, coordinates are always in x, y (lon, lat)
+            order, whatever the axis order of the projections' definitions.
+
+    Returns:
+        (pyproj.Transformer)
+    '''
+    if not hasattr(_local, 'transformers'):
+        _local.transformers = {}
+    key = (str(pin).upper(), str(pout).upper(), always_xy)
+    if key not in _local.transformers:
+        _local.transformers[key] = pyproj.Transformer.from_crs(
+                pin, pout, always_xy=always_xy)
+    return _local.transformers[key]
+
+
+def _transform_chunk(x, y, pin, pout, always_xy):
+    get_transformer(pin, pout, always_xy).transform(x, y, inplace=True)
+
+
+def transform_coordinates(x, y, pin, pout, always_xy=True,
+        chunk_size=CHUNK_SIZE, n_threads=1, inplace=False):
+    '''transform_coordinates
+    Translates vectors of spatial coordinates from one projection to
+    another. Coordinates are transformed in place in fixed size chunks,
+    during which pyproj releases the GIL, so chunks can be spread over
+    threads.
+
+    Args:
+        x (array-like): Vector of horizontal spatial coordinates.
+        y (array-like): Vector of vertical spatial coordinates.
+        pin (str): Projection of input vectors.
+        pout (str): Output projection.
+        always_xy (bool): See `get_transformer`. The default returns
+            longitude, latitude for geographic projections.
+        chunk_size (int): Number of coordinates transformed per call.
+        n_threads (int): Number of threads to transform chunks with.
+        inplace (bool): If True and `x` and `y` are contiguous float64
+            arrays, they are overwritten rather than copied.
+
+    Returns:
+        (tuple of np.array): Translated coordinate vectors.
+    '''
+    if inplace:
+        x = np.ascontiguousarray(x, dtype=np.float64)
+        y = np.ascontiguousarray(y, dtype=np.float64)
+    else:
+        x = np.array(x, dtype=np.float64, order='C')
+        y = np.array(y, dtype=np.float64, order='C')
+    if str(pin).upper() == str(pout).upper():
+        return x, y
+
+    chunks = [(x[i:i + chunk_size], y[i:i + chunk_size], pin, pout,
+               always_xy) for i in range(0, len(x), chunk_size)]
+    if n_threads == 1 or len(chunks) == 1:
+        for chunk in chunks:
+            _transform_chunk(*chunk)
+    else:
+        with ThreadPoolExecutor(n_threads) as executor:
+            list(executor.map(lambda chunk: _transform_chunk(*chunk),
+                              chunks))
+    return x, y
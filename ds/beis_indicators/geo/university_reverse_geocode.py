@@ -3,6 +3,8 @@ from collections import defaultdict
 import geopandas as gp
 from io import StringIO, BytesIO
 import json
+import logging
+import numpy as np
 import os
 import pandas as pd 
 import requests
@@ -13,9 +15,18 @@ import beis_indicators
 project_dir = beis_indicators.project_dir
 
 # from beis_indicators.geo.reverse_geocoder import *
-from beis_indicators.utils.nuts_utils import NUTS_YEARS, NUTS_ENFORCED
-from beis_indicators.utils.geo_utils import (load_nuts_regions, load_leps_regions, 
-        reverse_geocode, coordinates_to_points)
+from beis_indicators.geo.coders import LepCoder, NutsCoder
+from beis_indicators.geo.lookup_store import NO_REGION
+from beis_indicators.geo.nuts import NUTS_ENFORCED
+
+logger = logging.getLogger(__name__)
+
+UNI_REGIONS_FILE = f'{project_dir}/data/interim/universities/uni_regions.csv'
+UNI_REGIONS_COLUMNS = ['ukprn', 'coord_hash', 'region_type', 'year_spec',
+                       'region_id']
+
+# University region tables already loaded in this process
+_UNI_REGIONS = {}
 
 # if 'shapefiles' not in os.listdir(f'{project_dir}/data/raw'):
 #     os.mkdir(f'{project_dir}/data/raw/shapefiles')
@@ -59,45 +70,157 @@ def get_uni_metadata():
         os.mkdir(uni_meta_dir)
     uni_meta.to_csv(f'{uni_meta_dir}/uni_metadata.csv', index=False)
 
-def reverse_geocode_unis(uni_meta):
+def _coord_hash(lon, lat, dp=6):
+    """_coord_hash
+    Short hash of coordinates rounded to `dp` decimal places, used to spot
+    providers that have moved since they were last geocoded.
+    """
+    coords = pd.DataFrame({'lon': np.round(np.asarray(lon, dtype=float), dp),
+                           'lat': np.round(np.asarray(lat, dtype=float), dp)})
+    return pd.util.hash_pandas_object(coords, index=False).map(
+            '{:016x}'.format).values
+
+
+def _geocode_places(places):
+    """_geocode_places
+    Codes providers into every NUTS2, NUTS3 and LEP vintage. Each coder
+    loads its boundaries once and joins all of its vintages in one pass.
+    Providers outside every region get a single `NO_REGION` row, so that
+    they are not geocoded again on the next build.
+    """
+    coders = {
+        'nuts2': NutsCoder(level=2),
+        'nuts3': NutsCoder(level=3),
+        'lep': LepCoder(),
+        }
+
+    coded = []
+    for region_type, coder in coders.items():
+        point_idx, vintages, ids = coder.join_all_vintages(
+                places['lon'].values, places['lat'].values, 'EPSG:4326')
+        matched = places.iloc[point_idx]
+        coded.append(pd.DataFrame({
+            'ukprn': matched['ukprn'].values,
+            'coord_hash': matched['coord_hash'].values,
+            'region_type': region_type,
+            'year_spec': vintages,
+            'region_id': ids,
+            }))
+    coded = pd.concat(coded, ignore_index=True)
+
+    unmatched = places[~places['ukprn'].isin(coded['ukprn'])]
+    coded = pd.concat([coded, pd.DataFrame({
+        'ukprn': unmatched['ukprn'].values,
+        'coord_hash': unmatched['coord_hash'].values,
+        'region_type': NO_REGION,
+        'year_spec': np.nan,
+        'region_id': NO_REGION,
+        })], ignore_index=True)
+    return coded
+
+
+def reverse_geocode_unis(uni_meta, fout=UNI_REGIONS_FILE):
     """reverse_geocode_unis
-    Codes universities into NUTS2, NUTS3 and LEP regions.
+    Codes universities into NUTS2, NUTS3 and LEP regions for every boundary
+    vintage and materialises the results in a single table keyed on UKPRN
+    and a hash of each provider's coordinates. Only providers that are new
+    or have moved since the table was last built are geocoded; providers
+    that are no longer in `uni_meta` are dropped. Providers outside every
+    region are kept with a `region_type` of `NO_REGION`.
 
     Args:
         uni_meta (pd.DataFrame): Table of university metadata.
+        fout (str): Path of the university regions table.
+
+    Returns:
+        (pd.DataFrame): The university regions table.
     """
+    uni_meta = uni_meta.dropna(subset=['UKPRN', 'LONGITUDE', 'LATITUDE'])
+    places = pd.DataFrame({
+        'ukprn': uni_meta['UKPRN'].astype(int).astype(str).values,
+        'coord_hash': _coord_hash(uni_meta['LONGITUDE'],
+                                  uni_meta['LATITUDE']),
+        'lon': uni_meta['LONGITUDE'].values,
+        'lat': uni_meta['LATITUDE'].values,
+        }).drop_duplicates('ukprn')
+
+    if os.path.isfile(fout):
+        existing = pd.read_csv(fout, dtype={'ukprn': str, 'coord_hash': str})
+    else:
+        existing = pd.DataFrame(columns=UNI_REGIONS_COLUMNS)
+
+    keys = ['ukprn', 'coord_hash']
+    current = existing.merge(places[keys], on=keys)
+    todo = places[~places.set_index(keys).index.isin(
+            existing.set_index(keys).index)]
 
-    shapefile_dir = f'{project_dir}/data/raw/shapefiles'
-    out_dir = f'{project_dir}/data/metadata/universities'
-    if not os.path.isdir(out_dir):
-        os.mkdir(out_dir)
-
-    uni_meta = coordinates_to_points(uni_meta, 'LONGITUDE', 'LATITUDE')
-
-    for level in [2, 3]:
-        uni_nuts_regions = []
-        for year in NUTS_YEARS:
-            nuts = load_nuts_regions(year, shapefile_dir, level=level)
-            joined = reverse_geocode(uni_meta, nuts, 'EPSG:4326')
-            joined['nuts_year_spec'] = year
-            joined = joined.rename(columns={'NUTS_ID': 'nuts_id', 'UKPRN': 'ukprn'})
-            joined = joined[['ukprn', 'nuts_id', 'nuts_year_spec']]
-            joined['nuts_enforced'] = joined['nuts_year_spec'].map(NUTS_ENFORCED)
-            uni_nuts_regions.append(joined)
-
-        uni_nuts_df = pd.concat(uni_nuts_regions)
-        uni_nuts_df.to_csv(f'{project_dir}/data/interim/hesa/uni_nuts{level}_geos.csv', index=False)
-    
-    uni_leps_regions = []
-    for year in [2014, 2017]:
-        leps = load_leps_regions(year, shapefile_dir)
-        joined = reverse_geocode(uni_meta, leps, 'EPSG:4326')
-        col = f'lep{str(year)[-2:]}cd'
-        lep_ver = f'lep_{year}'
-        joined = joined.rename(columns={col: 'lep_id', 'UKPRN': 'ukprn'})
-        joined['lep_year_spec'] = year
-        uni_leps_regions.append(joined)
-
-    uni_leps_df = pd.concat(uni_leps_regions)
-    uni_leps_df.to_csv(f'{project_dir}/data/interim/hesa/uni_lep_geos.csv')
+    logger.info(f'Geocoding {len(todo)} new or moved universities')
+    regions = current
+    if len(todo) > 0:
+        regions = pd.concat([current, _geocode_places(todo)],
+                            ignore_index=True)
+    regions = (regions[UNI_REGIONS_COLUMNS]
+               .astype({'year_spec': 'Int64'})
+               .sort_values(['region_type', 'year_spec', 'ukprn'])
+               .reset_index(drop=True))
 
+    os.makedirs(os.path.dirname(fout), exist_ok=True)
+    regions.to_csv(fout, index=False)
+    _UNI_REGIONS.pop(fout, None)
+    return regions
+
+
+def load_uni_regions(fin=UNI_REGIONS_FILE):
+    """load_uni_regions
+    Loads the university regions table, indexed on region type, boundary
+    year and UKPRN, leaving out providers outside every region. The table is
+    kept in memory after the first load.
+
+    Returns:
+        (pd.DataFrame): `region_id` and `coord_hash` of each university.
+    """
+    if fin not in _UNI_REGIONS:
+        regions = pd.read_csv(fin, dtype={'ukprn': str, 'coord_hash': str})
+        regions = regions[regions['region_type'] != NO_REGION].astype(
+                {'year_spec': int})
+        _UNI_REGIONS[fin] = (regions
+                .set_index(['region_type', 'year_spec', 'ukprn'])
+                .sort_index())
+    return _UNI_REGIONS[fin]
+
+
+def uni_geos(region_type):
+    """uni_geos
+    University regions for one region type, in the format used by the HESA
+    indicators.
+
+    Args:
+        region_type (str): `nuts2`, `nuts3` or `lep`.
+
+    Returns:
+        (pd.DataFrame): Columns `ukprn`, `{geo}_id` and `{geo}_year_spec`,
+            plus `nuts_enforced` for NUTS regions.
+    """
+    geo = 'lep' if region_type == 'lep' else 'nuts'
+    regions = (load_uni_regions()
+               .loc[region_type, ['region_id']]
+               .reset_index()
+               .rename(columns={'region_id': f'{geo}_id',
+                                'year_spec': f'{geo}_year_spec'}))
+    regions = regions[['ukprn', f'{geo}_id', f'{geo}_year_spec']]
+    if geo == 'nuts':
+        regions['nuts_enforced'] = regions['nuts_year_spec'].map(
+                NUTS_ENFORCED)
+    return regions
+
+
+def uni_nuts_lookup(level=2):
+    """uni_nuts_lookup
+    University NUTS regions as a nested dict of UKPRN to `nuts{level}_{year}`
+    to NUTS ID, as used by the HEBCI and REF indicators.
+    """
+    regions = load_uni_regions().loc[f'nuts{level}', 'region_id']
+    lookup = defaultdict(dict)
+    for (year, ukprn), nuts_id in regions.items():
+        lookup[ukprn][f'nuts{level}_{year}'] = nuts_id
+    return dict(lookup)
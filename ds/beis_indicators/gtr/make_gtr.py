@@ -7,7 +7,7 @@ from beis_indicators.hesa.hesa_processing import multiple_nuts_estimates
 from data_getters.core import get_engine
 from data_getters.labs.core import download_file
 
-from beis_indicators.geo.reverse_geocoder import reverse_geocode
+from beis_indicators.geo.reverse_geocoder import multi_reverse_geocode, nuts_shapes
 
 PROJECT_DIR = beis_indicators.project_dir
 
@@ -43,20 +43,12 @@ def multi_geocode(source_df, lon_lat, ent_id, years):
     Returns a dict where the keys are the ids for a place and the values are dicts for different
     nuts years
     """
-    nutified = [
-        reverse_geocode(
-            place_df=source_df,
-            shape_name=f"nuts2_{str(y)}",
-            shape_file=f"NUTS_RG_01M_{str(y)}_4326_LEVL_2.shp.zip",
-            place_id=ent_id,
-            coord_names=lon_lat,
-        )["NUTS_ID"]
-        for y in years
-    ]
-
-    # create a df and turn into a dict
-    nutified_df = pd.concat(nutified, axis=1)
-    nutified_df.columns = [f"nuts2_{str(y)}" for y in years]
+    nutified_df = multi_reverse_geocode(
+        place_df=source_df,
+        shapes=nuts_shapes(years),
+        place_id=ent_id,
+        coord_names=lon_lat,
+    )
     nutified_dict = nutified_df.to_dict(orient="index")
     return nutified_dict
 
@@ -1,17 +1,16 @@
 # Script to make HESA indicators
 import csv
 import zipfile
-import io
 import os
-import requests
 import beis_indicators
+from beis_indicators.data.download import fetch
 import numpy as np
 import json
 
 from beis_indicators.utils.dir_file_management import *
 
+from beis_indicators.geo.nuts import nuts_earliest
 # from beis_indicators.utils.geo_utils import leps_year_spec
-# from beis_indicators.utils.nuts_utils import nuts_earliest
 
 project_dir = beis_indicators.project_dir
 
@@ -43,10 +42,8 @@ def hesa_parser(url, out_name, skip=16, encoding="utf-8"):
     """
     if f"{out_name}.txt" not in os.listdir(f"{project_dir}/data/raw/hesa/"):
         # Request and parse
-        rs = requests.get(url)
-
-        # Parse the file
-        parsed = rs.content.decode(encoding)
+        with open(fetch(url), "rb") as infile:
+            parsed = infile.read().decode(encoding)
 
         # Save it
 
@@ -112,7 +109,7 @@ def university_indicator(
         year_col = "nuts_year_spec"
         region_id_col = "nuts_id"
         groupby_year_col = "nuts_year_spec"
-        data["year_regions"] = data["academic_year"].apply(nuts_earliest)
+        data["year_regions"] = nuts_earliest(data["academic_year"].values)
     elif region_type == "lep":
         year_col = "lep_year_spec"
         groupby_year_col = "lep_year_spec"
@@ -146,14 +143,14 @@ def make_student_table(url):
 
     else:
         # Request
-        rs = requests.get(url)
+        student_zip = fetch(url)
 
         # Unzip and save the file
         # Note that the file contains tables for various years. We keep all of them
         years = ["2014-15", "2015-16", "2016-17", "2017-18", "2018-19"]
 
         out_files = [
-            zipfile.ZipFile(io.BytesIO(rs.content)).extract(
+            zipfile.ZipFile(student_zip).extract(
                 f"table-13-({year}).csv", f"{project_dir}/data/raw/hesa/students/"
             )
             for year in years
@@ -12,6 +12,7 @@ import numpy as np
 
 from beis_indicators.utils.dir_file_management import *
 from beis_indicators.hesa.hesa_processing import *
+from beis_indicators.geo.university_reverse_geocode import uni_nuts_lookup
 
 project_dir = beis_indicators.project_dir
 
@@ -19,8 +20,7 @@ project_dir = beis_indicators.project_dir
 make_dirs('hebci',['raw','processed','interim'])
 
 #Read the uni-nuts lookup
-with open(f'{project_dir}/data/interim/uni_geos.json','r') as infile:
-    uni_nuts = json.load(infile)
+uni_nuts = uni_nuts_lookup(level=2)
 
 
 ################
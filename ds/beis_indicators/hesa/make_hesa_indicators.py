@@ -11,6 +11,7 @@ import json
 
 from beis_indicators.utils.dir_file_management import *
 from beis_indicators.hesa.hesa_processing import *
+from beis_indicators.geo.university_reverse_geocode import uni_geos as uni_region_geos
 
 project_dir = beis_indicators.project_dir
 
@@ -38,7 +39,7 @@ grad_short = graduates_all_years.loc[
     & (graduates_all_years['mode_of_study'] == 'Full-time')]
 
 for region_type in ['nuts2', 'nuts3', 'lep']:
-    uni_geos = pd.read_csv(f'{project_dir}/data/interim/hesa/uni_{region_type}_geos.csv')
+    uni_geos = uni_region_geos(region_type)
     
     #University space
     space_name_lookup = {
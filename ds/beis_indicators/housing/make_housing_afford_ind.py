@@ -1,7 +1,7 @@
 import pandas as pd
-import requests
 import os
 import beis_indicators
+from beis_indicators.data.download import fetch
 from beis_indicators.utils.dir_file_management import make_indicator,save_indicator
 
 
@@ -12,16 +12,16 @@ INTERIM_PATH = f"{PROJECT_DIR}/data/interim/ashe_mean_salary"
 
 # Get the LAD to NUTS lookup
 lad_nuts_lu = pd.read_csv(
-    "https://opendata.arcgis.com/datasets/9b4c94e915c844adb11e15a4b1e1294d_0.csv")
+    fetch("https://opendata.arcgis.com/datasets/9b4c94e915c844adb11e15a4b1e1294d_0.csv"))
 
 # # PART 1: Create mean salaries by NUTS
 #
 # Get mean LAD salaries from ASHE (Annual Survey of Hours and Earnings)
 lads_ashe = pd.read_csv(
-    "https://www.nomisweb.co.uk/api/v01/dataset/NM_30_1.data.csv?geography=1820327937...1820328307&date=latestMINUS9-latest&sex=8&item=4&pay=7&measures=20100,20701")
+    fetch("https://www.nomisweb.co.uk/api/v01/dataset/NM_30_1.data.csv?geography=1820327937...1820328307&date=latestMINUS9-latest&sex=8&item=4&pay=7&measures=20100,20701"))
 # Get employment levels
 lads_bres = pd.read_csv(
-    "https://www.nomisweb.co.uk/api/v01/dataset/NM_189_1.data.csv?geography=1820327937...1820328307&date=latest&industry=37748736&employment_status=2&measure=1&measures=20100")
+    fetch("https://www.nomisweb.co.uk/api/v01/dataset/NM_189_1.data.csv?geography=1820327937...1820328307&date=latest&industry=37748736&employment_status=2&measure=1&measures=20100"))
 
 # These are the variables we are interested in
 my_vars = ['DATE','GEOGRAPHY_NAME','GEOGRAPHY_CODE','OBS_VALUE']
@@ -74,7 +74,7 @@ nuts_look_nomis = pd.merge(
 
 # Download house pricing index data
 hpi = pd.read_csv(
-        'http://publicdata.landregistry.gov.uk/market-trend-data/house-price-index-data/UK-HPI-full-file-2020-03.csv?utm_medium=GOV.UK&utm_source=datadownload&utm_campaign=full_fil&utm_term=9.30_20_05_20')
+        fetch('http://publicdata.landregistry.gov.uk/market-trend-data/house-price-index-data/UK-HPI-full-file-2020-03.csv?utm_medium=GOV.UK&utm_source=datadownload&utm_campaign=full_fil&utm_term=9.30_20_05_20'))
 
 # We focus on these variables
 hpi_short = hpi[['Date','RegionName','AreaCode','AveragePrice','SalesVolume']]
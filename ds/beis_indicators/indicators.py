@@ -2,13 +2,18 @@ import logging
 import pandas as pd
 import numpy as np
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from scipy import sparse
 
 from beis_indicators import project_dir
+from beis_indicators.geo.grid import grid_cell_regions, gather_regions
 
 
 def points_to_indicator(data, value_col, coder, 
         aggfunc=np.mean, value_rename=None, projection=None, 
-        x_col='lon', y_col='lat', dp=2, fillna=0, astype=None):
+        x_col='lon', y_col='lat', dp=2, fillna=0, astype=None, grid=None,
+        n_jobs=1, level=None):
     """points_to_indicator
 
     Args
@@ -22,7 +27,8 @@ def points_to_indicator(data, value_col, coder,
             created the indicator.
         coder (Coder): A coder object
         aggfunc (function): Function used to aggregate points within a boundary.
-            Default is `np.mean`.
+            Default is `np.mean`. Must be picklable (not a lambda) if `n_jobs`
+            is more than 1.
         value_rename (str): Optional. If provided, then the value column will be
             renamed as this for the output indicator.
         projection (str): Geographic projection of the data. Projections might
@@ -36,6 +42,15 @@ def points_to_indicator(data, value_col, coder,
         fillna (str or int): A value to be used to fill in any missing data
             for regions in the final indicator. If None, then the region 
             will be present with a NaN value.
+        grid (str): Optional. Name of a fixed grid that the points lie on,
+            such as DEFRA's modelled 1km grid. If provided, each grid cell is
+            assigned to a region once and cached, and points are then
+            assigned by looking up their cell instead of a spatial join.
+        n_jobs (int): Number of processes to geocode boundary years in
+            parallel with. -1 uses all cores. Default is 1.
+        level (int): Optional. For hierarchical coders such as `NutsCoder`,
+            points are coded at the coder's level and the indicator is
+            created for the containing regions at this coarser level.
 
     Returns:
         indicator (pd.DataFrame): Final indicator dataframe with columns:
@@ -44,28 +59,239 @@ def points_to_indicator(data, value_col, coder,
             - <geography>_year_spec: specification year of the boundaries
             - <value_col> or <rename_value>: the indicator values
     """
-    geo_type = coder.GEOGRAPHY
-    year_spec_col = f'{geo_type}_year_spec'
-    id_col = f'{geo_type}_id'
-    year_spec_map = {year: coder.generate_year_spec(year) 
-            for year in data['year'].unique()}
-    data[year_spec_col] = data['year'].map(year_spec_map)
-    
+    if n_jobs != 1:
+        geo_type = coder.GEOGRAPHY
+        return points_to_indicators(data, value_col, {geo_type: coder},
+                aggfunc=aggfunc, value_rename=value_rename,
+                projection=projection, x_col=x_col, y_col=y_col, dp=dp,
+                fillna=fillna, astype=astype, grid=grid,
+                n_jobs=n_jobs, level=level)[geo_type]
+
+    _assign_year_spec(data, coder)
+    levels = None if level is None else [level]
+
+    # points spanning several boundary years are joined to all of them at
+    # once rather than once per year
+    year_spec_col = f'{coder.GEOGRAPHY}_year_spec'
+    if grid is None and data[year_spec_col].abs().nunique() > 1:
+        joined = _code_all_vintages(data, coder, projection, x_col, y_col)
+    else:
+        joined = None
+
     aggregated = []
     for year, group in data.groupby('year'):
-        year_spec = np.abs(group[year_spec_col].max())
-        joined = coder.code_points(
-                group[x_col], group[y_col], year_spec, projection, group)
-        agg_cols = [id_col, 'year', year_spec_col]
-        agg = (joined
+        if joined is None:
+            agg = _aggregate_group(coder, group, value_col, aggfunc,
+                    projection, x_col, y_col, grid, levels)
+        else:
+            agg = _aggregate_joined(joined[joined['year'] == year], coder,
+                    value_col, aggfunc, levels)
+        if levels is not None:
+            agg = agg[level]
+        aggregated.append(agg)
+    indicator = pd.concat(aggregated)
+
+    return _format_indicator(indicator, coder, value_col, value_rename,
+            dp, fillna, astype)
+
+
+def points_to_indicators(data, value_col, coders, aggfunc=np.mean,
+        value_rename=None, projection=None, x_col='lon', y_col='lat', dp=2,
+        fillna=0, astype=None, grid=None, n_jobs=1, hierarchy=False,
+        level=None):
+    """points_to_indicators
+    Creates an indicator for each of several coders from the same points.
+    Each combination of coder and boundary year is independent, so these
+    are spread over a pool of `n_jobs` processes. The coders are sent to
+    each process once when it starts, rather than with every task, and
+    each process keeps the spatial indexes it builds for later tasks.
+
+    Args
+        data (pd.DataFrame): Point data. See `points_to_indicator`.
+        value_col (str): Name of the column that has the values from which to
+            created the indicator.
+        coders (dict): Coder objects keyed by an output name, e.g.
+            `{'nuts2': NutsCoder(level=2), 'lep': LepCoder()}`.
+        n_jobs (int): Number of processes. -1 uses all cores. Default is 1.
+        hierarchy (bool): If True, coders whose regions nest within each
+            other (e.g. NUTS2 and NUTS3 coders) share a single spatial join
+            at the finest level, and coarser indicators are created by
+            rolling region IDs up to their parents.
+        aggfunc, value_rename, projection, x_col, y_col, dp, fillna, astype,
+        grid, level: See `points_to_indicator`.
+
+    Returns:
+        indicators (dict): Indicator dataframes keyed like `coders`.
+    """
+    plan = _plan_hierarchy(coders, hierarchy, level)
+
+    cols = [x_col, y_col, value_col, 'year']
+    tasks = []
+    for run in dict.fromkeys(run for run, _ in plan.values()):
+        coder = coders[run]
+        levels = [lvl for r, lvl in plan.values() if r == run]
+        levels = None if None in levels else levels
+        _assign_year_spec(data, coder)
+        year_spec_col = f'{coder.GEOGRAPHY}_year_spec'
+        for _, group in data.groupby(data[year_spec_col].abs()):
+            tasks.append((run, group[cols + [year_spec_col]],
+                          {'levels': levels}))
+
+    results = _run_tasks(_aggregate_group, tasks, coders, n_jobs,
+            value_col, aggfunc, projection, x_col, y_col, grid)
+
+    indicators = {}
+    for name, (run, lvl) in plan.items():
+        aggregated = [r if lvl is None else r[lvl]
+                      for (n, _, _), r in zip(tasks, results) if n == run]
+        indicators[name] = _format_indicator(pd.concat(aggregated),
+                coders[name], value_col, value_rename, dp, fillna, astype)
+    return indicators
+
+
+def _plan_hierarchy(coders, hierarchy, level=None):
+    """_plan_hierarchy
+    Decides which coder each output is geocoded with. Returns a dict of
+    output name to (name of the coder to run, level to roll up to). The
+    level is None where the coder's own regions are used.
+    """
+    if not hierarchy:
+        return {name: (name, level) for name in coders}
+
+    plan = {}
+    families = {}
+    for name, coder in coders.items():
+        key = coder.hierarchy_key()
+        if key is None:
+            plan[name] = (name, None)
+        else:
+            families.setdefault(key, []).append(name)
+    for names in families.values():
+        finest = max(names, key=lambda n: coders[n].level)
+        for name in names:
+            plan[name] = (finest, coders[name].level)
+    return {name: plan[name] for name in coders}
+
+
+# Coders held by each worker process, set once when the worker starts
+_WORKER_CODERS = {}
+
+
+def _init_worker(coders):
+    global _WORKER_CODERS
+    _WORKER_CODERS = coders
+
+
+def _in_worker(func, name, *args, **kwargs):
+    return func(_WORKER_CODERS[name], *args, **kwargs)
+
+
+def _run_tasks(func, tasks, coders, n_jobs, *args):
+    """_run_tasks
+    Runs `func(coder, group, *args, **kwargs)` for each
+    (coder name, group, kwargs) task, either serially or on a process pool,
+    and returns results in task order.
+    """
+    if n_jobs == 1:
+        return [func(coders[name], group, *args, **kwargs)
+                for name, group, kwargs in tasks]
+
+    # load the boundaries that are needed so they are sent with the coders
+    for name, group, _ in tasks:
+        coder = coders[name]
+        coder.shapes[np.abs(group[f'{coder.GEOGRAPHY}_year_spec'].max())]
+
+    n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+    with ProcessPoolExecutor(n_jobs, initializer=_init_worker,
+            initargs=(coders,)) as executor:
+        futures = [executor.submit(_in_worker, func, name, group, *args,
+                                   **kwargs)
+                   for name, group, kwargs in tasks]
+        return [f.result() for f in futures]
+
+
+def _aggregate_group(coder, group, value_col, aggfunc, projection, x_col,
+        y_col, grid, levels=None):
+    """_aggregate_group
+    Geocodes the points for one boundary year and aggregates them. If
+    `levels` is given, the points are aggregated to each of those levels of
+    the coder's hierarchy and a dict of level to aggregate is returned.
+    """
+    joined = _code_group(group, coder, projection, x_col, y_col, grid)
+    return _aggregate_joined(joined, coder, value_col, aggfunc, levels)
+
+
+def _aggregate_joined(joined, coder, value_col, aggfunc, levels=None):
+    """_aggregate_joined
+    Aggregates geocoded points by region. See `_aggregate_group`.
+    """
+    id_col = f'{coder.GEOGRAPHY}_id'
+    agg_cols = [id_col, 'year', f'{coder.GEOGRAPHY}_year_spec']
+    if levels is None:
+        return (joined
                 .groupby(agg_cols, as_index=False)[value_col]
                 .apply(aggfunc)
                 .reset_index())
-        aggregated.append(agg)
-    indicator = pd.concat(aggregated)
-    
+
+    joined = joined.dropna(subset=[id_col])
+    aggs = {}
+    for level in levels:
+        rolled = joined.assign(**{id_col: coder.parent_ids(
+                joined[id_col], level)})
+        aggs[level] = (rolled
+                .groupby(agg_cols, as_index=False)[value_col]
+                .apply(aggfunc)
+                .reset_index())
+    return aggs
+
+
+def _assign_year_spec(data, coder):
+    """_assign_year_spec
+    Adds the boundary specification year for each row's year to `data`.
+    """
+    year_spec_col = f'{coder.GEOGRAPHY}_year_spec'
+    data[year_spec_col] = coder.generate_year_spec(data['year'].values)
+
+
+def _code_all_vintages(data, coder, projection, x_col, y_col):
+    """_code_all_vintages
+    Assigns points from any number of years to the regions of their
+    boundary years with a single join over all of the boundary years.
+    """
+    id_col = f'{coder.GEOGRAPHY}_id'
+    year_specs = np.abs(data[f'{coder.GEOGRAPHY}_year_spec'].values)
+    point_idx, vintages, ids = coder.join_all_vintages(
+            data[x_col].values, data[y_col].values, projection,
+            np.unique(year_specs).tolist())
+    own_year = vintages == year_specs[point_idx]
+    return data.iloc[point_idx[own_year]].assign(**{id_col: ids[own_year]})
+
+
+def _code_group(group, coder, projection, x_col, y_col, grid=None):
+    """_code_group
+    Assigns the points for a single year to regions.
+    """
+    id_col = f'{coder.GEOGRAPHY}_id'
+    year_spec = np.abs(group[f'{coder.GEOGRAPHY}_year_spec'].max())
+    if grid is not None:
+        regions = grid_cell_regions(group[x_col], group[y_col], coder,
+                year_spec, projection, grid)
+        return group.assign(**{id_col: gather_regions(
+                group[x_col], group[y_col], regions)})
+    return coder.code_points(
+            group[x_col], group[y_col], year_spec, projection, group)
+
+
+def _format_indicator(indicator, coder, value_col, value_rename=None,
+        dp=2, fillna=0, astype=None):
+    """_format_indicator
+    Renames, orders and rounds aggregated values into the indicator format.
+    """
+    year_spec_col = f'{coder.GEOGRAPHY}_year_spec'
+    id_col = f'{coder.GEOGRAPHY}_id'
     if value_rename is not None:
-        indicator = indicator.rename(columns={0: value_rename})
+        indicator = indicator.rename(columns={0: value_rename,
+                                              value_col: value_rename})
         value_col = value_rename
     else:
         indicator = indicator.rename(columns={0:value_col})
@@ -74,12 +300,271 @@ def points_to_indicator(data, value_col, coder,
     indicator['year'] = indicator['year'].astype(int)
     indicator[year_spec_col] = indicator[year_spec_col].astype(int)
     if fillna is not None:
-        indicator[value_col].fillna(fillna, inplace=True)
+        indicator[value_col] = indicator[value_col].fillna(fillna)
     if dp is not None:
         indicator[value_col] = np.round(indicator[value_col], dp)
     if astype is not None:
         indicator[value_col] = indicator[value_col].astype(astype)
-    
+
+    return indicator
+
+
+STREAM_STATS = ['sum', 'count', 'min', 'max', 'mean', 'median']
+
+
+def _partial_group(coder, group, value_col, median_precision, projection,
+        x_col, y_col, grid):
+    """_partial_group
+    Geocodes the points for one year and partially aggregates them.
+    """
+    joined = _code_group(group, coder, projection, x_col, y_col, grid)
+    agg_cols = [f'{coder.GEOGRAPHY}_id', 'year',
+                f'{coder.GEOGRAPHY}_year_spec']
+    return _partial_aggregate(joined, agg_cols, value_col, median_precision)
+
+
+def _partial_aggregate(joined, agg_cols, value_col, median_precision=None):
+    """_partial_aggregate
+    Mergeable summaries of the values in each region. Alongside the sum,
+    count, min and max, if `median_precision` is given, values rounded to
+    that many decimal places are counted so that medians can be found after
+    merging.
+    """
+    joined = joined.dropna(subset=agg_cols + [value_col])
+    grouped = joined.groupby(agg_cols)[value_col]
+    partial = grouped.agg(['sum', 'count', 'min', 'max'])
+    counts = None
+    if median_precision is not None:
+        rounded = joined[value_col].round(median_precision).rename('value')
+        counts = joined[agg_cols].assign(value=rounded).value_counts()
+    return partial, counts
+
+
+def _merge_partials(a, b):
+    """_merge_partials
+    Combines two sets of partial aggregates from `_partial_aggregate`.
+    """
+    if a is None:
+        return b
+    partial = (pd.concat([a[0], b[0]])
+            .groupby(level=list(range(a[0].index.nlevels)))
+            .agg({'sum': 'sum', 'count': 'sum', 'min': 'min', 'max': 'max'}))
+    counts = None
+    if a[1] is not None:
+        counts = (pd.concat([a[1], b[1]])
+                .groupby(level=list(range(a[1].index.nlevels))).sum())
+    return partial, counts
+
+
+def _median_from_counts(counts):
+    """_median_from_counts
+    Finds the median of each group from counts of its (rounded) values.
+    """
+    groups = list(range(counts.index.nlevels - 1))
+    counts = counts.sort_index()
+    cum = counts.groupby(level=groups).cumsum()
+    total = counts.groupby(level=groups).transform('sum')
+    # the two middle ranks, which are equal when the count is odd
+    lower = cum >= (total + 1) // 2
+    upper = cum >= total // 2 + 1
+    values = pd.Series(counts.index.get_level_values(-1), index=counts.index)
+    lower = values[lower].groupby(level=groups).first()
+    upper = values[upper].groupby(level=groups).first()
+    return (lower + upper) / 2
+
+
+def _roll_up_partials(partials, coder, level):
+    """_roll_up_partials
+    Merges partial aggregates for regions into their parent regions at a
+    coarser level of the coder's hierarchy.
+    """
+    partial, counts = partials
+
+    def roll_up(df, agg):
+        index = df.index.to_frame(index=False)
+        index.iloc[:, 0] = coder.parent_ids(index.iloc[:, 0], level)
+        df = df.set_axis(pd.MultiIndex.from_frame(index), axis=0)
+        return df.groupby(level=list(range(df.index.nlevels))).agg(agg)
+
+    partial = roll_up(partial,
+            {'sum': 'sum', 'count': 'sum', 'min': 'min', 'max': 'max'})
+    if counts is not None:
+        counts = roll_up(counts, 'sum')
+    return partial, counts
+
+
+def _finalise_partials(partials, stat):
+    """_finalise_partials
+    Calculates a statistic for each group from merged partial aggregates.
+    """
+    partial, counts = partials
+    if stat == 'mean':
+        return partial['sum'] / partial['count']
+    if stat == 'median':
+        return _median_from_counts(counts)
+    return partial[stat]
+
+
+def stream_points_to_indicator(chunks, value_col, coder, stat='mean',
+        value_rename=None, projection=None, x_col='lon', y_col='lat', dp=2,
+        fillna=0, astype=None, grid=None, median_precision=2, n_jobs=1,
+        levels=None):
+    """stream_points_to_indicator
+    Streaming version of `points_to_indicator` for datasets that are too big
+    to hold in memory at once. Chunks of points are geocoded one at a time
+    and only running partial aggregates are kept for each region, year and
+    boundary year, so peak memory depends on chunk size rather than on the
+    size of the dataset.
+
+    Args
+        chunks (iter of pd.DataFrame): Chunks of point data, e.g. from
+            `pd.read_csv(..., chunksize=n)` or a generator over files. Each
+            chunk needs the same columns as the data for
+            `points_to_indicator`.
+        value_col (str): Name of the column that has the values from which to
+            created the indicator.
+        coder (Coder): A coder object
+        stat (str): Statistic to aggregate points within a boundary with. One
+            of `sum`, `count`, `min`, `max`, `mean` or `median`. Default is
+            `mean`.
+        median_precision (int): Decimal places that values are rounded to
+            when calculating medians. Medians are exact at this precision.
+        n_jobs (int): Number of processes to geocode chunks with. -1 uses
+            all cores. Default is 1.
+        levels (list of int): Optional. For hierarchical coders such as
+            `NutsCoder`, points are coded once at the coder's level and the
+            partial aggregates are rolled up to each of these levels.
+        value_rename, projection, x_col, y_col, dp, fillna, astype, grid:
+            See `points_to_indicator`.
+
+    Returns:
+        indicator (pd.DataFrame): Final indicator dataframe in the same
+            format as `points_to_indicator`. If `levels` is given, a dict of
+            level to indicator dataframe.
+    """
+    if stat not in STREAM_STATS:
+        raise ValueError(f"'stat' must be one of {STREAM_STATS}")
+    if stat != 'median':
+        median_precision = None
+
+    partials = None
+    if n_jobs == 1:
+        for chunk in chunks:
+            _assign_year_spec(chunk, coder)
+            for year, group in chunk.groupby('year'):
+                partial = _partial_group(coder, group, value_col,
+                        median_precision, projection, x_col, y_col, grid)
+                partials = _merge_partials(partials, partial)
+    else:
+        n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+        name = coder.GEOGRAPHY
+        with ProcessPoolExecutor(n_jobs, initializer=_init_worker,
+                initargs=({name: coder},)) as executor:
+            # bound the number of chunks in flight to keep memory bounded
+            pending = deque()
+            for chunk in chunks:
+                _assign_year_spec(chunk, coder)
+                for year, group in chunk.groupby('year'):
+                    pending.append(executor.submit(_in_worker,
+                            _partial_group, name, group, value_col,
+                            median_precision, projection, x_col, y_col,
+                            grid))
+                while len(pending) > 2 * n_jobs:
+                    partials = _merge_partials(partials,
+                            pending.popleft().result())
+            while pending:
+                partials = _merge_partials(partials,
+                        pending.popleft().result())
+
+    if levels is None:
+        return _partials_to_indicator(partials, coder, stat, value_col,
+                value_rename, dp, fillna, astype)
+    return {level: _partials_to_indicator(
+                _roll_up_partials(partials, coder, level), coder, stat,
+                value_col, value_rename, dp, fillna, astype)
+            for level in levels}
+
+
+def _partials_to_indicator(partials, coder, stat, value_col, value_rename,
+        dp, fillna, astype):
+    indicator = (_finalise_partials(partials, stat)
+            .rename(value_col)
+            .reset_index())
+    return _format_indicator(indicator, coder, value_col, value_rename,
+            dp, fillna, astype)
+
+
+def _spatial_weights(coder, year, kind, bandwidth=None):
+    """_spatial_weights
+    Spatial weights between the regions of a coder for a boundary year.
+    """
+    if kind in ('queen', 'rook'):
+        return coder.adjacency(year, kind)
+    if kind != 'distance':
+        raise ValueError("kind must be one of 'queen', 'rook' or "
+                         f"'distance', not {kind}")
+    ids, distances = coder.distances(year)
+    weights = np.divide(1, distances, out=np.zeros_like(distances),
+                        where=distances > 0)
+    if bandwidth is not None:
+        weights[distances > bandwidth] = 0
+    return ids, sparse.csr_matrix(weights)
+
+
+def spatial_lag(indicator, coder, kind='queen', value_cols=None,
+        bandwidth=None, suffix='_lag'):
+    """spatial_lag
+    Adds the spatial lag of an indicator's values: the weighted mean of the
+    values of each region's neighbours in the same year. Neighbours without
+    a value are ignored. All years and value columns for a boundary year
+    are lagged together in a single sparse matrix product.
+
+    Args:
+        indicator (pd.DataFrame): Indicator with `year`, `{geography}_id`
+            and `{geography}_year_spec` columns, as created by
+            `points_to_indicator`.
+        coder (Coder): Coder for the indicator's geography.
+        kind (str): Spatial weights. `queen` or `rook` for the mean of
+            adjacent regions, or `distance` for an inverse distance weighted
+            mean of all regions.
+        value_cols (list): Columns to lag. Defaults to all value columns.
+        bandwidth (float): For `distance` weights, the distance in metres
+            beyond which regions are ignored. Default is no limit.
+        suffix (str): Suffix of the lagged columns.
+
+    Returns:
+        indicator (pd.DataFrame): Indicator with lagged value columns.
+    """
+    id_col = f'{coder.GEOGRAPHY}_id'
+    year_spec_col = f'{coder.GEOGRAPHY}_year_spec'
+    if value_cols is None:
+        value_cols = [c for c in indicator.columns
+                      if c not in ['year', id_col, year_spec_col]]
+
+    indicator = indicator.copy()
+    lag_cols = [f'{c}{suffix}' for c in value_cols]
+    for col in lag_cols:
+        indicator[col] = np.nan
+
+    for year_spec, group in indicator.groupby(indicator[year_spec_col].abs()):
+        ids, weights = _spatial_weights(coder, year_spec, kind, bandwidth)
+        years = pd.Index(np.sort(group['year'].unique()))
+        rows = ids.get_indexer(group[id_col])
+        cols = years.get_indexer(group['year'])
+        coded = rows >= 0
+
+        values = np.full((len(ids), len(years), len(value_cols)), np.nan)
+        values[rows[coded], cols[coded]] = group[value_cols].values[coded]
+        values = values.reshape(len(ids), -1)
+
+        totals = weights @ np.nan_to_num(values)
+        norms = weights @ (~np.isnan(values)).astype(float)
+        lagged = np.divide(totals, norms, out=np.full_like(totals, np.nan),
+                           where=norms > 0)
+        lagged = lagged.reshape(len(ids), len(years), len(value_cols))
+
+        index = group.index[coded]
+        indicator.loc[index, lag_cols] = lagged[rows[coded], cols[coded]]
     return indicator
 
 
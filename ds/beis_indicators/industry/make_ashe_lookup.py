@@ -1,7 +1,6 @@
 ## Logging
 import logging
 import sys
-import requests
 from zipfile import ZipFile
 from io import BytesIO
 
@@ -19,6 +18,7 @@ import datetime
 
 import beis_indicators
 from beis_indicators.data import make_dataset
+from beis_indicators.data.download import fetch
 from beis_indicators.utils import dir_file_management
 
 project_dir = beis_indicators.project_dir
@@ -33,11 +33,11 @@ def get_ashe_data(path,ons_path):
     This will return a doanloaded and parsed file
     
     '''
-    file = requests.get(ons_path+path)
+    fin = fetch(ons_path+path)
     logger.info(path)
     
     #Create a zipfile with its content
-    z = ZipFile(BytesIO(file.content))
+    z = ZipFile(fin)
     
     #Extract names
     names = z.namelist()
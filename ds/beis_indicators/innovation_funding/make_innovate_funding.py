@@ -7,7 +7,7 @@ import beis_indicators
 from zipfile import ZipFile
 import io
 from beis_indicators.utils.dir_file_management import make_indicator, save_indicator
-from beis_indicators.geo.reverse_geocoder import reverse_geocode
+from beis_indicators.geo.postcodes import PostcodeCoder
 from beis_indicators.utils.dir_file_management import get_nuts_category
 
 
@@ -33,9 +33,8 @@ if os.path.exists(f"{project_dir}/data/raw/nspl")==False:
     nspl_zip = ZipFile(io.BytesIO(nspl.content))
     nspl_zip.extractall(nspl_target)  
 
-# Read NSPL data    
-nspl = pd.read_csv(f"{nspl_target}/Data/NSPL_FEB_2020_UK.csv",
-                  usecols=['pcds','lat','long'])
+# Load the NSPL postcode lookup
+postcode_coder = PostcodeCoder()
 
 # Download and process the Innovate UK data
 iuk = pd.read_excel(innovate_url)
@@ -50,22 +49,15 @@ iuk_recent = iuk_recent.loc[~iuk_recent['Project Status'].isin(
                                                     ['Withdrawn','On Hold'])]
 
 # These are all the innovate UK postcodes
-iuk_postcodes = set(iuk_recent['Postcode'])
-
-# Extract their lat, lon from nspl
-iuk_pcs = nspl.loc[nspl['pcds'].isin(iuk_postcodes)]
+iuk_postcodes = list(set(iuk_recent['Postcode']))
 
 # For each level in NUTS...
 for level in ['2','3']:
     logging.info("Making indicator level {level}")
 
-    # We do the reverse geocoding for all NUTS years in our interval (2010-2020)
-    iuk_geo_pc = pd.concat(
-                [reverse_geocode(iuk_pcs,f'nuts2_{str(y)}',
-                    shape_file=f'NUTS_RG_01M_{str(y)}_4326_LEVL_{level}.shp.zip',
-                    place_id='pcds',
-                    coord_names=['long','lat'])['NUTS_ID'] 
-                for y in [2010,2013,2016]],axis=1)
+    # We get the NUTS codes for all NUTS years in our interval (2010-2020)
+    iuk_geo_pc = postcode_coder.code_postcodes(iuk_postcodes,
+                    [f"nuts{level}_{str(y)}" for y in [2010,2013,2016]])
 
     iuk_geo_pc.columns = [f"nuts2_{str(y)}" for y in [2010,2013,2016]]
     
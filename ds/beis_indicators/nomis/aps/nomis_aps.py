@@ -1,28 +1,28 @@
 """
 """
-from io import StringIO
-import requests
 import os
 import logging
 
-import ratelim
 from numpy import arange, sum
-from pandas import concat, crosstab, melt, read_csv, read_excel
+from pandas import crosstab, melt, read_csv, read_excel
 from beis_indicators import project_dir
 
 
 import beis_indicators
+from beis_indicators.nomis.paging import CELL_LIMIT
+from beis_indicators.nomis.reader import read_nomis
+from beis_indicators.nomis.scheduler import run_tasks
 from beis_indicators.utils.pandas import preview
 
 logger = logging.getLogger(__name__)
-CELL_LIMIT = 25_000
-REQUESTS_PER_SECOND = 2
 
 
 
 def make_nomis(geo_type, year_l, project_dir=None):
     """ Make NOMIS BRES & IDBR datasets
 
+    Datasets are fetched concurrently, under the shared NOMIS rate limit.
+
     Args:
         geo_type (str): Geography type to consider.
             Options: 'lad' or 'ttwa'.
@@ -53,26 +53,12 @@ def make_nomis(geo_type, year_l, project_dir=None):
     elif geo_type == 'lep':
         types = [beis_indicators.config["data"]["aps"]["geography"]["lep"]]
 
-    for dataset in ["ECON_ACTIVE_NVQ_PRO", "ECON_ACTIVE_STEM_PRO", "STEM_DENSITY", "PRO_OCCS"]:
-        # print(nuts_year)
-        # for year in year_l:
-        for type in types:
-
-        # print(geo_type)
-  # for each year, just go through all of them
-            raw_fout = (
-                f"{project_dir}/data/raw/aps/aps_{dataset}_{type}.csv"
-            )
-            tidy_fout = (
-                f"{project_dir}/data/interim/aps/aps_{dataset}_{type}.csv"
-            )
-
-            # Fetch and save raw data if not present
-            if os.path.exists(raw_fout):
-                df = read_csv(raw_fout)
-            else:
-                df = get_nomis(dataset, type, year_l)
-                df.to_csv(raw_fout, index=False)
+    tasks = [
+        (dataset, type, tuple(year_l), project_dir)
+        for dataset in ["ECON_ACTIVE_NVQ_PRO", "ECON_ACTIVE_STEM_PRO", "STEM_DENSITY", "PRO_OCCS"]
+        for type in types
+    ]
+    run_tasks(tasks, _fetch_raw)
 
         # # Pivot to [Region x Sector] matrices
         # logger.info(f"Pivoting {dataset} for {year} and {geo_type}")
@@ -91,6 +77,19 @@ def make_nomis(geo_type, year_l, project_dir=None):
         # )
 
 
+def _fetch_raw(dataset, type, year_l, project_dir):
+    """ Fetch and save raw data if not present """
+    raw_fout = (
+        f"{project_dir}/data/raw/aps/aps_{dataset}_{type}.csv"
+    )
+    if os.path.exists(raw_fout):
+        return "cached"
+    df = get_nomis(dataset, type, year_l)
+    # Written under a temporary name so a partial file is never taken as cached
+    df.to_csv(f"{raw_fout}.part", index=False)
+    os.replace(f"{raw_fout}.part", raw_fout)
+
+
 def get_nomis(dataset, geo_type, year_list):
     """ Get BRES or IDBR datasets (SIC4) from NOMIS for given year and geography
 
@@ -267,7 +266,6 @@ def get_nomis(dataset, geo_type, year_list):
 #     lookup_table.to_csv(table_fout)
 
 
-@ratelim.patient(REQUESTS_PER_SECOND, time_interval=1)
 def query_nomis(link, offset_size=CELL_LIMIT):
     """ Query NOMIS api with ratelimiting and pagination
 
@@ -278,46 +276,7 @@ def query_nomis(link, offset_size=CELL_LIMIT):
     Returns:
         pandas.DataFrame
     """
-    logger.info(f"Getting: {link}")
-
-    df_container = []
-    offset = 0
-    first_page = True
-    records_left = 1  # dummy
-
-    # While the final record we will obtain is below the total number of records:
-    while records_left > 0:
-        # Modify the query link with the offset
-        query = link + "&recordoffset={off}".format(off=str(offset))
-
-        response = requests.get(query)
-
-        if response.status_code == 200:
-
-            if response.text == "":
-                raise ValueError(f"Empty response for query: {query}")
-
-            # Run query and store
-            df_container.append(read_csv(StringIO(response.text)))
-
-            # Update the offset (next time we will query from this point)
-            offset += offset_size
-
-            # Get number of records from first iteration
-            if first_page:
-                total_records = df_container[-1].RECORD_COUNT.values[0]
-                logger.info(f"{total_records} to download")
-                records_left = total_records
-                first_page = False
-
-            records_left -= offset_size
-            logger.info(f"{records_left} records left")
-
-        else:
-            continue
-
-    # Concatenate all the outputs
-    return concat(df_container)
+    return read_nomis(link, offset_size)
 
 
 
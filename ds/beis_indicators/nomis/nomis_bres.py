@@ -1,20 +1,18 @@
 """
 """
-from io import StringIO
-import requests
 import os
 import logging
 
-import ratelim
 from numpy import arange, sum
-from pandas import concat, crosstab, melt, read_csv, read_excel
+from pandas import crosstab, melt, read_csv, read_excel
 
 import beis_indicators
+from beis_indicators.nomis.paging import CELL_LIMIT
+from beis_indicators.nomis.reader import COUNT_DTYPES, read_nomis
+from beis_indicators.nomis.scheduler import run_tasks
 from beis_indicators.utils.pandas import preview
 
 logger = logging.getLogger(__name__)
-CELL_LIMIT = 25_000
-REQUESTS_PER_SECOND = 2
 
 
 def _zero_pad(x, column, width=4):
@@ -23,19 +21,55 @@ def _zero_pad(x, column, width=4):
     return x
 
 
-def make_nomis(geo_type, year_l, project_dir=None):
+def make_nomis(geo_type, year_l, project_dir=None, n_jobs=-1):
     """ Make NOMIS BRES & IDBR datasets
 
+    Datasets are fetched concurrently, under the shared NOMIS rate limit,
+    and each one is tidied on a process pool as soon as it has been fetched.
+
     Args:
         geo_type (str): Geography type to consider.
             Options: 'lad' or 'ttwa'.
         year_l (list[int]): Year of data to consider
         project_dir (str): Project path
+        n_jobs (int): Number of processes to tidy with. -1 uses every CPU.
     """
 
     if project_dir is None:
         project_dir = beis_indicators.project_dir
 
+    tasks = [
+        (dataset, geo_type, year, project_dir)
+        for dataset in ["BRES", "IDBR"]
+        for year in year_l
+    ]
+    run_tasks(tasks, _fetch_raw, _tidy_raw, n_jobs=n_jobs)
+
+
+def _nomis_files(dataset, geo_type, year, project_dir):
+    """Raw and tidy files of a dataset, year and geography"""
+    fname = f"nomis_{dataset}_{year}_{geo_type}.csv"
+    return (
+        f"{project_dir}/data/raw/industry/{fname}",
+        f"{project_dir}/data/interim/industry/{fname}",
+    )
+
+
+def _fetch_raw(dataset, geo_type, year, project_dir):
+    """Fetch and save raw data if not present"""
+    raw_fout, _ = _nomis_files(dataset, geo_type, year, project_dir)
+    if os.path.exists(raw_fout):
+        return "cached"
+    df = get_nomis(dataset, geo_type, year)
+    # Written under a temporary name so a partial file is never taken as cached
+    df.to_csv(f"{raw_fout}.part", index=False)
+    os.replace(f"{raw_fout}.part", raw_fout)
+
+
+def _tidy_raw(dataset, geo_type, year, project_dir):
+    """Clean raw data and enrich it with industrial segments"""
+    raw_fout, tidy_fout = _nomis_files(dataset, geo_type, year, project_dir)
+
     # SIC4 <-> Nesta segement lookup
     fin = f"{beis_indicators.project_dir}/data/raw/sic_4_industry_segment_lookup.csv"
     segments = (
@@ -45,40 +79,25 @@ def make_nomis(geo_type, year_l, project_dir=None):
         .pipe(preview)
     )
 
-    for dataset in ["BRES", "IDBR"]:
-        for year in year_l:
-            raw_fout = (
-                f"{project_dir}/data/raw/industry/nomis_{dataset}_{year}_{geo_type}.csv"
-            )
-            tidy_fout = (
-                f"{project_dir}/data/interim/industry/nomis_{dataset}_{year}_{geo_type}.csv"
-            )
-
-            # Fetch and save raw data if not present
-            if os.path.exists(raw_fout):
-                df = read_csv(raw_fout)
-            else:
-                df = get_nomis(dataset, geo_type, year)
-                df.to_csv(raw_fout, index=False)
-
-            # Pivot to [Region x Sector] matrices
-            logger.info(f"Pivoting {dataset} for {year} and {geo_type}")
-            (  # Clean and enrich with industrial segments
-                df.rename(
-                    columns={
-                        "DATE_NAME": "year",
-                        "INDUSTRY_NAME": "SIC4",
-                        "GEOGRAPHY_TYPE": "geo_type",
-                        "OBS_VALUE": "value",
-                    }
-                )
-                .drop(["OBS_STATUS_NAME", "RECORD_COUNT"], 1)
-                .assign(SIC4=lambda x: x["SIC4"].str.extract("([0-9]*)"))
-                .merge(segments, on="SIC4")  # Merge onto remapping
-                .pipe(preview)
-                .fillna(0)
-                .to_csv(tidy_fout)
-            )
+    # Pivot to [Region x Sector] matrices
+    logger.info(f"Pivoting {dataset} for {year} and {geo_type}")
+    (  # Clean and enrich with industrial segments
+        read_csv(raw_fout)
+        .rename(
+            columns={
+                "DATE_NAME": "year",
+                "INDUSTRY_NAME": "SIC4",
+                "GEOGRAPHY_TYPE": "geo_type",
+                "OBS_VALUE": "value",
+            }
+        )
+        .drop(["OBS_STATUS_NAME", "RECORD_COUNT"], 1)
+        .assign(SIC4=lambda x: x["SIC4"].str.extract("([0-9]*)"))
+        .merge(segments, on="SIC4")  # Merge onto remapping
+        .pipe(preview)
+        .fillna(0)
+        .to_csv(tidy_fout)
+    )
 
 
 def get_nomis(dataset, geo_type, year):
@@ -211,7 +230,6 @@ def make_lad_ttwa_map(project_dir):
     lookup_table.to_csv(table_fout)
 
 
-@ratelim.patient(REQUESTS_PER_SECOND, time_interval=1)
 def query_nomis(link, offset_size=CELL_LIMIT):
     """ Query NOMIS api with ratelimiting and pagination
 
@@ -222,41 +240,7 @@ def query_nomis(link, offset_size=CELL_LIMIT):
     Returns:
         pandas.DataFrame
     """
-    logger.info(f"Getting: {link}")
-
-    df_container = []
-    offset = 0
-    first_page = True
-    records_left = 1  # dummy
-
-    # While the final record we will obtain is below the total number of records:
-    while records_left > 0:
-        # Modify the query link with the offset
-        query = link + "&recordoffset={off}".format(off=str(offset))
-
-        response = requests.get(query)
-        response.raise_for_status()
-        if response.text == "":
-            raise ValueError(f"Empty response for query: {query}")
-
-        # Run query and store
-        df_container.append(read_csv(StringIO(response.text)))
-
-        # Update the offset (next time we will query from this point)
-        offset += offset_size
-
-        # Get number of records from first iteration
-        if first_page:
-            total_records = df_container[-1].RECORD_COUNT.values[0]
-            logger.info(f"{total_records} to download")
-            records_left = total_records
-            first_page = False
-
-        records_left -= offset_size
-        logger.info(f"{records_left} records left")
-
-    # Concatenate all the outputs
-    return concat(df_container)
+    return read_nomis(link, offset_size, dtypes=COUNT_DTYPES)
 
 
 def pivot_area_industry(df, sector, aggfunc=sum):
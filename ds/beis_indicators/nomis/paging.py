@@ -0,0 +1,163 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+import logging
+import threading
+import time
+
+import requests
+from pandas import read_csv
+from pandas.errors import EmptyDataError
+
+logger = logging.getLogger(__name__)
+CELL_LIMIT = 25_000
+REQUESTS_PER_SECOND = 2
+MAX_WORKERS = 4
+# Retries of a page after a connection error, 429 or server error
+RETRIES = 3
+
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter
+
+    Tokens are added at `rate` per second up to `capacity`, and each request
+    takes one, waiting for it if the bucket is empty. Short bursts up to
+    `capacity` are allowed but the long run rate never exceeds `rate`.
+
+    Args:
+        rate (float): Tokens added per second
+        capacity (int, optional): Maximum number of tokens. Defaults to `rate`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, blocking until one is available"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                added = (now - self._updated) * self.rate
+                self._tokens = min(self.capacity, self._tokens + added)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# Shared by every NOMIS request in the process so concurrent pages and
+# concurrent queries are limited together
+NOMIS_LIMITER = TokenBucket(REQUESTS_PER_SECOND)
+
+
+def read_page(response):
+    """Parse a NOMIS CSV response"""
+    return read_csv(StringIO(response.text))
+
+
+def _get_page(link, offset, session, limiter, parse):
+    query = link + "&recordoffset={off}".format(off=str(offset))
+    for attempt in range(RETRIES + 1):
+        limiter.acquire()
+        try:
+            with session.get(query, stream=True) as response:
+                response.raise_for_status()
+                return parse(response)
+        except EmptyDataError:
+            raise ValueError(f"Empty response for query: {query}")
+        except (requests.ConnectionError, requests.HTTPError) as e:
+            status = getattr(e.response, "status_code", None)
+            retry = status is None or status == 429 or status >= 500
+            if not retry or attempt == RETRIES:
+                raise
+            logger.warning(f"Retrying {query} after: {e}")
+            time.sleep(2 ** attempt)
+
+
+def iter_pages(
+    link,
+    offset_size=CELL_LIMIT,
+    parse=read_page,
+    max_workers=MAX_WORKERS,
+    limiter=None,
+    session=None,
+):
+    """Fetch every page of a NOMIS API query, yielding pages in offset order
+
+    The first page gives `RECORD_COUNT`, so the offsets of all remaining
+    pages are known up front. These are requested concurrently, each under
+    the shared rate limiter, and parsed as they arrive. Only pages that have
+    not been consumed yet are held in memory.
+
+    Args:
+        link (str): URL of NOMIS API query
+        offset_size (int): Size of pagination chunks
+        parse (function): Parses a response into a page. Defaults to a
+            `pandas.DataFrame`.
+        max_workers (int): Maximum number of pages requested at once
+        limiter (TokenBucket, optional): Rate limiter. Defaults to
+            `NOMIS_LIMITER`.
+        session (requests.Session, optional): Session to make requests with.
+
+    Yields:
+        tuple: Total number of records and a parsed page
+    """
+    limiter = NOMIS_LIMITER if limiter is None else limiter
+    session = requests if session is None else session
+    logger.info(f"Getting: {link}")
+
+    first = _get_page(link, 0, session, limiter, parse)
+    total_records = first.RECORD_COUNT.values[0] if len(first) > 0 else 0
+    logger.info(f"{total_records} to download")
+    yield total_records, first
+    del first
+
+    offsets = range(offset_size, total_records, offset_size)
+    n_left = len(offsets)
+    if n_left == 0:
+        return
+
+    with ThreadPoolExecutor(min(max_workers, n_left)) as executor:
+        # Only a window of pages is requested ahead of the consumer, which
+        # bounds the number of parsed pages waiting in memory
+        offsets = iter(offsets)
+        pending = deque()
+
+        def submit():
+            offset = next(offsets, None)
+            if offset is not None:
+                pending.append(
+                    executor.submit(
+                        _get_page, link, offset, session, limiter, parse
+                    )
+                )
+
+        for _ in range(2 * max_workers):
+            submit()
+        while pending:
+            page = pending.popleft().result()
+            submit()
+            n_left -= 1
+            logger.info(f"{n_left} pages left")
+            yield total_records, page
+
+
+def fetch_pages(link, offset_size=CELL_LIMIT, parse=read_page, **kwargs):
+    """Fetch every page of a NOMIS API query
+
+    Args:
+        link (str): URL of NOMIS API query
+        offset_size (int): Size of pagination chunks
+        parse (function): Parses a response into a page.
+        kwargs: Passed to `iter_pages`.
+
+    Returns:
+        list: Parsed pages in offset order
+    """
+    return [page for _, page in iter_pages(link, offset_size, parse, **kwargs)]
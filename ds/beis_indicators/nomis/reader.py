@@ -0,0 +1,170 @@
+import logging
+
+import numpy as np
+import pandas as pd
+from pandas import read_csv
+
+from beis_indicators.nomis.paging import CELL_LIMIT, MAX_WORKERS, iter_pages
+
+logger = logging.getLogger(__name__)
+
+# Columns that repeat a handful of values across every row are read as
+# categoricals. OBS_VALUE keeps full precision, as many datasets publish
+# rates and decimals.
+NOMIS_DTYPES = {
+    "GEOGRAPHY_CODE": "category",
+    "INDUSTRY_NAME": "category",
+    "DATE_NAME": "category",
+    "OBS_VALUE": "float64",
+}
+# For datasets of whole number counts, such as BRES and IDBR, OBS_VALUE can
+# be held as float32, which is exact below 2**24.
+COUNT_DTYPES = dict(NOMIS_DTYPES, OBS_VALUE="float32")
+
+
+def read_typed_page(response, dtypes=NOMIS_DTYPES, **kwargs):
+    """Parse a NOMIS CSV response straight from the response body
+
+    The body is streamed into the parser rather than decoded into a string
+    first, and columns are read with their declared dtypes.
+
+    Args:
+        response (requests.Response): Response opened with `stream=True`
+        dtypes (dict): Column dtypes. Columns missing from the page are
+            ignored.
+        kwargs: Passed to `pandas.read_csv`.
+
+    Returns:
+        pandas.DataFrame
+    """
+    response.raw.decode_content = True
+    return read_csv(response.raw, dtype=dtypes, **kwargs)
+
+
+class ColumnBuffer:
+    """Column-wise buffer that pages of a table are appended into
+
+    Each column is a preallocated array. Categorical columns are held as
+    integer codes into categories that are extended as new values appear, so
+    pages are copied once into the buffer and the table is never
+    concatenated.
+
+    Args:
+        size (int): Expected number of rows, e.g. `RECORD_COUNT`. The buffer
+            grows if more rows are appended.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.n_rows = 0
+        self.columns = None
+        self._arrays = {}
+        self._categories = {}
+
+    def _allocate(self, page):
+        self.columns = list(page.columns)
+        for col in self.columns:
+            dtype = page[col].dtype
+            if isinstance(dtype, pd.CategoricalDtype):
+                self._arrays[col] = np.full(self.size, -1, dtype=np.int32)
+                self._categories[col] = pd.Index(dtype.categories[:0])
+            elif isinstance(dtype, np.dtype):
+                self._arrays[col] = np.empty(self.size, dtype=dtype)
+            else:
+                self._arrays[col] = np.empty(self.size, dtype=object)
+
+    def _grow(self, n_rows):
+        size = max(n_rows, 2 * self.size)
+        logger.debug(f"Growing buffer from {self.size} to {size} rows")
+        for col, array in self._arrays.items():
+            fill = -1 if col in self._categories else 0
+            grown = np.full(size, fill, dtype=array.dtype)
+            grown[: self.n_rows] = array[: self.n_rows]
+            self._arrays[col] = grown
+        self.size = size
+
+    def _codes(self, col, values):
+        """Codes of a categorical page column in the buffer's categories"""
+        categories = self._categories[col]
+        new = values.cat.categories.difference(categories)
+        if len(new) > 0:
+            categories = categories.append(new)
+            self._categories[col] = categories
+        lookup = categories.get_indexer(values.cat.categories)
+        codes = values.cat.codes.to_numpy()
+        return np.where(codes < 0, -1, lookup[codes])
+
+    def append(self, page):
+        """Copy a page into the buffer
+
+        Args:
+            page (pandas.DataFrame): Page with the same columns as the first
+                page appended.
+        """
+        if self.columns is None:
+            self._allocate(page)
+        end = self.n_rows + len(page)
+        if end > self.size:
+            self._grow(end)
+
+        for col in self.columns:
+            values = page[col]
+            if col in self._categories:
+                values = self._codes(col, values)
+            else:
+                values = values.to_numpy()
+                array = self._arrays[col]
+                dtype = np.result_type(array.dtype, values.dtype)
+                if dtype != array.dtype:
+                    self._arrays[col] = array.astype(dtype)
+            self._arrays[col][self.n_rows : end] = values
+        self.n_rows = end
+
+    def to_frame(self):
+        """Returns the rows appended so far as a `pandas.DataFrame`"""
+        if self.columns is None:
+            return pd.DataFrame()
+        data = {}
+        for col in self.columns:
+            array = self._arrays[col][: self.n_rows]
+            if col in self._categories:
+                array = pd.Categorical.from_codes(array, self._categories[col])
+            data[col] = array
+        return pd.DataFrame(data, columns=self.columns, copy=False)
+
+
+def read_nomis(
+    link,
+    offset_size=CELL_LIMIT,
+    dtypes=NOMIS_DTYPES,
+    max_workers=MAX_WORKERS,
+    **kwargs,
+):
+    """Read every page of a NOMIS API query into a typed table
+
+    Pages are parsed with `read_typed_page` as they arrive and copied into a
+    `ColumnBuffer` sized from `RECORD_COUNT`, so the full table is only ever
+    held once.
+
+    Args:
+        link (str): URL of NOMIS API query
+        offset_size (int): Size of pagination chunks
+        dtypes (dict): Column dtypes, see `NOMIS_DTYPES`
+        max_workers (int): Maximum number of pages requested at once
+        kwargs: Passed to `beis_indicators.nomis.paging.iter_pages`.
+
+    Returns:
+        pandas.DataFrame
+    """
+    buffer = None
+    for total_records, page in iter_pages(
+        link,
+        offset_size,
+        parse=lambda response: read_typed_page(response, dtypes),
+        max_workers=max_workers,
+        **kwargs,
+    ):
+        if buffer is None:
+            buffer = ColumnBuffer(max(total_records, len(page)))
+        buffer.append(page)
+    return buffer.to_frame()
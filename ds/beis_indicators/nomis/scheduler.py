@@ -0,0 +1,111 @@
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+import logging
+import multiprocessing
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Datasets fetched at once. Every request still goes through the shared
+# NOMIS rate limiter, so this only sets how many queries can be in flight.
+FETCH_WORKERS = 4
+
+
+def _label(task):
+    """Task arguments for the log, leaving out paths"""
+    return " ".join(str(arg) for arg in task
+                    if not (isinstance(arg, str) and os.sep in arg))
+
+
+def _timed(func, task):
+    start = time.monotonic()
+    status = func(*task)
+    return status, time.monotonic() - start
+
+
+def run_tasks(tasks, fetch, tidy=None, fetch_workers=FETCH_WORKERS,
+              n_jobs=-1):
+    """Fetch and tidy NOMIS datasets concurrently
+
+    Each task is fetched on a thread pool, as fetching is network bound and
+    rate limited across the whole process, and is tidied on a process pool
+    as soon as its fetch finishes. Fetch and tidy functions read and write
+    their own files, so outputs don't depend on the order tasks finish in.
+
+    A failed task doesn't stop the others. Failures are raised together once
+    every task has finished.
+
+    Args:
+        tasks (list[tuple]): Arguments of each task
+        fetch (function): Called with a task's arguments to download its
+            data. May return a status such as `"cached"` for the log.
+        tidy (function, optional): Called with a task's arguments once it
+            has been fetched. Must be picklable, and importable by spawned
+            workers, unless `n_jobs` is 1.
+        fetch_workers (int): Number of tasks fetched at once
+        n_jobs (int): Number of tidy processes. -1 uses every CPU and 1 tidies
+            in this process.
+
+    Returns:
+        dict: Status of each task
+
+    Raises:
+        RuntimeError: If any task failed.
+    """
+    tasks = list(tasks)
+    status = {task: "pending" for task in tasks}
+    n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+
+    def report(task, message):
+        status[task] = message
+        n_done = sum(s in ("done", "failed") for s in status.values())
+        logger.info(f"[{n_done}/{len(tasks)}] {_label(task)}: {message}")
+
+    fetch_pool = ThreadPoolExecutor(fetch_workers)
+    tidy_pool = None
+    if tidy and n_jobs != 1:
+        # Forking while fetch threads hold locks can deadlock the workers,
+        # so they are started fresh instead
+        tidy_pool = ProcessPoolExecutor(
+                n_jobs, mp_context=multiprocessing.get_context("spawn"))
+    failures = {}
+    try:
+        pending = {fetch_pool.submit(_timed, fetch, task): ("fetch", task)
+                   for task in tasks}
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, task = pending.pop(future)
+                try:
+                    result, elapsed = future.result()
+                except Exception as e:
+                    failures[task] = e
+                    report(task, "failed")
+                    logger.exception(f"{stage} failed for {_label(task)}: {e}")
+                    continue
+
+                if stage == "tidy" or tidy is None:
+                    report(task, "done")
+                    continue
+
+                report(task, f"{result or 'fetched'} in {elapsed:.1f}s")
+                if tidy_pool is None:
+                    tidy_future = fetch_pool.submit(_timed, tidy, task)
+                else:
+                    tidy_future = tidy_pool.submit(_timed, tidy, task)
+                pending[tidy_future] = ("tidy", task)
+    finally:
+        fetch_pool.shutdown()
+        if tidy_pool is not None:
+            tidy_pool.shutdown()
+
+    if failures:
+        failed = ", ".join(_label(task) for task in failures)
+        raise RuntimeError(
+                f"{len(failures)} of {len(tasks)} tasks failed: {failed}")
+    return status
@@ -14,6 +14,7 @@ from ast import literal_eval
 from data_getters.labs.core import download_file
 
 import beis_indicators
+from beis_indicators.data.download import fetch
 from beis_indicators.utils.dir_file_management import *
 project_dir = beis_indicators.project_dir
 
@@ -132,7 +133,7 @@ def unfold_field(pat_item,variable,year_var):
 #0. Metadata
 #########
 
-nuts = pd.read_csv('https://opendata.arcgis.com/datasets/d266cbe2179a4766b4de7c6e73b4a285_0.csv')
+nuts = pd.read_csv(fetch('https://opendata.arcgis.com/datasets/d266cbe2179a4766b4de7c6e73b4a285_0.csv'))
 
 #This is a NUTS 2 lookup FOR 2015 (ie 2013 in EU terms)
 nuts_2_code_name_lookup = nuts.drop_duplicates('NUTS215CD').set_index(
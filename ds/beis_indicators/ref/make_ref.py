@@ -1,8 +1,10 @@
 # Import our repo as a module
 import beis_indicators
+from beis_indicators.data.download import fetch
 from beis_indicators.utils.dir_file_management import *
 from beis_indicators.geo.reverse_geocoder import *
 from beis_indicators.hesa.hesa_processing import *
+from beis_indicators.geo.university_reverse_geocode import uni_nuts_lookup
 
 ## Logging
 import logging
@@ -26,9 +28,8 @@ target_path = os.path.join(data_path,'processed','ref')
 #Make directory (if needed)
 make_dirs('ref')
 
-#Load NUTS json
-with open(f"{project_dir}/data/interim/uni_geos.json",'r') as infile:
-    unis_geos = json.load(infile)
+#Load the uni-nuts lookup
+unis_geos = uni_nuts_lookup(level=2)
 
 #Load STEM discipline names
 with open(f'{project_dir}/data/aux/stem_ref.txt','r') as infile:
@@ -41,7 +42,7 @@ with open(f'{project_dir}/data/aux/stem_ref.txt','r') as infile:
 #Read HEFCE data
 REF_URL = 'https://results.ref.ac.uk/(S(hlvnuqzwkag44jp3df3d4q14))/DownloadFile/AllResults/xlsx'
 
-ref = pd.read_excel(REF_URL,skiprows=7,na_values='-')
+ref = pd.read_excel(fetch(REF_URL),skiprows=7,na_values='-')
 ref.columns = [re.sub(' ','_',col.lower()) for col in ref.columns]
 
 #Focus on variables of interest
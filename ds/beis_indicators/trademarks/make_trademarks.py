@@ -10,6 +10,7 @@ import logging
 
 import beis_indicators
 from beis_indicators.geo.reverse_geocoder import *
+from beis_indicators.geo.postcodes import PostcodeCoder
 from beis_indicators.utils.dir_file_management import *
 
 # Create logger
@@ -93,7 +94,7 @@ def get_trademarks(url):
 
     return text_df
 
-def geocode_trademarks(df, geo_code=['long','lat']):
+def geocode_trademarks(df, geo_code=['long','lat'], coder=None):
     """
     This function reverse geocodes a trademark df using the postcode of the applicant.
     It returns the lat and lon for each trademark
@@ -101,57 +102,28 @@ def geocode_trademarks(df, geo_code=['long','lat']):
     Args:
         df (df) is a dataframe with organisation postcodes
         geo_code (str) is the geocode in the NSPL database that we want to use
+        coder (PostcodeCoder) is the NSPL lookup. A new one is loaded if None
     """
+    coder = PostcodeCoder() if coder is None else coder
     df_c = df.copy()
     # We have trailing spaces in the postcodes
     
     df_c["postcode"] = [
         x.strip() if pd.isnull(x) is False else np.nan for x in df_c['postcode']]
 
-    # Read nspl
-    nspl = pd.read_csv(f"{DATA_RAW}/nspl/Data/NSPL_FEB_2020_UK.csv") 
-
     # The trademark dataset only provides information for the first part of the postcode
-    # We split the nspl postcodes to merge on a smaller dataset
-    nspl["pcds_1st"] = nspl["pcds"].apply(lambda x: x.split(" ")[0])
-
-    nspl_short = nspl.drop_duplicates("pcds_1st")[["pcds_1st"]+geo_code]
+    # so we look up the outward codes in the NSPL extract
+    nspl_short = coder.code_outward(
+        df_c["postcode"].dropna().unique(), geo_code)
+    nspl_short = nspl_short.dropna(how="all").rename_axis("pcds_1st").reset_index()
 
     merged = pd.merge(df_c, nspl_short, left_on="postcode", right_on="pcds_1st")
 
     return merged
 
-def make_reverse_geocode_lookup(df,nuts_years=[2010,2013,2016],coords=['long','lat']):
-    '''
-    Function to create a map between geography and various nuts taxonomies
-
-    Args:
-        df (df) is the df with lat,lons that we want to reverse geocode
-        nuts_years (list) are the nuts years that we want to consider
-        coords (str) are the coordinate variable names
-
-    '''
-    container = []
-
-    for y in nuts_years:
-
-        rev = reverse_geocode(place_df=df,
-                              shape_name=f'nuts2_{str(y)}',
-                              shape_file=f'NUTS_RG_01M_{str(y)}_4326_LEVL_2.shp.zip',
-                              place_id = 'pcds_1st',
-                              coord_names=coords)['NUTS_ID']
-        container.append(rev)
-
-    all_nuts = pd.concat(container,axis=1)
-
-    all_nuts.columns = [f'nuts2_{str(y)}' for y in nuts_years]
-
-    all_nuts_map = all_nuts.to_dict(orient='index')
-
-    return(all_nuts_map)
-
 def reverse_geocode_trademarks(df,tm_year = 'published',
-                               tm_threshold=2010,method='time_consistent'):
+                               tm_threshold=2010,method='time_consistent',
+                               coder=None):
     '''
     This function takes the df with lats and lons and labels with NUTS based 
     on their publication year
@@ -163,7 +135,9 @@ def reverse_geocode_trademarks(df,tm_year = 'published',
         method (str) is whether we are creating the indicator using a time 
         consistent approach 
             (each year in its NUTS category) or using the latest nuts
+        coder (PostcodeCoder) is the NSPL lookup. A new one is loaded if None
     '''
+    coder = PostcodeCoder() if coder is None else coder
     df_2 = df.copy()
 
     #Drop missing years
@@ -180,8 +154,11 @@ def reverse_geocode_trademarks(df,tm_year = 'published',
     
     pc_lookup = df_2.drop_duplicates('pcds_1st')[['pcds_1st','long','lat']]
 
-    #We create a reverse geocoding lookup
-    pc_nuts_map = make_reverse_geocode_lookup(pc_lookup,nuts_years=[2010,2013,2016])
+    #We create a reverse geocoding lookup. NSPL gives us the latest NUTS
+    #directly and earlier versions are joined from the postcode coordinates
+    pc_nuts_map = coder.code_outward(
+        pc_lookup['pcds_1st'].values,
+        [f'nuts2_{str(y)}' for y in [2010,2013,2016]]).to_dict(orient='index')
 
     if method == 'time_consistent':
         df_2['nuts_code'] = [pc_nuts_map[row['pcds_1st']][get_nuts_category(
@@ -219,11 +196,14 @@ def make_trademarks(URL,detailed_classes):
     logger.info("Downloading the data")
     tm_df = get_trademarks(URL)
 
+    # The NSPL lookup is loaded once and shared by both geocoding steps
+    coder = PostcodeCoder()
+
     logger.info("Geocoding the data")
-    tm_df_geo = geocode_trademarks(tm_df)
+    tm_df_geo = geocode_trademarks(tm_df, coder=coder)
 
     logger.info("Reverse geocoding the data")
-    tm_df_nuts = reverse_geocode_trademarks(tm_df_geo)
+    tm_df_nuts = reverse_geocode_trademarks(tm_df_geo, coder=coder)
 
     for x in tm_df_nuts.columns:
         if "class" in x:
@@ -12,6 +12,7 @@ from beis_indicators import project_dir
 from beis_indicators.utils.dir_file_management import save_indicator
 from beis_indicators.utils import chunks, camel_to_snake
 from beis_indicators.geo import NutsCoder, LepCoder
+from beis_indicators.geo.centroids import area_centroids
 from beis_indicators.indicators import points_to_indicator, save_indicator
 
 logger = logging.getLogger(__name__)
@@ -30,6 +31,15 @@ LSOA_SHAPEFILES = {
 
 }
 
+# Shapefile extracted from each of the LSOA_SHAPEFILES archives, and its
+# LSOA code column
+LSOA_SHAPE_MEMBERS = {
+    2001: (f'{project_dir}/data/raw/travel/lsoa_latlon_2001/Lower_Layer_Super_Output_Areas__December_2001__Boundaries_EW_BFC.shp', 'LSOA01CD'),
+    2011: (f'{project_dir}/data/raw/travel/lsoa_latlon_2011/Lower_Layer_Super_Output_Areas__December_2011__Boundaries_EW_BFC_v3.shp', 'LSOA11CD'),
+}
+# LSOA boundaries used by each year of travel times
+TRAVEL_LSOA_YEARS = {2011: 2001, 2013: 2011}
+
 MYDIR = (f'{project_dir}/data/raw/travel')
 CHECK_FOLDER = os.path.isdir(MYDIR)
 
@@ -134,40 +144,23 @@ def retrieve_shape_files():
         with ZipFile(shp_file, 'r') as zip_ref:
             zip_ref.extractall(f'{project_dir}/data/raw/travel/lsoa_latlon_{year}')
 
-def read_shp_files():
-
-    lsoa_shp_01 = gpd.read_file(f'{project_dir}/data/raw/travel/lsoa_latlon_2001/Lower_Layer_Super_Output_Areas__December_2001__Boundaries_EW_BFC.shp')
-    lsoa_shp_11 = gpd.read_file(f'{project_dir}/data/raw/travel/lsoa_latlon_2011/Lower_Layer_Super_Output_Areas__December_2011__Boundaries_EW_BFC_v3.shp')
-
-    lsoa_shp_geo_01 = lsoa_shp_01.to_crs(epsg=4326)
-    lsoa_shp_geo_11 = lsoa_shp_11.to_crs(epsg=4326)
-
-
-    lsoa_shp_geo_01['lon'] = lsoa_shp_geo_01.geometry.apply(lambda i: i.centroid.x)
-    lsoa_shp_geo_01['lat'] = lsoa_shp_geo_01.geometry.apply(lambda i: i.centroid.y)
-
-    lsoa_shp_geo_11['lon'] = lsoa_shp_geo_11.geometry.apply(lambda i: i.centroid.x)
-    lsoa_shp_geo_11['lat'] = lsoa_shp_geo_11.geometry.apply(lambda i: i.centroid.y)
-
-    lsoa_shp_geo_re_01 = lsoa_shp_geo_01.rename(columns={'LSOA01CD':'LSOA_code'})
-    lsoa_shp_geo_re_11 = lsoa_shp_geo_11.rename(columns={'LSOA11CD':'LSOA_code'})
-
-    geo_dict = {2001: lsoa_shp_geo_re_01, 2011: lsoa_shp_geo_re_11}
-
-    return geo_dict
-
+def lsoa_centroids(year):
+    """lsoa_centroids
+    Centroids of the LSOAs for a boundary vintage (2001 or 2011), indexed
+    by `LSOA_code`.
+    """
+    shape_file, code_col = LSOA_SHAPE_MEMBERS[year]
+    centroids = area_centroids('lsoa', year, shape_file, code_col)
+    return centroids.rename_axis('LSOA_code')
 
 
 def lsoa_to_latlon(data, year):
-    if year == 2011:
-        lsoa_shp_geo_re_01 = read_shp_files()[2001]
-        data = data.merge(lsoa_shp_geo_re_01, on='LSOA_code', how='left')
-        data = data[['LSOA_code', 'RepTime', 'Percentage Services', 'uid', 'NearOrder', 'lon', 'lat']]
-
-    elif year == 2013:
-        lsoa_shp_geo_re_11 = read_shp_files()[2011]
-        data = data.merge(lsoa_shp_geo_re_11, on='LSOA_code', how='left')
-        data = data[['LSOA_code', 'RepTime', 'Percentage Services', 'uid', 'NearOrder', 'lon', 'lat']]
+    if year not in TRAVEL_LSOA_YEARS:
+        raise ValueError(f'No LSOA boundaries for {year} travel times. '
+                         f'Supported years: {sorted(TRAVEL_LSOA_YEARS)}')
+    boundary_year = TRAVEL_LSOA_YEARS[year]
+    data = data.join(lsoa_centroids(boundary_year), on='LSOA_code')
+    data = data[['LSOA_code', 'RepTime', 'Percentage Services', 'uid', 'NearOrder', 'lon', 'lat']]
 
     return data
 
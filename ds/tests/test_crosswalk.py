@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+
+from beis_indicators.geo.crosswalk import Crosswalk
+
+
+def test_intensive_convert_ignores_missing_sources():
+    crosswalk = Crosswalk.from_pairs(['a', 'b', 'b'], ['X', 'X', 'Y'])
+    values = pd.Series({'a': np.nan, 'b': 10.0})
+
+    converted = crosswalk.convert(values, extensive=False)
+
+    assert converted['X'] == 10.0
+    assert converted['Y'] == 10.0
+
+
+def test_intensive_convert_is_nan_without_sources():
+    crosswalk = Crosswalk.from_pairs(['a', 'b'], ['X', 'Y'])
+    values = pd.DataFrame({'v': [np.nan, 4.0], 'w': [2.0, np.nan]},
+                          index=['a', 'b'])
+
+    converted = crosswalk.convert(values, extensive=False)
+
+    assert converted.loc['X', 'w'] == 2.0
+    assert np.isnan(converted.loc['X', 'v'])
+    assert converted.loc['Y', 'v'] == 4.0
+    assert np.isnan(converted.loc['Y', 'w'])
+
+
+def test_extensive_convert_splits_totals():
+    crosswalk = Crosswalk.from_pairs(['a', 'b', 'b'], ['X', 'X', 'Y'])
+    values = pd.Series({'a': np.nan, 'b': 10.0})
+
+    converted = crosswalk.convert(values, extensive=True)
+
+    assert converted['X'] == 5.0
+    assert converted['Y'] == 5.0
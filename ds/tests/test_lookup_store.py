@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+from beis_indicators.geo.lookup_store import GeoLookupStore, NO_REGION
+
+
+def test_concurrent_saves_keep_each_others_rows(tmp_path):
+    first, second = GeoLookupStore(tmp_path), GeoLookupStore(tmp_path)
+    first_keys = first.keys([0.1, 0.2], [51.0, 52.0])
+    second_keys = second.keys([0.3], [53.0])
+
+    first.update(pd.DataFrame({'nuts': ['UKI3', np.nan]}, index=first_keys))
+    second.update(pd.DataFrame({'nuts': ['UKM7']}, index=second_keys))
+    first.save()
+    second.save()
+
+    found = GeoLookupStore(tmp_path).lookup(first_keys.append(second_keys),
+                                            ['nuts', 'lep'])
+    assert list(found['nuts']) == ['UKI3', NO_REGION, 'UKM7']
+    assert found['lep'].isnull().all()
+
+
+def test_later_saves_take_precedence(tmp_path):
+    store = GeoLookupStore(tmp_path)
+    keys = store.keys([0.1], [51.0])
+    store.update(pd.DataFrame({'nuts': ['UKI3']}, index=keys))
+    store.save()
+
+    store = GeoLookupStore(tmp_path)
+    store.update(pd.DataFrame({'nuts': ['UKI4']}, index=keys))
+    store.save()
+
+    assert GeoLookupStore(tmp_path).lookup(keys, ['nuts']).iloc[0, 0] == 'UKI4'
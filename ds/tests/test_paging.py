@@ -0,0 +1,151 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+from beis_indicators.nomis import paging
+from beis_indicators.nomis.paging import TokenBucket, fetch_pages, iter_pages
+
+PAGE_SIZE = 10
+N_RECORDS = 95
+
+
+class CountingBucket(TokenBucket):
+    def __init__(self):
+        super().__init__(rate=1000, capacity=1000)
+        self.n_acquired = 0
+        self._count_lock = threading.Lock()
+
+    def acquire(self):
+        with self._count_lock:
+            self.n_acquired += 1
+        super().acquire()
+
+
+@pytest.fixture
+def nomis_stub():
+    '''A NOMIS-like CSV API on localhost. `failures` maps an offset to the
+    statuses returned before the page is served.'''
+    state = SimpleNamespace(requested=[], failures={}, in_flight=0,
+                            max_in_flight=0, lock=threading.Lock(), delay=0)
+    state.arrived = threading.Condition(state.lock)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            offset = int(query['recordoffset'][0])
+            with state.lock:
+                state.requested.append(offset)
+                state.arrived.notify_all()
+                state.in_flight += 1
+                state.max_in_flight = max(state.max_in_flight,
+                                          state.in_flight)
+                failures = state.failures.get(offset, [])
+                status = failures.pop(0) if failures else 200
+            try:
+                time.sleep(state.delay)
+                if status != 200:
+                    self.send_error(status)
+                    return
+                rows = range(offset, min(offset + PAGE_SIZE, N_RECORDS))
+                body = 'RECORD_COUNT,RECORD_OFFSET\n' + ''.join(
+                        f'{N_RECORDS},{i}\n' for i in rows)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/csv')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body.encode('utf-8'))
+            finally:
+                with state.lock:
+                    state.in_flight -= 1
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever,
+                              args=(0.05,), daemon=True)
+    thread.start()
+    state.link = f'http://127.0.0.1:{server.server_port}/data.csv?x=1'
+    try:
+        yield state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def backoffs(monkeypatch):
+    '''Records retry backoffs instead of sleeping'''
+    sleeps = []
+    monkeypatch.setattr(paging, 'time', SimpleNamespace(
+            sleep=sleeps.append, monotonic=time.monotonic))
+    return sleeps
+
+
+def test_pages_are_yielded_in_offset_order(nomis_stub):
+    nomis_stub.delay = 0.01
+    limiter = CountingBucket()
+    with requests.Session() as session:
+        pages = fetch_pages(nomis_stub.link, PAGE_SIZE, max_workers=4,
+                            limiter=limiter, session=session)
+
+    records = [i for page in pages for i in page.RECORD_OFFSET]
+    assert records == list(range(N_RECORDS))
+    assert sorted(nomis_stub.requested) == list(range(0, N_RECORDS,
+                                                      PAGE_SIZE))
+    assert limiter.n_acquired == len(nomis_stub.requested)
+    assert nomis_stub.max_in_flight <= 4
+
+
+@pytest.mark.parametrize('status', [429, 500, 503])
+def test_pages_are_retried(nomis_stub, backoffs, status):
+    nomis_stub.failures = {0: [status], 30: [status, status]}
+    with requests.Session() as session:
+        pages = fetch_pages(nomis_stub.link, PAGE_SIZE, max_workers=2,
+                            limiter=CountingBucket(), session=session)
+
+    records = [i for page in pages for i in page.RECORD_OFFSET]
+    assert records == list(range(N_RECORDS))
+    assert nomis_stub.requested.count(0) == 2
+    assert nomis_stub.requested.count(30) == 3
+    assert sorted(backoffs) == [1, 1, 2]
+
+
+def test_client_errors_are_not_retried(nomis_stub, backoffs):
+    nomis_stub.failures = {20: [404]}
+    with requests.Session() as session:
+        with pytest.raises(requests.HTTPError):
+            fetch_pages(nomis_stub.link, PAGE_SIZE, max_workers=2,
+                        limiter=CountingBucket(), session=session)
+
+    assert nomis_stub.requested.count(20) == 1
+    assert backoffs == []
+
+
+def test_pages_are_only_requested_a_window_ahead(nomis_stub):
+    max_workers = 2
+    with requests.Session() as session:
+        pages = iter_pages(nomis_stub.link, PAGE_SIZE,
+                           max_workers=max_workers,
+                           limiter=CountingBucket(), session=session)
+        next(pages)
+        next(pages)
+        # the first page, the window, and the page submitted when the
+        # second page was taken from the window
+        expected = 2 + 2 * max_workers
+        with nomis_stub.arrived:
+            assert nomis_stub.arrived.wait_for(
+                    lambda: len(nomis_stub.requested) >= expected,
+                    timeout=10)
+            # nothing more is requested until the consumer takes a page
+            assert not nomis_stub.arrived.wait_for(
+                    lambda: len(nomis_stub.requested) > expected,
+                    timeout=0.2)
+        remaining = list(pages)
+
+    assert len(remaining) == N_RECORDS // PAGE_SIZE - 1
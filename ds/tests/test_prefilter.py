@@ -0,0 +1,52 @@
+import numpy as np
+import shapely
+from shapely import STRtree
+
+from beis_indicators.geo.prefilter import PrefilteredTree, verify_prefilter
+
+
+def _tessellation(n_cells, seed):
+    '''Irregular polygons tiling the unit square, sharing their edges'''
+    rng = np.random.default_rng(seed)
+    seeds = shapely.multipoints(rng.random((n_cells, 2)))
+    cells = shapely.get_parts(shapely.voronoi_polygons(seeds))
+    cells = shapely.intersection(cells, shapely.box(0, 0, 1, 1))
+    return cells[~shapely.is_empty(cells)]
+
+
+def _exact(geoms, points):
+    exact = STRtree(geoms).query(points, predicate='within')
+    return exact[:, np.lexsort((exact[1], exact[0]))]
+
+
+def test_verify_prefilter_on_tessellation():
+    geoms = _tessellation(50, seed=0)
+
+    assert verify_prefilter(geoms, n_points=5000, tolerance=0.01) == 10000
+
+
+def test_verify_prefilter_with_overlapping_groups():
+    old, new = _tessellation(30, seed=1), _tessellation(40, seed=2)
+    geoms = np.concatenate([old, new])
+    groups = np.repeat([2016, 2021], [len(old), len(new)])
+
+    verify_prefilter(geoms, n_points=5000, tolerance=0.01, groups=groups)
+
+
+def test_points_near_interior_edges_match_exact_join():
+    geoms = _tessellation(20, seed=3)
+    tree = PrefilteredTree(geoms, tolerance=0.02)
+    assert len(tree.interiors) > 0
+
+    # points either side of the buffered and simplified interiors' edges
+    edges = shapely.boundary(tree.interiors)
+    t = np.linspace(0, 1, 200, endpoint=False)
+    on_edges = shapely.line_interpolate_point(
+            np.repeat(edges, len(t)), np.tile(t, len(edges)),
+            normalized=True)
+    x, y = shapely.get_coordinates(on_edges).T
+    offsets = np.array([-1e-6, 0, 1e-6])
+    points = shapely.points(np.add.outer(offsets, x).ravel(),
+                            np.add.outer(offsets, y).ravel())
+
+    assert np.array_equal(tree.query(points), _exact(geoms, points))